@@ -8,12 +8,16 @@ import os
 import subprocess
 import time
 import threading
-import requests
-from huggingface_hub import hf_hub_download
+
+from metrics import start_metrics_server
+from model_downloader import download_models
+from process_supervisor import ProcessSupervisor, ProcessExitedError, http_probe
 
 class ComfyUISetup:
     def __init__(self):
         self.comfyui_process = None
+        self.supervisor = None
+        self.time_to_ready = None
         self.setup_comfyui()
     
     def setup_comfyui(self):
@@ -66,56 +70,9 @@ class ComfyUISetup:
         print("Downloading custom models...")
         
         try:
-            # Download checkpoint
-            checkpoint_path = hf_hub_download(
-                repo_id="skas12/illustrious-test1",
-                filename="realismIllustriousBy_v50FP16.safetensors",
-                local_dir="comfyui/models/checkpoints"
-            )
-            print(f"Checkpoint downloaded: {checkpoint_path}")
-            
-            # Download LoRAs
-            loras = [
-                "Pony Realism Slider.safetensors",
-                "RealSkin_slider.safetensors", 
-                "insta baddie PN.safetensors",
-                "Real_Beauty.safetensors",
-                "Pony_DetailV2.0.safetensors",
-                "perfect ass sliderV1.safetensors",
-                "Detail_Tweaker_Illustrious_BSY_V3.safetensors"
-            ]
-            
-            for lora in loras:
-                try:
-                    lora_path = hf_hub_download(
-                        repo_id="skas12/illustrious-test1",
-                        filename=lora,
-                        local_dir="comfyui/models/loras"
-                    )
-                    print(f"LoRA downloaded: {lora}")
-                except Exception as e:
-                    print(f"Failed to download {lora}: {e}")
-            
-            # Download embeddings
-            embeddings = [
-                "Stable_Yogis_Realism_Positives_V1.safetensors",
-                "Stable_Yogis_Anatomy_Negatives_V1-neg.safetensors",
-                "Stable_Yogis_General_Negatives_V1-neg.safetensors",
-                "Stable_Yogis_Realism_Negatives_V1-neg.safetensors"
-            ]
-            
-            for embedding in embeddings:
-                try:
-                    embedding_path = hf_hub_download(
-                        repo_id="skas12/illustrious-test1",
-                        filename=embedding,
-                        local_dir="comfyui/models/embeddings"
-                    )
-                    print(f"Embedding downloaded: {embedding}")
-                except Exception as e:
-                    print(f"Failed to download {embedding}: {e}")
-            
-            print("All models downloaded successfully!")
+            results = download_models("comfyui/models")
+            if not any(results.values()):
+                print("All models downloaded successfully!")
             
         except Exception as e:
             print(f"Error downloading models: {e}")
@@ -125,34 +82,36 @@ class ComfyUISetup:
         print("Starting ComfyUI server...")
         
         try:
+            from cpu_profile import CpuProfile
+            cpu = CpuProfile.from_env()
+            
             # Start ComfyUI server
             cmd = [
                 "python", "comfyui/main.py", 
                 "--listen", "0.0.0.0", 
                 "--port", "7860",  # Use 7860 for Hugging Face Spaces
                 "--cpu"  # Use CPU for Hugging Face Spaces
-            ]
-            
-            self.comfyui_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
+            ] + cpu.comfyui_args()  # bf16 on CPUs that compute it natively
             
-            # Wait for server to start
-            for i in range(30):  # Wait up to 30 seconds
-                try:
-                    response = requests.get("http://127.0.0.1:7860", timeout=1)
-                    if response.status_code == 200:
-                        print("ComfyUI server started successfully!")
-                        print("Access ComfyUI at: http://127.0.0.1:7860")
-                        return True
-                except:
-                    time.sleep(1)
+            print(f"Starting ComfyUI on CPU: {cpu.describe()}")
+            self.supervisor = ProcessSupervisor(cmd, name="ComfyUI", stage="comfyui_startup", env=cpu.environ())
+            self.comfyui_process = self.supervisor.start()
             
-            print("ComfyUI server started (may take a moment to be ready)")
+            # Probe with backoff, failing fast if the process dies
+            self.time_to_ready = self.supervisor.wait_until_ready(
+                http_probe("http://127.0.0.1:7860"), timeout=120
+            )
+            print(f"ComfyUI server started successfully in {self.time_to_ready:.2f}s!")
+            print("Access ComfyUI at: http://127.0.0.1:7860")
             return True
             
+        except ProcessExitedError as e:
+            print(f"ComfyUI server crashed during startup: {e}")
+            return False
+        except TimeoutError as e:
+            # Left running, it may still come up, but nothing has confirmed that it serves
+            print(f"ComfyUI server not ready, startup unconfirmed: {e}")
+            return False
         except Exception as e:
             print(f"Error starting ComfyUI: {e}")
             return False
@@ -160,13 +119,18 @@ class ComfyUISetup:
 # Initialize ComfyUI setup
 if __name__ == "__main__":
     print("Starting ComfyUI setup...")
+    # METRICS_PORT exposes /metrics, including the ComfyUI time to ready, for scraping
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
     comfyui_setup = ComfyUISetup()
     
     # Keep the process running
     try:
-        while True:
+        while comfyui_setup.supervisor is None or comfyui_setup.supervisor.is_alive():
             time.sleep(1)
+        print(f"ComfyUI exited with code {comfyui_setup.supervisor.poll()}:")
+        print(comfyui_setup.supervisor.tail())
     except KeyboardInterrupt:
         print("Shutting down ComfyUI...")
-        if comfyui_setup.comfyui_process:
-            comfyui_setup.comfyui_process.terminate()
\ No newline at end of file
+        if comfyui_setup.supervisor:
+            comfyui_setup.supervisor.stop()
\ No newline at end of file
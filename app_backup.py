@@ -3,16 +3,48 @@ import torch
 from diffusers import StableDiffusionXLPipeline
 from huggingface_hub import hf_hub_download
 import tempfile
+import time
 import os
 
+from prompt_cache import PromptEmbeddingCache
+from lora_manager import LoraManager, manifest_weights
+from model_manifest import CHECKPOINT, EMBEDDINGS, LORAS, REPO_ID, REVISION
+from textual_inversion import EmbeddingTable
+from image_output import OutputDirectory, OutputFormat, OutputPool, encode_image
+from generation_metadata import generation_record
+from memory_mode import MemoryManager
+from cpu_profile import CpuProfile
+from job_scheduler import JobScheduler, QueueFullError, INTERACTIVE
+from step_progress import run_with_progress, GenerationCancelled
+from metrics import REQUESTS, observe_stage, launch_with_metrics
+import asyncio
+
+# Preview every Nth step, 0 disables previews
+PREVIEW_EVERY = int(os.environ.get("PREVIEW_EVERY", "2"))
+# OUTPUT_FORMAT, OUTPUT_QUALITY and OUTPUT_COMPRESS_LEVEL pick the file format of final images
+OUTPUT_FORMAT = OutputFormat.from_env()
+OUTPUTS = OutputDirectory()
+
 class PonyGenerator:
     def __init__(self):
         self.pipe = None
+        self.loras = None
+        self.memory = None
+        self.cpu = None
+        self.adapter_key = ()
+        self.embeddings = EmbeddingTable()
+        self.prompt_cache = PromptEmbeddingCache()
+        self.encoder = OutputPool()
         self.load_model()
     
     def load_model(self):
         """Load the custom pony model with Hugging Face Hub integration"""
         print("🦄 Loading custom pony model...")
+        start = time.perf_counter()
+        
+        # CPUs cannot compute in float16, so without a GPU the CPU profile picks the weights' dtype
+        self.cpu = None if torch.cuda.is_available() else CpuProfile.from_env()
+        dtype = torch.float16 if self.cpu is None else self.cpu.dtype
         
         try:
             # Method 1: Try direct Hugging Face Hub download first
@@ -24,7 +56,7 @@ class PonyGenerator:
                 )
                 self.pipe = StableDiffusionXLPipeline.from_single_file(
                     checkpoint_path,
-                    torch_dtype=torch.float16,
+                    torch_dtype=dtype,
                     use_safetensors=True
                 )
                 print("✅ Checkpoint loaded from Hugging Face Hub!")
@@ -34,40 +66,46 @@ class PonyGenerator:
                 print("🔄 Trying to load as HF repository...")
                 self.pipe = StableDiffusionXLPipeline.from_pretrained(
                     "skas12/illustrious-test1",
-                    torch_dtype=torch.float16,
+                    torch_dtype=dtype,
                     use_safetensors=True,
                     variant="fp16"
                 )
                 print("✅ Checkpoint loaded as HF repository!")
             
-            # Load the LoRA
-            print("📥 Loading Pony Realism Slider LoRA...")
-            try:
-                # Try downloading LoRA from Hugging Face Hub
-                lora_path = hf_hub_download(
-                    repo_id="skas12/illustrious-test1",
-                    filename="Pony Realism Slider.safetensors"
-                )
-                self.pipe.load_lora_weights(lora_path, adapter_name="pony_realism")
-            except Exception as lora_error:
-                print(f"❌ LoRA download failed: {lora_error}")
-                # Fallback: try loading as HF repository
-                self.pipe.load_lora_weights(
-                    "skas12/illustrious-test1", 
-                    weight_name="Pony Realism Slider.safetensors",
-                    adapter_name="pony_realism"
-                )
+            # Every manifest LoRA becomes a named adapter so requests can pick their own weights
+            print(f"📥 Loading {len(LORAS)} LoRAs from the manifest...")
+            self.loras = LoraManager(self.pipe)
+            self.loras.load_manifest(lambda entry: hf_hub_download(
+                repo_id=REPO_ID,
+                filename=entry.filename,
+                revision=REVISION
+            ))
+            print("✅ LoRAs loaded successfully!")
             
-            self.pipe.set_adapters(["pony_realism"], adapter_weights=[1.0])
-            print("✅ LoRA loaded successfully!")
+            # Textual inversions go into both tokenizers and text encoders once
+            print(f"📥 Loading {len(EMBEDDINGS)} embeddings from the manifest...")
+            self.embeddings.load_manifest(self.pipe, lambda entry: hf_hub_download(
+                repo_id=REPO_ID,
+                filename=entry.filename,
+                revision=REVISION
+            ))
+            print(f"✅ Embeddings loaded: {', '.join(self.embeddings.vectors)}")
             
-            # Move to GPU if available
+            # Move to GPU if available, model by model (CPU offload) when the weights would not fit next to a request
+            self.memory = MemoryManager(self.pipe)
             if torch.cuda.is_available():
-                self.pipe = self.pipe.to("cuda")
-                print("🚀 Custom pony model loaded on GPU")
+                print(f"🚀 Custom pony model loaded on GPU ({self.memory.place('cuda')}, memory mode {self.memory.mode})")
             else:
-                print("💻 Custom pony model loaded on CPU")
+                self.memory.place("cpu")
+                self.cpu.apply(self.pipe)
+                print(f"💻 Custom pony model loaded on CPU ({self.cpu.describe()}, memory mode {self.memory.mode})")
             
+            # Fuse on the target device so the merge runs there
+            self.adapter_key = self.loras.activate(manifest_weights())
+            self.prompt_cache.clear()
+            print(f"✅ LoRA active: {self.loras.stats()}")
+            
+            observe_stage("model_load", time.perf_counter() - start)
             print("🦄 Your custom pony model loaded successfully!")
             
         except Exception as e:
@@ -75,13 +113,42 @@ class PonyGenerator:
             print("🚨 CUSTOM MODEL IS REQUIRED - NO FALLBACK TO BASE SDXL!")
             raise Exception(f"Failed to load custom model: {e}")
 
-    def generate_image(self, prompt, negative_prompt, width, height, steps, guidance_scale, seed):
-        """Generate pony image with custom model"""
+    def generate_image(self, prompt, negative_prompt, width, height, steps, guidance_scale, seed,
+                       lora_weights=None, previews=True, cancel_token=None):
+        """Generate pony image with custom model
+        
+        lora_weights are per manifest LoRA in manifest order (None for the
+        defaults). Yields (preview, status) after every denoising step and
+        returns a Future of (image path, message), resolved once the output
+        pool has written the file; the pipeline is free for the next request
+        as soon as the image is decoded. Errors are yielded as (None, message).
+        Closing the generator or setting cancel_token stops the denoising loop.
+        """
         if self.pipe is None:
-            return None, "❌ Model not loaded properly"
+            yield None, "❌ Model not loaded properly"
+            return
         
         try:
             print(f"🎨 Generating pony image with prompt: {prompt}")
+            params = {
+                "checkpoint": CHECKPOINT.filename,
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "seed": seed,
+                "width": width,
+                "height": height,
+                "steps": steps,
+                "guidance_scale": guidance_scale,
+            }
+            
+            prompt = self.embeddings.resolve(prompt)
+            negative_prompt = self.embeddings.resolve(negative_prompt)
+            
+            # Recently used LoRA mixes are restored from cache instead of re-fused
+            started = time.perf_counter()
+            self.adapter_key = self.loras.activate(manifest_weights(lora_weights))
+            timings = {"lora_switch_s": time.perf_counter() - started}
+            params["loras"] = dict(self.adapter_key)
             
             # Set seed if provided
             if seed is not None:
@@ -90,34 +157,136 @@ class PonyGenerator:
             else:
                 generator = None
             
-            # Generate image
-            with torch.autocast("cuda" if torch.cuda.is_available() else "cpu"):
-                result = self.pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    width=width,
-                    height=height,
-                    num_inference_steps=steps,
-                    guidance_scale=guidance_scale,
-                    generator=generator
-                )
+            # Decode tiling and attention slicing only when this resolution would not fit otherwise
+            memory_plan = self.memory.prepare(width, height)
+            params["memory"] = {"level": memory_plan.level, "offload": memory_plan.offload}
             
-            print("✅ Image generated successfully!")
-            return result.images[0], "🦄 Image generated successfully!"
+            # Generate image on a helper thread so every step can be reported
+            def run(callback):
+                autocast = self.cpu.autocast() if self.cpu is not None else torch.autocast("cuda" if torch.cuda.is_available() else "cpu")
+                with self.memory.track() as memory, autocast:
+                    started = time.perf_counter()
+                    embeds = self.prompt_cache.encode(self.pipe, prompt, negative_prompt, adapter_key=self.adapter_key,
+                                                      embeddings_key=self.embeddings.key)
+                    timings["text_encode_s"] = time.perf_counter() - started
+                    callback.start()
+                    result = self.pipe(
+                        **embeds,
+                        width=width,
+                        height=height,
+                        num_inference_steps=steps,
+                        guidance_scale=guidance_scale,
+                        generator=generator,
+                        callback_on_step_end=callback,
+                        output_type="np"
+                    )
+                    timings["vae_decode_s"] = callback.since_last_step()
+                    observe_stage("vae_decode", timings["vae_decode_s"])
+                    timings.update(callback.timings())
+                params["memory"].update(memory)
+                return result
             
+            preview = None
+            updates = run_with_progress(run, steps, cancel_token=cancel_token,
+                                        preview_every=PREVIEW_EVERY if previews else 0)
+            try:
+                while True:
+                    try:
+                        update = next(updates)
+                    except StopIteration as done:
+                        result = done.value
+                        break
+                    if update.previews:
+                        preview = update.previews[0]
+                    yield preview, f"🎨 Step {update.step}/{update.total} ({update.step_time * 1000:.0f} ms/step)"
+            finally:
+                # Stops the denoising loop if we are closed early
+                updates.close()
+            
+            print(f"🧠 Memory: {memory_plan.describe()}, peak {params['memory']['peak_memory_mb']:.0f} MiB")
+            
+            # Encoded once on the output pool; Gradio serves the file as is
+            return self.encoder.submit(self.save_output, result.images[0], generation_record("diffusers", params, timings))
+            
+        except GenerationCancelled as e:
+            print(f"🛑 {e}")
+            REQUESTS.labels(outcome="cancelled").inc()
+            yield None, "🛑 Generation cancelled"
         except Exception as e:
             print(f"❌ Error generating image: {e}")
+            REQUESTS.labels(outcome="error").inc()
+            yield None, f"❌ Error: {str(e)}"
+
+    @staticmethod
+    def save_output(frame, record):
+        """Encode, write and hash a decoded frame with its generation record (runs on the output pool)"""
+        try:
+            output = encode_image(frame, OUTPUT_FORMAT, OUTPUTS.directory, record)
+        except Exception as e:
+            print(f"❌ Error writing image: {e}")
+            REQUESTS.labels(outcome="error").inc()
             return None, f"❌ Error: {str(e)}"
+        OUTPUTS.track(output.path)
+        print(f"✅ Image generated successfully! ({output.size // 1024} KiB, sha256 {output.sha256[:16]})")
+        REQUESTS.labels(outcome="generated").inc()
+        return output.path, "🦄 Image generated successfully!"
 
-# Initialize the model
-try:
-    pony_gen = PonyGenerator()
-    model_loaded = True
-    model_error = None
-except Exception as e:
+# Initialize the model (PONY_SKIP_MODEL_LOAD=1 lets benchmarks import this module and bring their own pipeline)
+if os.environ.get("PONY_SKIP_MODEL_LOAD") == "1":
     pony_gen = None
     model_loaded = False
-    model_error = str(e)
+    model_error = "Model loading skipped (PONY_SKIP_MODEL_LOAD=1)"
+else:
+    try:
+        pony_gen = PonyGenerator()
+        model_loaded = True
+        model_error = None
+    except Exception as e:
+        pony_gen = None
+        model_loaded = False
+        model_error = str(e)
+
+# One pipeline, one worker: the scheduler queues, prioritises and sheds in front of it
+scheduler = JobScheduler(
+    workers=1,
+    max_queue=int(os.environ.get("GENERATION_MAX_QUEUE", "16")),
+    name="Diffusers"
+)
+
+async def generate(request: gr.Request, prompt, negative_prompt, width, height, steps, guidance_scale, seed, *lora_weights):
+    """Queue a generation and stream queue position, then step progress, until it finishes"""
+    try:
+        job = scheduler.submit(
+            pony_gen.generate_image,
+            prompt, negative_prompt, width, height, steps, guidance_scale, seed, list(lora_weights),
+            client_id=getattr(request, "session_hash", None) or "anonymous",
+            priority=INTERACTIVE,
+            # Unseeded requests each want their own random image, so only seeded ones are coalesced
+            key=None if seed is None else (prompt, negative_prompt, width, height, steps, guidance_scale, seed, lora_weights)
+        )
+    except QueueFullError as e:
+        yield None, f"🚦 Server busy: {e}. Please try again shortly."
+        return
+    
+    future = asyncio.wrap_future(job.future)
+    shown, last_position = None, None
+    try:
+        while not job.done():
+            position = job.position()
+            if position and position != last_position:
+                yield None, f"⏳ Queued: position {position}"
+            elif not position and job.progress is not None and job.progress is not shown:
+                shown = job.progress
+                yield shown
+            last_position = position
+            await asyncio.wait({future}, timeout=0.25)
+        yield await future
+    except QueueFullError as e:
+        yield None, f"🚦 Server busy: {e}"
+    finally:
+        # Abandoned jobs stop at the end of the current denoising step
+        if not job.done():
+            scheduler.cancel(job)
 
 # Create Gradio interface
 def create_interface():
@@ -131,7 +300,7 @@ def create_interface():
             The custom model failed to load. Please check:
             1. Your Hugging Face repository `skas12/illustrious-test1` exists
             2. The checkpoint file `realismIllustriousBy_v50FP16.safetensors` is available
-            3. The LoRA file `Pony Realism Slider.safetensors` is available
+            3. The LoRA files listed in `model_manifest.py` are available
             
             **NO FALLBACK TO BASE SDXL - CUSTOM MODEL REQUIRED!**
             """)
@@ -141,7 +310,7 @@ def create_interface():
             
             Generate beautiful pony images using your custom CivitAI models:
             - **Base Model**: Realism Illustrious
-            - **LoRA**: Pony Realism Slider
+            - **LoRAs**: Pony Realism Slider and the rest of the manifest, weighted per image
             
             Powered by Hugging Face Spaces! 🚀
             """)
@@ -160,6 +329,12 @@ def create_interface():
                         value="blurry, low quality, distorted, bad anatomy, nsfw"
                     )
                     
+                    # LoRA weight controls, 0 disables a LoRA
+                    lora_controls = [
+                        gr.Slider(-5.0, 5.0, weight, step=0.01, label=f"🎚️ {entry.name}")
+                        for entry, weight in zip(LORAS, manifest_weights().values())
+                    ]
+                    
                     with gr.Row():
                         width = gr.Slider(512, 1536, 1024, step=64, label="📐 Width")
                         height = gr.Slider(512, 1536, 1024, step=64, label="📐 Height")
@@ -169,18 +344,22 @@ def create_interface():
                         guidance_scale = gr.Slider(1.0, 20.0, 7.5, step=0.1, label="🎛️ Guidance Scale")
                         seed = gr.Number(label="🌱 Seed (optional)", precision=0)
                     
-                    generate_btn = gr.Button("🦄 Generate Pony", variant="primary", size="lg")
+                    with gr.Row():
+                        generate_btn = gr.Button("🦄 Generate Pony", variant="primary", size="lg")
+                        cancel_btn = gr.Button("🛑 Cancel", variant="stop", size="lg")
                     
                 with gr.Column():
-                    output_image = gr.Image(label="🖼️ Generated Image", type="pil")
+                    output_image = gr.Image(label="🖼️ Generated Image", type="filepath")
                     status = gr.Textbox(label="📊 Status", interactive=False)
             
             # Event handlers
-            generate_btn.click(
-                fn=pony_gen.generate_image,
-                inputs=[prompt, negative_prompt, width, height, steps, guidance_scale, seed],
-                outputs=[output_image, status]
+            generate_event = generate_btn.click(
+                fn=generate,
+                inputs=[prompt, negative_prompt, width, height, steps, guidance_scale, seed] + lora_controls,
+                outputs=[output_image, status],
+                concurrency_limit=None  # admission control happens in the scheduler
             )
+            cancel_btn.click(fn=None, cancels=[generate_event])
             
             # Example prompts
             gr.Examples(
@@ -198,4 +377,5 @@ def create_interface():
 # Launch the interface
 if __name__ == "__main__":
     demo = create_interface()
-    demo.launch()
+    # Gradio UI at / and Prometheus metrics at /metrics
+    launch_with_metrics(demo)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+CPU inference benchmark: the float16 + torch.autocast("cpu") path against the CPU profile's settings
+Usage: python -m bench.cpu --variants current,fp32,bf16,bf16-cl,bf16-cl-compile --resolutions 256x256 --steps 4
+
+Every variant runs the same tiny randomly-initialised SDXL (same weights)
+on this machine. Latencies, per-step time and the largest pixel difference
+to the float32 output are printed (or written with --output) as JSON.
+"""
+
+import argparse
+import json
+import sys
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from bench.e2e import environment, parse_resolutions
+from bench.stats import peak_rss_mb, summarize
+from cpu_profile import CpuProfile, cpu_flags, native_bf16, physical_cores
+
+PROMPT = "a pony with a rainbow mane, high quality, detailed"
+NEGATIVE_PROMPT = "blurry, low quality"
+GUIDANCE_SCALE = 7.0
+
+# name -> (weights dtype, autocast, channels-last, compile)
+VARIANTS = {
+    "current": (torch.float16, True, False, False),
+    "fp32-autocast": (torch.float32, True, False, False),
+    "fp32": (torch.float32, False, False, False),
+    "fp32-cl": (torch.float32, False, True, False),
+    "bf16": (torch.bfloat16, False, False, False),
+    "bf16-cl": (torch.bfloat16, False, True, False),
+    "bf16-cl-compile": (torch.bfloat16, False, True, True),
+}
+
+
+def build(variant: str, seed: int, threads: int, interop_threads: int):
+    from bench.tiny_sdxl import build_tiny_sdxl
+
+    dtype, autocast, channels_last, compile = VARIANTS[variant]
+    pipe = build_tiny_sdxl(seed=seed)
+    profile = CpuProfile(dtype, threads, interop_threads, channels_last=channels_last, compile=compile)
+    profile.apply(pipe)
+    return pipe, (lambda: torch.autocast("cpu")) if autocast else nullcontext
+
+
+def generate(pipe, context, width: int, height: int, steps: int, seed: int) -> np.ndarray:
+    with context():
+        return pipe(
+            prompt=PROMPT,
+            negative_prompt=NEGATIVE_PROMPT,
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+            guidance_scale=GUIDANCE_SCALE,
+            generator=torch.Generator().manual_seed(seed),
+            output_type="np"
+        ).images
+
+
+def run_variant(variant: str, width: int, height: int, steps: int, requests: int, seed: int,
+                threads: int, interop_threads: int, reference: Optional[np.ndarray]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"variant": variant, "width": width, "height": height, "steps": steps}
+    pipe, context = build(variant, seed, threads, interop_threads)
+    try:
+        # The first request pays for oneDNN primitive creation, and compilation for the compile variant
+        start = time.perf_counter()
+        images = generate(pipe, context, width, height, steps, seed)
+        result["first_request_s"] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        started = time.perf_counter()
+        images = generate(pipe, context, width, height, steps, seed)
+        latencies.append(time.perf_counter() - started)
+    result.update(summarize(latencies, time.perf_counter() - start))
+    result["ms_per_step"] = round(result["p50_ms"] / steps, 2)
+    if reference is not None:
+        result["max_abs_diff_vs_fp32"] = round(float(np.abs(images - reference).max()), 5)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", default="current,fp32-autocast,fp32,fp32-cl,bf16,bf16-cl",
+                        help=f"comma-separated, from {', '.join(VARIANTS)}")
+    parser.add_argument("--resolutions", default="256x256", help="comma-separated WxH")
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=3, help="timed requests per variant")
+    parser.add_argument("--threads", type=int, default=physical_cores())
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    variants = [name.strip() for name in args.variants.split(",") if name.strip()]
+    for name in variants:
+        if name not in VARIANTS:
+            parser.error(f"Unknown variant {name!r}")
+
+    results: List[Dict[str, Any]] = []
+    for width, height in parse_resolutions(args.resolutions):
+        # float32 without autocast is the numerical reference every variant is compared to
+        pipe, context = build("fp32", args.seed, args.threads, args.interop_threads)
+        reference = generate(pipe, context, width, height, args.steps, args.seed)
+        del pipe
+        for name in variants:
+            result = run_variant(name, width, height, args.steps, args.requests, args.seed,
+                                 args.threads, args.interop_threads, reference)
+            results.append(result)
+            if "error" in result:
+                print(f"{name} {width}x{height}: failed ({result['error']})", file=sys.stderr)
+            else:
+                print(f"{name} {width}x{height} steps={args.steps}: p50={result['p50_ms']}ms "
+                      f"({result['ms_per_step']} ms/step) first={result['first_request_s']}s "
+                      f"diff={result.get('max_abs_diff_vs_fp32')}", file=sys.stderr)
+
+    info = environment()
+    info.update({
+        "physical_cores": physical_cores(),
+        "native_bf16": native_bf16(),
+        "bf16_flags": [flag for flag in cpu_flags() if "bf16" in flag],
+        "profile": CpuProfile.from_env().describe(),
+    })
+    report = {"config": vars(args), "environment": info, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
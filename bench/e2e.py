@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of Predictor.predict, PonyGenerator.generate_image and PonyComfyUIWorkflow.generate_pony
+Usage: python -m bench.e2e --backends predict,diffusers,comfyui --concurrency 1,4 --resolutions 64x64 --steps 2,4 --loras "none;default"
+
+Runs CPU-only: the diffusers backends use a tiny randomly-initialised SDXL and
+the ComfyUI backend talks to fake ComfyUI servers. Results are printed (or
+written with --output) as JSON so runs can be diffed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench.fake_comfyui import FakeComfyUIServer
+from bench.stats import device_peak_mb, peak_rss_mb, reset_device_peak, summarize
+from image_output import OUTPUT_WORKERS
+from job_scheduler import JobScheduler
+from metrics import STAGE_SECONDS
+from result_cache import ResultCache
+
+PROMPT = "a pony with a rainbow mane, high quality, detailed"
+NEGATIVE_PROMPT = "blurry, low quality"
+GUIDANCE_SCALE = 7.0
+
+LoraConfig = Tuple[str, Optional[List[float]]]
+
+
+def parse_resolutions(spec: str) -> List[Tuple[int, int]]:
+    """"64x64,128x96" -> [(64, 64), (128, 96)]"""
+    resolutions = []
+    for item in spec.split(","):
+        width, height = item.lower().split("x")
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def parse_loras(spec: str) -> List[LoraConfig]:
+    """"none;default;0.5,1.0" -> LoRA weight vectors (None means the backend's default)"""
+    configs: List[LoraConfig] = []
+    for item in spec.split(";"):
+        item = item.strip()
+        if item == "none":
+            configs.append((item, []))
+        elif item == "default":
+            configs.append((item, None))
+        else:
+            configs.append((item, [float(weight) for weight in item.split(",")]))
+    return configs
+
+
+class Backend:
+    """One generation entry point driven the way its app drives it"""
+
+    name = "backend"
+
+    def workers(self, concurrency: int) -> int:
+        """Scheduler workers in front of the backend"""
+        return 1
+
+    def max_running(self, concurrency: int) -> Optional[int]:
+        """Bound on the scheduler's jobs in flight, None leaves it to the workers"""
+        return None
+
+    def configure(self, lora_weights: Optional[List[float]]):
+        pass
+
+    def call(self, width: int, height: int, steps: int, seed: int) -> Tuple[Any, tuple, dict]:
+        """Function and arguments for one request"""
+        raise NotImplementedError
+
+    def ok(self, result: Any) -> bool:
+        return result is not None
+
+    def close(self):
+        pass
+
+
+class DiffusersBackend(Backend):
+    """app_backup.PonyGenerator on a tiny SDXL, one worker like the app"""
+
+    name = "diffusers"
+
+    def __init__(self, pipe, adapters: List[str], fused: bool, output_workers: int, memory_mode: str, cpu):
+        os.environ.setdefault("PONY_SKIP_MODEL_LOAD", "1")
+        from app_backup import PonyGenerator
+        from image_output import OutputPool
+        from lora_manager import LoraManager
+        from memory_mode import MemoryManager
+        from prompt_cache import PromptEmbeddingCache
+        from textual_inversion import EmbeddingTable
+
+        self.generator = PonyGenerator.__new__(PonyGenerator)
+        self.generator.pipe = pipe
+        self.generator.loras = LoraManager(pipe, fused=fused)
+        self.generator.loras.adapters = list(adapters)
+        self.generator.adapter_key = ()
+        self.generator.prompt_cache = PromptEmbeddingCache()
+        self.generator.embeddings = EmbeddingTable()
+        self.generator.encoder = OutputPool(output_workers)
+        self.generator.memory = MemoryManager(pipe, mode=memory_mode)
+        self.generator.cpu = cpu
+        self.lora_weights: Optional[List[float]] = None
+
+    def configure(self, lora_weights: Optional[List[float]]):
+        self.lora_weights = lora_weights
+
+    def call(self, width, height, steps, seed):
+        return self.generator.generate_image, (PROMPT, NEGATIVE_PROMPT, width, height, steps, GUIDANCE_SCALE, seed), {
+            "lora_weights": self.lora_weights,
+            "previews": False
+        }
+
+    def ok(self, result):
+        return result is not None and result[0] is not None
+
+    def close(self):
+        self.generator.encoder.shutdown()
+
+
+class PredictBackend(Backend):
+    """predict.Predictor on a tiny SDXL, one prediction at a time like Cog"""
+
+    name = "predict"
+
+    def __init__(self, pipe, adapters: List[str], fused: bool, cache_dir: str, output_workers: int, memory_mode: str,
+                 cpu):
+        from image_output import OutputPool
+        from lora_manager import LoraManager
+        from memory_mode import MemoryManager
+        from predict import Predictor
+        from prompt_cache import PromptEmbeddingCache
+        from textual_inversion import EmbeddingTable
+
+        self.predictor = Predictor()
+        self.predictor.pipe = pipe
+        self.predictor.loras = LoraManager(pipe, fused=fused)
+        self.predictor.loras.adapters = list(adapters)
+        self.predictor.adapter_key = ()
+        self.predictor.prompt_cache = PromptEmbeddingCache()
+        self.predictor.embeddings = EmbeddingTable()
+        self.predictor.result_cache = ResultCache(cache_dir)
+        self.predictor.encoder = OutputPool(output_workers)
+        self.predictor.memory = MemoryManager(pipe, mode=memory_mode)
+        self.predictor.cpu = cpu
+        self.lora_weights = ""
+
+    def configure(self, lora_weights: Optional[List[float]]):
+        # "" is the predictor's default; an explicit 0 switches every LoRA off
+        if lora_weights is None:
+            self.lora_weights = ""
+        else:
+            self.lora_weights = ",".join(str(weight) for weight in lora_weights) or "0"
+
+    def call(self, width, height, steps, seed):
+        return self._predict, (width, height, steps, seed), {}
+
+    def _predict(self, width, height, steps, seed):
+        paths = self.predictor.predict(
+            prompt=PROMPT,
+            negative_prompt=NEGATIVE_PROMPT,
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+            guidance_scale=GUIDANCE_SCALE,
+            seed=seed,
+            num_outputs=1,
+            seeds="",
+            lora_weights=self.lora_weights,
+            output_format="png",
+            output_quality=90
+        )
+        for path in paths:
+            os.remove(path)
+        return paths
+
+    def ok(self, result):
+        return bool(result)
+
+    def close(self):
+        self.predictor.encoder.shutdown()
+
+
+class ComfyUIBackend(Backend):
+    """comfyui_app.PonyComfyUIWorkflow over a pool of fake ComfyUI servers"""
+
+    name = "comfyui"
+
+    def __init__(self, servers: int, execution_time: float, cache_dir: str):
+        self.servers = [FakeComfyUIServer(execution_time=execution_time).start() for _ in range(servers)]
+        os.environ["COMFYUI_BACKENDS"] = ",".join(server.url for server in self.servers)
+        from comfyui_app import PonyComfyUIWorkflow
+
+        self.workflow = PonyComfyUIWorkflow()
+        self.workflow.result_cache = ResultCache(cache_dir)
+        self.lora_weights: Optional[List[float]] = None
+
+    def max_running(self, concurrency: int) -> Optional[int]:
+        # Jobs run on the async client, so the one worker only dispatches and this bounds the prompts in flight
+        return concurrency
+
+    def configure(self, lora_weights: Optional[List[float]]):
+        self.lora_weights = lora_weights
+
+    def call(self, width, height, steps, seed):
+        return self.workflow.generate_pony_async, (), {
+            "prompt": PROMPT,
+            "negative_prompt": NEGATIVE_PROMPT,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "cfg": GUIDANCE_SCALE,
+            "seed": seed,
+            "lora_weights": self.lora_weights,
+            "previews": False
+        }
+
+    def ok(self, result):
+        return result is not None and result[0] is not None
+
+    def close(self):
+        for server in self.servers:
+            server.stop()
+
+
+def stage_totals() -> Dict[str, Tuple[float, int]]:
+    return {key[0]: totals for key, totals in STAGE_SECONDS.totals().items()}
+
+
+def stage_breakdown(before: Dict[str, Tuple[float, int]], after: Dict[str, Tuple[float, int]]) -> Dict[str, Dict[str, float]]:
+    """Count and mean latency per instrumented stage between two snapshots"""
+    breakdown = {}
+    for stage, (total, count) in sorted(after.items()):
+        previous_total, previous_count = before.get(stage, (0.0, 0))
+        if count > previous_count:
+            breakdown[stage] = {
+                "count": count - previous_count,
+                "mean_ms": round((total - previous_total) / (count - previous_count) * 1000, 3),
+            }
+    return breakdown
+
+
+def run_scenario(backend: Backend, concurrency: int, total: int, width: int, height: int,
+                 steps: int, seed: int) -> Dict[str, Any]:
+    """Drive `total` requests from `concurrency` clients through a JobScheduler"""
+    scheduler = JobScheduler(
+        workers=backend.workers(concurrency),
+        max_queue=max(32, total),
+        name=f"bench-{backend.name}",
+        max_running=backend.max_running(concurrency)
+    )
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [total]
+
+    def client(index: int):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                request = total - remaining[0]
+            # Distinct seeds keep the result cache out of the measurement
+            fn, args, kwargs = backend.call(width, height, steps, seed + request)
+            start = time.perf_counter()
+            try:
+                result = scheduler.submit(fn, *args, client_id=f"client-{index}", **kwargs).result()
+                ok = backend.ok(result)
+            except Exception as e:
+                print(f"{backend.name} request failed: {e}", file=sys.stderr)
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    before = stage_totals()
+    reset_device_peak()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, elapsed)
+    result.update({
+        "errors": errors[0],
+        "peak_rss_mb": peak_rss_mb(),
+        "device_peak_mb": device_peak_mb(),
+        "stages": stage_breakdown(before, stage_totals()),
+    })
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    info: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+        info["device"] = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        pass
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="predict,diffusers,comfyui")
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated client counts")
+    parser.add_argument("--resolutions", default="64x64", help="comma-separated WxH")
+    parser.add_argument("--steps", default="2,4", help="comma-separated step counts")
+    parser.add_argument("--loras", default="none;default", help='";"-separated LoRA weight vectors, "none" or "default"')
+    parser.add_argument("--lora-mode", choices=("fused", "peft"), default=os.environ.get("LORA_MODE", "fused"),
+                        help="fuse LoRAs into the weights or run them as PEFT adapters")
+    parser.add_argument("--output-workers", type=int, default=OUTPUT_WORKERS,
+                        help="threads encoding finished images, 0 encodes on the generation thread")
+    parser.add_argument("--memory-mode", default=os.environ.get("MEMORY_MODE", "auto"),
+                        help="auto, or force full, vae_slicing, vae_tiling or attention_slicing")
+    parser.add_argument("--cpu-profile", choices=("on", "off"), default=os.environ.get("CPU_PROFILE", "on"),
+                        help="run the diffusers backends with cpu_profile.CpuProfile (CPU_DTYPE etc.) or under "
+                             "torch.autocast(\"cpu\") (python -m bench.cpu compares the two in detail)")
+    parser.add_argument("--requests", type=int, default=8, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests per scenario")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--comfyui-servers", type=int, default=1)
+    parser.add_argument("--comfyui-execution-time", type=float, default=0.05, help="seconds per fake prompt")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+    resolutions = parse_resolutions(args.resolutions)
+    step_counts = [int(value) for value in args.steps.split(",")]
+    lora_configs = parse_loras(args.loras)
+
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    # Seeds never repeat across runs, so neither warmups nor timed requests hit the result cache
+    next_seed = args.seed
+    results = []
+    try:
+        for name in backends:
+            if name in ("diffusers", "predict"):
+                from bench.tiny_sdxl import build_tiny_sdxl
+                from model_manifest import LORAS
+                # Random stand-ins named like the manifest LoRAs, so weight vectors map the same way
+                adapters = [entry.adapter_name for entry in LORAS]
+                start = time.perf_counter()
+                pipe = build_tiny_sdxl(seed=args.seed, lora_adapters=adapters)
+                print(f"Built tiny SDXL in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+                cpu = None
+                if args.cpu_profile == "on":
+                    from cpu_profile import CpuProfile
+                    cpu = CpuProfile.from_env()
+                    cpu.apply(pipe)
+                    print(f"CPU profile: {cpu.describe()}", file=sys.stderr)
+                if name == "diffusers":
+                    backend: Backend = DiffusersBackend(pipe, adapters, args.lora_mode == "fused", args.output_workers,
+                                                        args.memory_mode, cpu)
+                else:
+                    backend = PredictBackend(pipe, adapters, args.lora_mode == "fused", os.path.join(cache_dir, name),
+                                             args.output_workers, args.memory_mode, cpu)
+            elif name == "comfyui":
+                backend = ComfyUIBackend(args.comfyui_servers, args.comfyui_execution_time,
+                                         os.path.join(cache_dir, name))
+            else:
+                parser.error(f"Unknown backend {name!r}")
+
+            try:
+                for label, weights in lora_configs:
+                    backend.configure(weights)
+                    for width, height in resolutions:
+                        for steps in step_counts:
+                            for concurrency in concurrencies:
+                                if args.warmup:
+                                    run_scenario(backend, 1, args.warmup, width, height, steps, next_seed)
+                                    next_seed += args.warmup
+                                summary = run_scenario(backend, concurrency, args.requests, width, height, steps, next_seed)
+                                next_seed += args.requests
+                                scenario = {
+                                    "backend": backend.name,
+                                    "concurrency": concurrency,
+                                    "width": width,
+                                    "height": height,
+                                    "steps": steps,
+                                    "loras": label,
+                                }
+                                scenario.update(summary)
+                                results.append(scenario)
+                                print(f"{backend.name} c={concurrency} {width}x{height} steps={steps} loras={label}: "
+                                      f"{summary['throughput_per_s']}/s p50={summary['p50_ms']}ms "
+                                      f"p99={summary['p99_ms']}ms errors={summary['errors']}", file=sys.stderr)
+            finally:
+                backend.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {"config": vars(args), "environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    sys.exit(1 if any(result["errors"] for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal fake ComfyUI server for benchmarks
+Implements the HTTP and websocket endpoints our clients use, with a fixed execution delay
+"""
+
+import base64
+import hashlib
+import json
+import socket as socketlib
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+
+def make_png(width: int = 8, height: int = 8) -> bytes:
+    """Encode a solid grey RGB PNG without any imaging dependency"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + b"\x80" * (width * 3) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """Unmasked server-to-client websocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_frame(rfile) -> Optional[Tuple[int, bytes]]:
+    """Read one (masked) client frame, None once the connection is gone"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else b""
+    data = rfile.read(length)
+    if mask:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return opcode, data
+
+
+class FakeWebSocket:
+    """Server side of one client's websocket, writes are serialised"""
+
+    def __init__(self, wfile, connection=None):
+        self.wfile = wfile
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def drop(self):
+        """Cut the connection without a close frame, like a server restart or a proxy timeout"""
+        if self.connection is not None:
+            try:
+                self.connection.shutdown(socketlib.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def send(self, payload: bytes, opcode: int = 0x1) -> bool:
+        try:
+            with self.lock:
+                self.wfile.write(encode_frame(payload, opcode))
+                self.wfile.flush()
+            return True
+        except (OSError, ValueError):
+            # ValueError: the handler already closed the file after a drop
+            return False
+
+    def send_json(self, message: Dict[str, Any]) -> bool:
+        return self.send(json.dumps(message).encode("utf-8"))
+
+
+class FakeComfyUIState:
+    """Jobs known to the fake server.
+
+    Every job "runs" for `execution_time` seconds from submission, all in
+    parallel. Clients connected over /ws get the same event sequence
+    ComfyUI sends: execution_start, executing, one progress message (and
+    binary preview) per step, executing with node None, execution_success.
+    With `fail`, every job stops after its first step with execution_error
+    and an error status in its history.
+    """
+
+    def __init__(self, execution_time: float = 0.0, image_size: int = 8, progress_steps: int = 4,
+                 fail: bool = False):
+        self.execution_time = execution_time
+        self.progress_steps = progress_steps
+        self.fail = fail
+        self.image = make_png(image_size, image_size)
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.sockets: Dict[str, FakeWebSocket] = {}
+
+    def submit(self, workflow: Dict[str, Any], client_id: Optional[str] = None) -> str:
+        prompt_id = str(uuid.uuid4())
+        queued_at = time.time()
+        with self.lock:
+            self.jobs[prompt_id] = {"workflow": workflow, "queued_at": queued_at}
+        if client_id:
+            threading.Thread(target=self._emit, args=(client_id, prompt_id, workflow, queued_at), daemon=True).start()
+        return prompt_id
+
+    def connect(self, client_id: str, socket: FakeWebSocket):
+        with self.lock:
+            self.sockets[client_id] = socket
+
+    def drop_sockets(self):
+        """Cut every websocket, jobs keep running and their history stays available"""
+        with self.lock:
+            sockets = list(self.sockets.values())
+        for socket in sockets:
+            socket.drop()
+
+    def disconnect(self, client_id: str, socket: FakeWebSocket):
+        with self.lock:
+            if self.sockets.get(client_id) is socket:
+                del self.sockets[client_id]
+
+    def _send(self, client_id: str, message: Dict[str, Any], preview: bool = False):
+        """Send to the client's current socket, like ComfyUI does, dropping it if nobody listens"""
+        with self.lock:
+            socket = self.sockets.get(client_id)
+        if socket is None:
+            return
+        socket.send_json(message)
+        if preview:
+            socket.send(struct.pack(">II", 1, 2) + self.image, opcode=0x2)
+
+    def _emit(self, client_id: str, prompt_id: str, workflow: Dict[str, Any], queued_at: float):
+        samplers: List[str] = [node_id for node_id, node in workflow.items() if node.get("class_type") == "KSampler"]
+        node = samplers[0] if samplers else None
+        self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id, "timestamp": int(queued_at * 1000)}})
+        self._send(client_id, {"type": "executing", "data": {"node": node, "prompt_id": prompt_id}})
+        for step in range(1, self.progress_steps + 1):
+            time.sleep(max(0.0, queued_at + self.execution_time * step / self.progress_steps - time.time()))
+            self._send(client_id, {"type": "progress", "data": {
+                "value": step, "max": self.progress_steps, "prompt_id": prompt_id, "node": node
+            }}, preview=True)
+            if self.fail:
+                self._send(client_id, {"type": "execution_error", "data": {
+                    "prompt_id": prompt_id, "node_id": node, "exception_message": "fake failure"
+                }})
+                self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+                return
+        time.sleep(max(0.0, queued_at + self.execution_time - time.time()))
+        self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+        self._send(client_id, {"type": "execution_success", "data": {
+            "prompt_id": prompt_id, "timestamp": int((queued_at + self.execution_time) * 1000)
+        }})
+
+    def pending(self) -> int:
+        now = time.time()
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if now - job["queued_at"] < self.execution_time)
+
+    def history(self, prompt_id: str) -> Dict[str, Any]:
+        with self.lock:
+            job = self.jobs.get(prompt_id)
+        # Failing jobs end at their first step
+        duration = self.execution_time / self.progress_steps if self.fail else self.execution_time
+        if job is None or time.time() - job["queued_at"] < duration:
+            return {}
+        if self.fail:
+            return {prompt_id: {"status": {"status_str": "error", "completed": False, "messages": [
+                ["execution_error", {"prompt_id": prompt_id, "exception_message": "fake failure"}],
+            ]}, "outputs": {}}}
+
+        # One image per sampler branch and latent in its batch, like ImageBatch into SaveImage
+        nodes = job["workflow"].values()
+        samplers = sum(1 for node in nodes if node.get("class_type") == "KSampler")
+        batch = max([node["inputs"].get("batch_size", 1) for node in nodes
+                     if node.get("class_type") == "EmptyLatentImage"] or [1])
+        count = max(1, samplers) * batch
+        images = []
+        for node_id, node in job["workflow"].items():
+            if node.get("class_type") == "SaveImage":
+                images.extend((node_id, {"filename": f"{prompt_id}_{index}.png" if index else f"{prompt_id}.png",
+                                         "subfolder": "", "type": "output"}) for index in range(count))
+        return {
+            prompt_id: {
+                "status": {
+                    "status_str": "success",
+                    "completed": True,
+                    "messages": [
+                        ["execution_start", {"prompt_id": prompt_id, "timestamp": int(job["queued_at"] * 1000)}],
+                        ["execution_success", {"prompt_id": prompt_id,
+                                               "timestamp": int((job["queued_at"] + self.execution_time) * 1000)}],
+                    ],
+                },
+                "outputs": {node_id: {"images": [info for image_node, info in images if image_node == node_id]}
+                            for node_id, _ in images},
+            }
+        }
+
+
+class FakeComfyUIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, Nagle would add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeComfyUIState:
+        return self.server.state
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: Any, status: int = 200):
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _websocket(self, client_id: str):
+        """Upgrade to a websocket and hold it open until the client leaves"""
+        accept = base64.b64encode(
+            hashlib.sha1((self.headers.get("Sec-WebSocket-Key", "") + WEBSOCKET_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+        socket = FakeWebSocket(self.wfile, self.connection)
+        # Registered before the client sees the handshake, or a prompt it queues right after would go unheard;
+        # the lock holds back events until the handshake is out
+        with socket.lock:
+            self.state.connect(client_id, socket)
+            self.send_response(101, "Switching Protocols")
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+        socket.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id}})
+        try:
+            while True:
+                frame = read_frame(self.rfile)
+                if frame is None or frame[0] == 0x8:
+                    break
+                if frame[0] == 0x9:
+                    socket.send(frame[1], opcode=0xA)
+        except OSError:
+            pass
+        finally:
+            self.state.disconnect(client_id, socket)
+            self.close_connection = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/ws":
+            client_id = parse_qs(url.query).get("clientId", [str(uuid.uuid4())])[0]
+            self._websocket(client_id)
+        elif url.path == "/system_stats":
+            self._send_json({"system": {"os": "fake"}, "devices": []})
+        elif url.path == "/queue":
+            running = [[0, "fake"]] if self.state.pending() else []
+            self._send_json({"queue_running": running, "queue_pending": []})
+        elif url.path.startswith("/history/"):
+            self._send_json(self.state.history(url.path[len("/history/"):]))
+        elif url.path == "/view":
+            if not parse_qs(url.query).get("filename"):
+                self._send(400, b"")
+            else:
+                self._send(200, self.state.image, "image/png")
+        else:
+            self._send(404, b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        url = urlparse(self.path)
+        if url.path == "/prompt":
+            payload = json.loads(body or b"{}")
+            prompt_id = self.state.submit(payload.get("prompt", {}), payload.get("client_id"))
+            self._send_json({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+        elif url.path == "/interrupt":
+            self._send(200, b"")
+        else:
+            self._send(404, b"")
+
+
+class FakeComfyUIServer:
+    """Run a fake ComfyUI server on a background thread"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 execution_time: float = 0.0, image_size: int = 8, progress_steps: int = 4, fail: bool = False):
+        self.httpd = ThreadingHTTPServer((host, port), FakeComfyUIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = FakeComfyUIState(execution_time, image_size, progress_steps, fail)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def state(self) -> FakeComfyUIState:
+        return self.httpd.state
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeComfyUIServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark one-shot requests.get/post against the pooled ComfyUI session
+Usage: python -m bench.http_session --requests 2000 --concurrency 8
+"""
+
+import argparse
+import json
+import threading
+import time
+from typing import Callable, Dict, List
+
+import requests
+
+from bench.fake_comfyui import FakeComfyUIServer
+from bench.stats import summarize
+from comfyui_http import create_session, TIMEOUTS
+
+WORKFLOW = {"13": {"class_type": "SaveImage", "inputs": {"filename_prefix": "pony"}}}
+
+
+def job_cycle(http, server_url: str):
+    """One submit -> history -> view round trip, like a ComfyUI client job"""
+    data = json.dumps({"prompt": WORKFLOW, "client_id": "bench"}).encode("utf-8")
+    prompt_id = http.post(f"{server_url}/prompt", data=data, timeout=TIMEOUTS["prompt"]).json()["prompt_id"]
+    http.get(f"{server_url}/history/{prompt_id}", timeout=TIMEOUTS["history"]).json()
+    http.get(f"{server_url}/view", params={"filename": f"{prompt_id}.png", "type": "output"},
+             timeout=TIMEOUTS["view"]).content
+
+
+def run(call: Callable[[], None], total: int, concurrency: int) -> Dict[str, float]:
+    """Run `total` calls spread over `concurrency` threads"""
+    latencies: List[float] = []
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            call()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=1000, help="job cycles per mode (3 HTTP calls each)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=16)
+    args = parser.parse_args()
+
+    with FakeComfyUIServer() as server:
+        session = create_session(pool_size=args.pool_size)
+        results = {
+            "before_one_shot": run(lambda: job_cycle(requests, server.url), args.requests, args.concurrency),
+            "after_pooled_session": run(lambda: job_cycle(session, server.url), args.requests, args.concurrency),
+        }
+
+    print(json.dumps({"concurrency": args.concurrency, "pool_size": args.pool_size, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
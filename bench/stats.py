@@ -0,0 +1,59 @@
+"""Small helpers for summarising benchmark latencies and memory"""
+
+import math
+import resource
+import sys
+from typing import Dict, List, Optional
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles (in milliseconds) for one run"""
+    return {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _torch():
+    """torch if installed, the ComfyUI client benchmarks run without it"""
+    try:
+        import torch
+    except ImportError:
+        return None
+    return torch
+
+
+def reset_device_peak():
+    """Start a new device memory peak window, if there is an accelerator"""
+    torch = _torch()
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def device_peak_mb() -> Optional[float]:
+    """Peak accelerator memory since the last reset, None on CPU-only runs"""
+    torch = _torch()
+    if torch is not None and torch.cuda.is_available():
+        return round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1)
+    return None
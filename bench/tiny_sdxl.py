@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tiny randomly-initialised SDXL pipeline for CPU benchmarks
+Same architecture and code paths as the real model, built offline in well under a second
+"""
+
+import json
+import os
+import tempfile
+from typing import List, Optional, Sequence
+
+import torch
+from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+TEXT_HIDDEN_SIZE = 32
+
+
+def byte_symbols() -> List[str]:
+    """The 256 printable stand-ins byte-level BPE uses for raw bytes (GPT-2/CLIP mapping)"""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    symbols = {}
+    extra = 0
+    for byte in range(256):
+        if byte in printable:
+            symbols[byte] = chr(byte)
+        else:
+            symbols[byte] = chr(256 + extra)
+            extra += 1
+    return [symbols[byte] for byte in range(256)]
+
+
+def write_tokenizer_files(directory: str) -> str:
+    """Byte-level CLIP vocabulary without merges, so no hub download is needed"""
+    symbols = byte_symbols()
+    vocab = symbols + [symbol + "</w>" for symbol in symbols] + ["<|startoftext|>", "<|endoftext|>"]
+    with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({token: index for index, token in enumerate(vocab)}, f)
+    with open(os.path.join(directory, "merges.txt"), "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    return directory
+
+
+def build_tiny_sdxl(seed: int = 0, lora_adapters: Sequence[str] = (),
+                    directory: Optional[str] = None) -> StableDiffusionXLPipeline:
+    """SDXL pipeline with both text encoders, a two-block UNet and a two-block VAE
+
+    A random LoRA is attached to the UNet (needs peft) for every name in
+    `lora_adapters`, so adapter switching can be benchmarked too.
+    """
+    torch.manual_seed(seed)
+    tokenizer_dir = write_tokenizer_files(directory or tempfile.mkdtemp(prefix="tiny-sdxl-"))
+    vocab_file, merges_file = os.path.join(tokenizer_dir, "vocab.json"), os.path.join(tokenizer_dir, "merges.txt")
+    tokenizer = CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+    tokenizer_2 = CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+
+    text_config = CLIPTextConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=TEXT_HIDDEN_SIZE,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        projection_dim=TEXT_HIDDEN_SIZE,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        hidden_act="gelu",
+    )
+
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 1),
+        # 6 time ids of 8 dims each plus the pooled text embedding
+        projection_class_embeddings_input_dim=6 * 8 + TEXT_HIDDEN_SIZE,
+        cross_attention_dim=2 * TEXT_HIDDEN_SIZE,
+        norm_num_groups=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        sample_size=128,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        steps_offset=1,
+        timestep_spacing="leading",
+    )
+
+    pipe = StableDiffusionXLPipeline(
+        vae=vae,
+        text_encoder=CLIPTextModel(text_config),
+        text_encoder_2=CLIPTextModelWithProjection(text_config),
+        tokenizer=tokenizer,
+        tokenizer_2=tokenizer_2,
+        unet=unet,
+        scheduler=scheduler,
+    )
+    pipe.set_progress_bar_config(disable=True)
+
+    if lora_adapters:
+        attach_random_loras(pipe, lora_adapters)
+    return pipe
+
+
+def attach_random_loras(pipe: StableDiffusionXLPipeline, names: Sequence[str], rank: int = 4) -> List[str]:
+    """Add a randomly initialised LoRA adapter to the UNet per name"""
+    from peft import LoraConfig
+
+    for name in names:
+        config = LoraConfig(r=rank, lora_alpha=rank, init_lora_weights="gaussian",
+                            target_modules=["to_q", "to_k", "to_v", "to_out.0"])
+        pipe.unet.add_adapter(config, adapter_name=name)
+    return list(names)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Build a diffusers-format SDXL snapshot with the LoRAs fused into the weights
+Usage: python build_snapshot.py --output snapshot [--lora "Pony Realism Slider.safetensors=1.0" ...]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from diffusers import StableDiffusionXLPipeline
+from huggingface_hub import hf_hub_download
+
+from model_manifest import CHECKPOINT, DEFAULT_LORA_WEIGHTS, LORAS, REPO_ID, REVISION, ModelFile
+
+SNAPSHOT_DIR = os.environ.get("PONY_SNAPSHOT_DIR", "snapshot")
+METADATA_FILE = "pony_snapshot.json"
+
+# What Predictor.setup used to apply on every boot
+DEFAULT_LORAS = [(entry.filename, DEFAULT_LORA_WEIGHTS[entry.adapter_name])
+                 for entry in LORAS if entry.adapter_name in DEFAULT_LORA_WEIGHTS]
+
+
+def download(entry: ModelFile) -> str:
+    return hf_hub_download(repo_id=REPO_ID, filename=entry.filename, revision=REVISION)
+
+
+def fuse_loras(pipe: StableDiffusionXLPipeline, loras: List[Tuple[str, str, float]]) -> List[Tuple[str, float]]:
+    """Load (name, path, weight) LoRAs, fuse them into the base weights and drop the adapter layers"""
+    fused = [(name, path, weight) for name, path, weight in loras if weight != 0.0]
+    if not fused:
+        return []
+    for name, path, _ in fused:
+        pipe.load_lora_weights(path, adapter_name=name)
+    names = [name for name, _, _ in fused]
+    pipe.set_adapters(names, adapter_weights=[weight for _, _, weight in fused])
+    pipe.fuse_lora(adapter_names=names, lora_scale=1.0)
+    pipe.unload_lora_weights()
+    return [(name, weight) for name, _, weight in fused]
+
+
+def save_snapshot(pipe: StableDiffusionXLPipeline, output_dir: str, metadata: Dict[str, Any]):
+    """Write the pipeline as safetensors next to a metadata file, replacing any previous snapshot atomically"""
+    staging = output_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    pipe.save_pretrained(staging, safe_serialization=True)
+    with open(os.path.join(staging, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(staging, output_dir)
+
+
+def build_snapshot(output_dir: str = SNAPSHOT_DIR,
+                   loras: Optional[List[Tuple[str, float]]] = None,
+                   dtype: torch.dtype = torch.float16) -> Dict[str, Any]:
+    """Convert the manifest checkpoint once, fuse the chosen LoRAs and save it as a snapshot"""
+    by_filename = {entry.filename: entry for entry in LORAS}
+    chosen = DEFAULT_LORAS if loras is None else loras
+    for filename, _ in chosen:
+        if filename not in by_filename:
+            raise ValueError(f"{filename!r} is not a manifest LoRA")
+
+    start = time.perf_counter()
+    print(f"Converting {CHECKPOINT.filename}...")
+    pipe = StableDiffusionXLPipeline.from_single_file(download(CHECKPOINT), torch_dtype=dtype, use_safetensors=True)
+
+    fused = fuse_loras(pipe, [
+        (by_filename[filename].adapter_name, download(by_filename[filename]), weight)
+        for filename, weight in chosen
+    ])
+    print(f"Fused LoRAs: {fused or 'none'}")
+
+    metadata = {
+        "repo_id": REPO_ID,
+        "revision": REVISION,
+        "checkpoint": CHECKPOINT.filename,
+        "loras": fused,
+        "dtype": str(dtype).replace("torch.", ""),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    save_snapshot(pipe, output_dir, metadata)
+    print(f"Snapshot written to {output_dir} in {time.perf_counter() - start:.1f}s")
+    return metadata
+
+
+def read_metadata(path: str = SNAPSHOT_DIR) -> Optional[Dict[str, Any]]:
+    """Metadata of a snapshot directory, None if there is no complete snapshot"""
+    try:
+        with open(os.path.join(path, METADATA_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_mismatch(metadata: Dict[str, Any]) -> Optional[str]:
+    """Why a snapshot was built from something other than the manifest checkpoint, None if it matches"""
+    expected = {"repo_id": REPO_ID, "revision": REVISION, "checkpoint": CHECKPOINT.filename}
+    stale = [f"{field} {metadata.get(field)!r} (manifest {value!r})"
+             for field, value in expected.items() if metadata.get(field) != value]
+    return ", ".join(stale) or None
+
+
+def snapshot_adapter_key(metadata: Dict[str, Any]) -> tuple:
+    """Prompt/result cache adapter key of the LoRAs fused into a snapshot"""
+    return tuple((name, float(weight)) for name, weight in metadata.get("loras", []))
+
+
+def load_snapshot(path: str = SNAPSHOT_DIR,
+                  dtype: torch.dtype = torch.float16) -> Tuple[StableDiffusionXLPipeline, Dict[str, Any]]:
+    """Load a snapshot; safetensors are memory-mapped and no weights are converted or patched"""
+    metadata = read_metadata(path)
+    if metadata is None:
+        raise FileNotFoundError(f"No pipeline snapshot at {path}")
+    pipe = StableDiffusionXLPipeline.from_pretrained(
+        path,
+        torch_dtype=dtype,
+        use_safetensors=True,
+        low_cpu_mem_usage=True
+    )
+    return pipe, metadata
+
+
+def parse_lora(spec: str) -> Tuple[str, float]:
+    """"file.safetensors=0.8" -> ("file.safetensors", 0.8)"""
+    filename, _, weight = spec.rpartition("=")
+    if not filename:
+        return spec, 1.0
+    return filename, float(weight)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default=SNAPSHOT_DIR, help="snapshot directory")
+    parser.add_argument("--lora", action="append", type=parse_lora, metavar="FILE=WEIGHT",
+                        help="LoRA to fuse, repeatable (default: Pony Realism Slider at 1.0)")
+    parser.add_argument("--manifest-defaults", action="store_true",
+                        help="fuse every manifest LoRA at its default weight")
+    args = parser.parse_args()
+
+    loras = args.lora
+    if args.manifest_defaults:
+        loras = [(entry.filename, entry.default_weight) for entry in LORAS]
+    build_snapshot(args.output, loras)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,63 @@
 """
 Simple script to check image metadata
 Usage: python check_metadata.py image.png
+       python check_metadata.py --index outputs/ [--db pony_metadata.sqlite]
+       python check_metadata.py --query [--seed 42] [--prompt "rainbow mane"] [--lora pony_realism_slider=1.0]
 """
 
+import argparse
+import json
+import os
+import sqlite3
 import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
 from PIL import Image
 from PIL.ExifTags import TAGS
 
+from generation_metadata import read_record
+
+DEFAULT_DB = os.environ.get("PONY_METADATA_DB", "pony_metadata.sqlite")
+IMAGE_SUFFIXES = (".png", ".webp", ".jpg", ".jpeg")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    backend TEXT,
+    checkpoint TEXT,
+    seed INTEGER,
+    prompt TEXT,
+    negative_prompt TEXT,
+    width INTEGER,
+    height INTEGER,
+    steps INTEGER,
+    guidance_scale REAL,
+    created_at TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS images_seed ON images (seed);
+CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at);
+CREATE TABLE IF NOT EXISTS image_loras (
+    name TEXT NOT NULL,
+    weight REAL NOT NULL,
+    image_id INTEGER NOT NULL,
+    PRIMARY KEY (name, weight, image_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_loras_image ON image_loras (image_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS prompt_words USING fts5(prompt, negative_prompt, content='images', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS images_insert AFTER INSERT ON images BEGIN
+    INSERT INTO prompt_words (rowid, prompt, negative_prompt) VALUES (new.id, new.prompt, new.negative_prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS images_delete AFTER DELETE ON images BEGIN
+    INSERT INTO prompt_words (prompt_words, rowid, prompt, negative_prompt) VALUES ('delete', old.id, old.prompt, old.negative_prompt);
+    DELETE FROM image_loras WHERE image_id = old.id;
+END;
+"""
+
 def check_image_metadata(image_path):
     """Check metadata of an image file"""
     try:
@@ -37,14 +88,171 @@ def check_image_metadata(image_path):
                 print("\n📝 Custom Text:")
                 for key, value in img.text.items():
                     print(f"   {key}: {value}")
-                    
+            
+        # Request parameters and timings written by the generators
+        record = read_record(image_path)
+        if record:
+            print("\n🦄 Generation Record:")
+            for key, value in record.items():
+                print(f"   {key}: {value}")
+
     except Exception as e:
         print(f"❌ Error reading metadata: {e}")
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python check_metadata.py <image_file>")
-        sys.exit(1)
-    
-    check_image_metadata(sys.argv[1])
+def image_files(directory: str) -> Iterator[Tuple[str, os.stat_result]]:
+    """Image files under a directory with their stat, skipping hidden entries (e.g. half-written cache dirs)"""
+    stack = [directory]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_SUFFIXES):
+                yield entry.path, entry.stat()
+
+class MetadataIndex:
+    """SQLite index of the generation records in output directories.
+
+    Only the file headers are read (see generation_metadata.read_record), and
+    files whose size and mtime are unchanged since the last run are skipped,
+    so re-indexing a directory costs one stat per file. Seeds and LoRA
+    weights are B-tree indexed and prompts full-text indexed, so lookups stay
+    instant at hundreds of thousands of images.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
 
+    def index(self, directory: str) -> Dict[str, int]:
+        """Bring the index up to date with a directory tree, returns counts of what changed"""
+        prefix = os.path.join(os.path.abspath(directory), "")
+        # Every indexed path under the prefix, the upper bound is the next separator character
+        known = {
+            row["path"]: (row["mtime_ns"], row["size"], row["id"])
+            for row in self.db.execute("SELECT path, mtime_ns, size, id FROM images WHERE path >= ? AND path < ?",
+                                       (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        }
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "without_record": 0}
+        with self.db:
+            for path, stat in image_files(prefix):
+                previous = known.pop(path, None)
+                if previous is not None:
+                    if previous[:2] == (stat.st_mtime_ns, stat.st_size):
+                        counts["unchanged"] += 1
+                        continue
+                    self.db.execute("DELETE FROM images WHERE id = ?", (previous[2],))
+                record = read_record(path)
+                if record is None:
+                    counts["without_record"] += 1
+                self._insert(path, stat, record)
+                counts["updated" if previous is not None else "added"] += 1
+            for _, _, image_id in known.values():
+                self.db.execute("DELETE FROM images WHERE id = ?", (image_id,))
+            counts["removed"] = len(known)
+        return counts
+
+    def _insert(self, path: str, stat: os.stat_result, record: Optional[Dict[str, Any]]):
+        record = record or {}
+        cursor = self.db.execute(
+            "INSERT INTO images (path, mtime_ns, size, backend, checkpoint, seed, prompt, negative_prompt, width, "
+            "height, steps, guidance_scale, created_at, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, record.get("backend"), record.get("checkpoint"), record.get("seed"),
+             record.get("prompt"), record.get("negative_prompt"), record.get("width"), record.get("height"),
+             record.get("steps"), record.get("guidance_scale"), record.get("created_at"),
+             json.dumps(record["timings"], separators=(",", ":")) if record.get("timings") else None)
+        )
+        loras = record.get("loras") or {}
+        self.db.executemany("INSERT OR IGNORE INTO image_loras (name, weight, image_id) VALUES (?, ?, ?)",
+                            [(name, float(weight), cursor.lastrowid) for name, weight in loras.items()])
+
+    def query(self, seed: Optional[int] = None, prompt: Optional[str] = None, lora: Optional[str] = None,
+              lora_weight: Optional[float] = None, backend: Optional[str] = None, limit: int = 50) -> List[sqlite3.Row]:
+        """Newest images matching every given filter; prompt matches all of its words, in any order"""
+        clauses, args = [], []
+        if seed is not None:
+            clauses.append("images.seed = ?")
+            args.append(seed)
+        if prompt:
+            words = " ".join('"' + word.replace('"', '""') + '"' for word in prompt.split())
+            clauses.append("images.id IN (SELECT rowid FROM prompt_words WHERE prompt_words MATCH ?)")
+            args.append(f"prompt : ({words})")
+        if lora:
+            if lora_weight is None:
+                clauses.append("images.id IN (SELECT image_id FROM image_loras WHERE name = ?)")
+                args.append(lora)
+            else:
+                clauses.append("images.id IN (SELECT image_id FROM image_loras WHERE name = ? AND weight = ?)")
+                args.extend([lora, lora_weight])
+        if backend:
+            clauses.append("images.backend = ?")
+            args.append(backend)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return self.db.execute(
+            "SELECT images.*, (SELECT group_concat(name || '=' || weight, ', ') FROM image_loras "
+            f"WHERE image_id = images.id) AS loras FROM images{where} ORDER BY images.created_at DESC, images.id DESC LIMIT ?",
+            args + [limit]
+        ).fetchall()
+
+    def count(self) -> int:
+        return self.db.execute("SELECT count(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+def parse_lora(spec: str) -> Tuple[str, Optional[float]]:
+    """"name=0.8" -> ("name", 0.8), "name" -> ("name", None)"""
+    name, _, weight = spec.partition("=")
+    return name, float(weight) if weight else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="image file to inspect, or directories with --index")
+    parser.add_argument("--index", action="store_true", help="index the generation records of the given directories")
+    parser.add_argument("--query", action="store_true", help="search the index")
+    parser.add_argument("--db", default=DEFAULT_DB, help="index database")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--prompt", help="words that must all appear in the prompt")
+    parser.add_argument("--lora", type=parse_lora, metavar="NAME[=WEIGHT]", help="LoRA adapter name, optionally its weight")
+    parser.add_argument("--backend", choices=("predict", "diffusers", "comfyui"))
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    if not args.index and not args.query:
+        if len(args.paths) != 1:
+            print("Usage: python check_metadata.py <image_file>")
+            sys.exit(1)
+        check_image_metadata(args.paths[0])
+        return
+
+    index = MetadataIndex(args.db)
+    try:
+        if args.index:
+            for directory in args.paths:
+                start = time.perf_counter()
+                counts = index.index(directory)
+                print(f"📚 Indexed {directory} in {time.perf_counter() - start:.2f}s: {counts}")
+            print(f"🗂️ {index.count()} images in {args.db}")
+        if args.query:
+            lora, lora_weight = args.lora if args.lora else (None, None)
+            start = time.perf_counter()
+            rows = index.query(seed=args.seed, prompt=args.prompt, lora=lora, lora_weight=lora_weight,
+                               backend=args.backend, limit=args.limit)
+            print(f"🔎 {len(rows)} match(es) in {(time.perf_counter() - start) * 1000:.1f} ms")
+            for row in rows:
+                print(f"   {row['path']}  seed={row['seed']} backend={row['backend']} loras=[{row['loras'] or ''}]")
+                print(f"      {row['prompt']}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
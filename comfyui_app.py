@@ -11,51 +11,91 @@ import websocket
 import uuid
 import time
 import os
-import subprocess
 import threading
-from typing import Dict, Any, Optional, List
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable, Union, AsyncIterator, Iterator, Generator, Tuple
+from urllib.parse import urlparse
 from PIL import Image
 import io
+import asyncio
+
+from comfyui_async import AsyncComfyUIManager
+from comfyui_events import ComfyUIEventStream, run_watch, watch_prompt
+from comfyui_http import get_session, TIMEOUTS
+from comfyui_pool import ComfyUIPool, workflow_model_key, is_backend_failure
+from process_supervisor import ProcessSupervisor, ProcessExitedError, http_probe
+from result_cache import ResultCache, request_key
+from image_output import CHUNK_SIZE, OutputFormat, convert_file, write_chunks
+from generation_metadata import generation_record
+from job_scheduler import JobScheduler, QueueFullError, INTERACTIVE
+from metrics import REQUESTS, observe_stage, time_stage, launch_with_metrics
+from workflow_template import get_template, LORAS, DEFAULT_LORA_WEIGHTS, DEFAULT_SEED
+
+def record_history_timings(entry: Dict[str, Any], queued_at: float) -> Dict[str, float]:
+    """Split a finished prompt's latency into queue wait and execution using its history timestamps"""
+    stamps = {
+        message[0]: message[1].get('timestamp')
+        for message in entry.get('status', {}).get('messages', [])
+        if len(message) == 2 and isinstance(message[1], dict)
+    }
+    started = stamps.get('execution_start')
+    finished = stamps.get('execution_success') or stamps.get('execution_error')
+    if started is None or finished is None:
+        return {}
+    # ComfyUI timestamps are epoch milliseconds, the wait assumes clocks are roughly in sync
+    timings = {
+        "queue_wait_s": max(0.0, started / 1000.0 - queued_at),
+        "execution_s": max(0.0, (finished - started) / 1000.0),
+    }
+    observe_stage("comfyui_queue_wait", timings["queue_wait_s"])
+    observe_stage("comfyui_execution", timings["execution_s"])
+    return timings
 
 class ComfyUIManager:
-    def __init__(self):
-        self.server_url = "http://127.0.0.1:8188"
+    def __init__(self, server_url: str = "http://127.0.0.1:8188", session: Optional[requests.Session] = None):
+        self.server_url = server_url
         self.client_id = str(uuid.uuid4())
+        self.session = session if session is not None else get_session()
         self.comfyui_process = None
+        self.supervisor: Optional[ProcessSupervisor] = None
+        self.time_to_ready: Optional[float] = None
         self.is_running = False
+        self.events = ComfyUIEventStream(self.server_url, self.client_id)
         
-    def start_comfyui(self):
+    def start_comfyui(self, timeout: float = 120.0):
         """Start ComfyUI server in background"""
         if not self.is_running:
             try:
+                # Imported here, the client side of this app runs without torch
+                from cpu_profile import CpuProfile
+                cpu = CpuProfile.from_env()
+                
                 # Start ComfyUI server
                 cmd = [
                     "python", "comfyui/main.py", 
                     "--listen", "0.0.0.0", 
-                    "--port", "8188",
-                    "--cpu"  # Use CPU for Hugging Face Spaces
-                ]
+                    "--port", str(urlparse(self.server_url).port or 8188),
+                    "--cpu",  # Use CPU for Hugging Face Spaces
+                    # latent2rgb previews cost next to nothing, "none" turns them off
+                    "--preview-method", os.environ.get("COMFYUI_PREVIEW_METHOD", "latent2rgb")
+                ] + cpu.comfyui_args()  # bf16 on CPUs that compute it natively
                 
-                self.comfyui_process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
+                print(f"Starting ComfyUI on CPU: {cpu.describe()}")
+                self.supervisor = ProcessSupervisor(cmd, name="ComfyUI", stage="comfyui_startup", env=cpu.environ())
+                self.comfyui_process = self.supervisor.start()
                 
-                # Wait for server to start
-                for i in range(30):  # Wait up to 30 seconds
-                    try:
-                        response = requests.get(f"{self.server_url}/system_stats", timeout=1)
-                        if response.status_code == 200:
-                            self.is_running = True
-                            print("ComfyUI server started successfully!")
-                            return True
-                    except:
-                        time.sleep(1)
+                # Probe with backoff, failing fast if the process dies
+                probe = http_probe(f"{self.server_url}/system_stats", self.session, TIMEOUTS["health"][1])
+                self.time_to_ready = self.supervisor.wait_until_ready(probe, timeout=timeout)
+                self.is_running = True
+                print(f"ComfyUI server started successfully in {self.time_to_ready:.2f}s!")
+                return True
                 
-                print("Failed to start ComfyUI server")
+            except (ProcessExitedError, TimeoutError) as e:
+                print(f"Failed to start ComfyUI server: {e}")
+                if self.supervisor is not None:
+                    self.supervisor.stop()
                 return False
-                
             except Exception as e:
                 print(f"Error starting ComfyUI: {e}")
                 return False
@@ -63,11 +103,13 @@ class ComfyUIManager:
     
     def queue_prompt(self, workflow: Dict[str, Any]) -> str:
         """Queue a workflow for execution"""
+        # Listen before queueing, or the prompt's first events (and the previews they attribute) are missed
+        self.events.ensure_connected()
         p = {"prompt": workflow, "client_id": self.client_id}
         data = json.dumps(p).encode('utf-8')
         
         try:
-            response = requests.post(f"{self.server_url}/prompt", data=data, timeout=10)
+            response = self.session.post(f"{self.server_url}/prompt", data=data, timeout=TIMEOUTS["prompt"])
             if response.status_code == 200:
                 return response.json()['prompt_id']
             else:
@@ -75,53 +117,95 @@ class ComfyUIManager:
         except Exception as e:
             raise Exception(f"ComfyUI server not responding: {e}")
     
-    def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> Image.Image:
-        """Get generated image from ComfyUI"""
+    def get_image_bytes(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
+        """Get the encoded image file from ComfyUI"""
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
         
         try:
-            response = requests.get(f"{self.server_url}/view", params=data, timeout=10)
+            response = self.session.get(f"{self.server_url}/view", params=data, timeout=TIMEOUTS["view"])
             if response.status_code == 200:
-                return Image.open(io.BytesIO(response.content))
+                return response.content
             else:
                 raise Exception(f"Failed to get image: {response.status_code}")
         except Exception as e:
             raise Exception(f"Failed to retrieve image: {e}")
     
+    def download_image(self, filename: str, subfolder: str = "", folder_type: str = "output",
+                       directory: Optional[str] = None, record: Optional[Dict[str, Any]] = None) -> str:
+        """Stream the encoded image file from ComfyUI into a local file, without decoding it
+        
+        A generation record is spliced into the PNG header on the way through.
+        """
+        data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        
+        try:
+            with self.session.get(f"{self.server_url}/view", params=data, timeout=TIMEOUTS["view"], stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Failed to get image: {response.status_code}")
+                return write_chunks(response.iter_content(CHUNK_SIZE), directory, record)
+        except Exception as e:
+            raise Exception(f"Failed to retrieve image: {e}")
+    
+    def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> Image.Image:
+        """Get generated image from ComfyUI"""
+        return Image.open(io.BytesIO(self.get_image_bytes(filename, subfolder, folder_type)))
+    
     def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """Get execution history"""
         try:
-            response = requests.get(f"{self.server_url}/history/{prompt_id}", timeout=10)
+            response = self.session.get(f"{self.server_url}/history/{prompt_id}", timeout=TIMEOUTS["history"])
             return response.json()
         except Exception as e:
             raise Exception(f"Failed to get history: {e}")
     
-    def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> Dict[str, Any]:
-        """Wait for workflow completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            try:
-                history = self.get_history(prompt_id)
-                
-                if prompt_id in history:
-                    status = history[prompt_id].get('status', {})
-                    if status.get('status_str') == 'success':
-                        return history[prompt_id]
-                    elif status.get('status_str') == 'error':
-                        raise Exception(f"Workflow failed: {status.get('messages', 'Unknown error')}")
-                
-                time.sleep(1)
-            except Exception as e:
-                if "not responding" in str(e):
-                    raise Exception("ComfyUI server is not running. Please check the server status.")
-                raise e
+    def watch(self, prompt_id: str, timeout: int = 300,
+              heartbeat: Optional[float] = None) -> Generator[Optional[Dict[str, Any]], None, Dict[str, Any]]:
+        """Yield the websocket events of a prompt until it finishes, then return its history entry
         
-        raise Exception("Workflow timed out")
+        With a heartbeat, None is yielded whenever that many seconds pass without
+        an event, so consumers can react (or stop) while ComfyUI is busy elsewhere.
+        Without a websocket the history is polled and only heartbeats are yielded.
+        """
+        return watch_prompt(self.events, self.get_history, prompt_id, timeout, heartbeat)
+    
+    def wait_for_completion(self, prompt_id: str, timeout: int = 300,
+                            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Wait for workflow completion using websocket events, polling history as a fallback"""
+        return run_watch(self.watch(prompt_id, timeout), on_event)
+    
+    def cancel_prompt(self, prompt_id: str) -> bool:
+        """Stop a prompt: interrupt it if it is running, drop it from the queue if pending"""
+        try:
+            response = self.session.get(f"{self.server_url}/queue", timeout=TIMEOUTS["health"])
+            queue_info = response.json()
+            running = [item[1] for item in queue_info.get("queue_running", [])]
+            pending = [item[1] for item in queue_info.get("queue_pending", [])]
+            
+            if prompt_id in running:
+                # Newer ComfyUI only interrupts the given prompt, older ones whatever runs (which is ours)
+                self.session.post(f"{self.server_url}/interrupt", json={"prompt_id": prompt_id}, timeout=TIMEOUTS["prompt"])
+            elif prompt_id in pending:
+                self.session.post(f"{self.server_url}/queue", json={"delete": [prompt_id]}, timeout=TIMEOUTS["prompt"])
+            else:
+                return False
+            print(f"Cancelled prompt {prompt_id} on {self.server_url}")
+            return True
+        except Exception as e:
+            print(f"Failed to cancel prompt {prompt_id}: {e}")
+            return False
 
 class PonyComfyUIWorkflow:
     def __init__(self):
         self.comfyui = ComfyUIManager()
+        self.async_comfyui = AsyncComfyUIManager(self.comfyui.server_url)
+        
+        # COMFYUI_BACKENDS="http://host-a:8188,http://host-b:8188" spreads prompts over several servers
+        backends = [url.strip() for url in os.environ.get("COMFYUI_BACKENDS", "").split(",") if url.strip()]
+        self.pool = ComfyUIPool(backends, client_factory=ComfyUIManager) if backends else None
+        self.async_clients: Dict[str, AsyncComfyUIManager] = {}
+        self.result_cache = ResultCache()
+        self.output_format = OutputFormat.from_env()
+        self.template = get_template()
         
     def create_workflow(self, 
                        prompt: str,
@@ -133,135 +217,208 @@ class PonyComfyUIWorkflow:
                        seed: int = None,
                        lora_weights: List[float] = None) -> Dict[str, Any]:
         """Create ComfyUI workflow for pony generation"""
+        return self.template.build(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            cfg=cfg,
+            seed=seed,
+            lora_weights=lora_weights
+        )
+    
+    @contextmanager
+    def backend(self, workflow: Dict[str, Any]) -> Iterator[ComfyUIManager]:
+        """ComfyUI client to run a workflow on: the local server, or the pool's pick"""
+        if self.pool is None:
+            # Ensure ComfyUI is running
+            if not self.comfyui.is_running:
+                if not self.comfyui.start_comfyui():
+                    raise Exception("Failed to start ComfyUI server")
+            yield self.comfyui
+        else:
+            with self.pool.acquire(workflow_model_key(workflow)) as backend:
+                yield backend.client
+    
+    def output_images(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Image descriptors of the SaveImage node in a history entry"""
+        outputs = result.get('outputs', {})
+        output_node = self.template.output_node
+        if output_node in outputs and 'images' in outputs[output_node]:
+            return outputs[output_node]['images']
+        return []
+    
+    def describe_event(self, workflow: Dict[str, Any], event: Dict[str, Any]) -> Optional[str]:
+        """Human-readable status for a ComfyUI execution event"""
+        data = event['data']
+        if event['type'] == 'execution_start':
+            return "Started on ComfyUI"
+        if event['type'] == 'executing' and data.get('node') in workflow:
+            return f"Running {workflow[data['node']]['class_type']}"
+        if event['type'] == 'progress':
+            return f"Step {data.get('value')}/{data.get('max')}"
+        if event['type'] == 'execution_error':
+            return f"Failed: {data.get('exception_message', 'Unknown error')}"
+        if event['type'] == 'execution_interrupted':
+            return "Interrupted"
+        return None
+    
+    def stream_workflow(self, workflow: Dict[str, Any], previews: bool = False,
+                        to_files: bool = False, params: Optional[List[Dict[str, Any]]] = None
+                        ) -> Generator[Tuple[Optional[Image.Image], str], None, List[Union[bytes, str]]]:
+        """Run a workflow, yielding (preview, status) as it executes, and return the output images
         
-        if seed is None:
-            seed = 3891560175039
+        Outputs are returned as encoded bytes, or with to_files as paths of
+        temporary files streamed straight from /view, carrying the workflow's
+        generation record (or one built from params[i] for the i-th image).
+        Closing the generator before it finishes cancels the prompt on ComfyUI.
+        """
+        with self.backend(workflow) as comfyui:
+            queued_at = time.time()
+            started = time.perf_counter()
+            with time_stage("comfyui_queue_prompt"):
+                prompt_id = comfyui.queue_prompt(workflow)
+            timings = {"queue_prompt_s": time.perf_counter() - started}
+            print(f"Queued workflow with ID: {prompt_id} on {comfyui.server_url}")
+            
+            preview, status = None, "Waiting for ComfyUI..."
+            finished = False
+            try:
+                yield preview, status
+                events = comfyui.watch(prompt_id, heartbeat=1.0)
+                while True:
+                    try:
+                        event = next(events)
+                    except StopIteration as done:
+                        result = done.value
+                        break
+                    if event is None:
+                        yield preview, status
+                    elif event['type'] == 'preview':
+                        if previews:
+                            preview = Image.open(io.BytesIO(event['data']['image']))
+                            yield preview, status
+                    else:
+                        status = self.describe_event(workflow, event) or status
+                        yield preview, status
+                finished = True
+            finally:
+                if not finished:
+                    comfyui.cancel_prompt(prompt_id)
             
-        if lora_weights is None:
-            lora_weights = [1.0, 1.0, 0.94, 0.9, 3.0, 0.34, 0.0]
+            timings.update(record_history_timings(result, queued_at))
+            with time_stage("comfyui_fetch"):
+                if not to_files:
+                    return [
+                        comfyui.get_image_bytes(info['filename'], info.get('subfolder', ''), info.get('type', 'output'))
+                        for info in self.output_images(result)
+                    ]
+                records = self.output_records(workflow, timings, params)
+                return [
+                    comfyui.download_image(info['filename'], info.get('subfolder', ''), info.get('type', 'output'),
+                                           record=records[min(i, len(records) - 1)])
+                    for i, info in enumerate(self.output_images(result))
+                ]
+    
+    def output_records(self, workflow: Dict[str, Any], timings: Dict[str, float],
+                       params: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Generation records of a workflow's output images, in output order"""
+        return [generation_record("comfyui", image_params, timings)
+                for image_params in params or [self.template.parameters(workflow)]]
+    
+    def run_workflow(self, workflow: Dict[str, Any], to_files: bool = False,
+                     params: Optional[List[Dict[str, Any]]] = None) -> List[Union[bytes, str]]:
+        """Queue a workflow, wait for it and download every output image"""
+        updates = self.stream_workflow(workflow, to_files=to_files, params=params)
+        while True:
+            try:
+                next(updates)
+            except StopIteration as done:
+                return done.value
+    
+    async def stream_workflow_async(self, workflow: Dict[str, Any], outputs: List[Union[bytes, str]],
+                                    previews: bool = False, to_files: bool = False,
+                                    params: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[Tuple[Optional[Image.Image], str]]:
+        """Async counterpart of stream_workflow; the output images are appended to `outputs`
         
-        # ComfyUI workflow JSON
-        workflow = {
-            "1": {
-                "class_type": "CheckpointLoaderSimple",
-                "inputs": {
-                    "ckpt_name": "realismIllustriousBy_v50FP16.safetensors"
-                }
-            },
-            "2": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["1", 0],
-                    "clip": ["1", 1],
-                    "lora_name": "Pony Realism Slider.safetensors",
-                    "strength_model": lora_weights[0],
-                    "strength_clip": lora_weights[0]
-                }
-            },
-            "3": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["2", 0],
-                    "clip": ["2", 1],
-                    "lora_name": "RealSkin_slider.safetensors",
-                    "strength_model": lora_weights[1],
-                    "strength_clip": lora_weights[1]
-                }
-            },
-            "4": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["3", 0],
-                    "clip": ["3", 1],
-                    "lora_name": "insta baddie PN.safetensors",
-                    "strength_model": lora_weights[2],
-                    "strength_clip": lora_weights[2]
-                }
-            },
-            "5": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["4", 0],
-                    "clip": ["4", 1],
-                    "lora_name": "Real_Beauty.safetensors",
-                    "strength_model": lora_weights[3],
-                    "strength_clip": lora_weights[3]
-                }
-            },
-            "6": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["5", 0],
-                    "clip": ["5", 1],
-                    "lora_name": "Pony_DetailV2.0.safetensors",
-                    "strength_model": lora_weights[4],
-                    "strength_clip": lora_weights[4]
-                }
-            },
-            "7": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["6", 0],
-                    "clip": ["6", 1],
-                    "lora_name": "perfect ass sliderV1.safetensors",
-                    "strength_model": lora_weights[5],
-                    "strength_clip": lora_weights[5]
-                }
-            },
-            "8": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "text": prompt,
-                    "clip": ["7", 1]
-                }
-            },
-            "9": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "text": negative_prompt,
-                    "clip": ["7", 1]
-                }
-            },
-            "10": {
-                "class_type": "EmptyLatentImage",
-                "inputs": {
-                    "width": width,
-                    "height": height,
-                    "batch_size": 1
-                }
-            },
-            "11": {
-                "class_type": "KSampler",
-                "inputs": {
-                    "seed": seed,
-                    "steps": steps,
-                    "cfg": cfg,
-                    "sampler_name": "dpmpp_sde",
-                    "scheduler": "normal",
-                    "denoise": 1.0,
-                    "model": ["7", 0],
-                    "positive": ["8", 0],
-                    "negative": ["9", 0],
-                    "latent_image": ["10", 0]
-                }
-            },
-            "12": {
-                "class_type": "VAEDecode",
-                "inputs": {
-                    "samples": ["11", 0],
-                    "vae": ["1", 2]
-                }
-            },
-            "13": {
-                "class_type": "SaveImage",
-                "inputs": {
-                    "filename_prefix": "pony",
-                    "images": ["12", 0]
-                }
-            }
-        }
+        Holds no thread while ComfyUI runs. Closing or cancelling the generator
+        before it finishes cancels the prompt on ComfyUI.
+        """
+        if self.pool is None:
+            if not self.comfyui.is_running:
+                if not await asyncio.to_thread(self.comfyui.start_comfyui):
+                    raise Exception("Failed to start ComfyUI server")
+            backend = None
+            client = self.async_comfyui
+        else:
+            model_key = workflow_model_key(workflow)
+            backend = await asyncio.to_thread(self.pool.select, model_key, True)
+            client = self.async_clients.setdefault(backend.url, AsyncComfyUIManager(backend.url))
         
-        return workflow
+        ok = True
+        try:
+            queued_at = time.time()
+            started = time.perf_counter()
+            with time_stage("comfyui_queue_prompt"):
+                prompt_id = await client.queue_prompt(workflow)
+            timings = {"queue_prompt_s": time.perf_counter() - started}
+            print(f"Queued workflow with ID: {prompt_id} on {client.server_url}")
+            
+            preview, status = None, "Waiting for ComfyUI..."
+            finished = False
+            try:
+                yield preview, status
+                deadline = time.time() + 300
+                events = client.watch(prompt_id, heartbeat=1.0)
+                try:
+                    async for event in events:
+                        if event is None:
+                            yield preview, status
+                        elif event['type'] == 'preview':
+                            if previews:
+                                preview = Image.open(io.BytesIO(event['data']['image']))
+                                yield preview, status
+                        else:
+                            status = self.describe_event(workflow, event) or status
+                            yield preview, status
+                finally:
+                    await events.aclose()
+                # History is written right before the completion event, poll briefly in case it lags
+                result = await client.poll_for_completion(prompt_id, deadline, interval=0.05)
+                finished = True
+            finally:
+                if not finished:
+                    await asyncio.shield(client.cancel_prompt(prompt_id))
+            
+            timings.update(record_history_timings(result, queued_at))
+            images = self.output_images(result)
+            with time_stage("comfyui_fetch"):
+                if not to_files:
+                    outputs.extend(await asyncio.gather(*[
+                        client.get_image_bytes(info['filename'], info.get('subfolder', ''), info.get('type', 'output'))
+                        for info in images
+                    ]))
+                else:
+                    records = self.output_records(workflow, timings, params)
+                    outputs.extend(await asyncio.gather(*[
+                        client.download_image(info['filename'], info.get('subfolder', ''), info.get('type', 'output'),
+                                              record=records[min(i, len(records) - 1)])
+                        for i, info in enumerate(images)
+                    ]))
+        except Exception as e:
+            ok = not is_backend_failure(e)
+            raise
+        finally:
+            if backend is not None:
+                self.pool.finish(backend, ok)
+    
+    async def run_workflow_async(self, workflow: Dict[str, Any]) -> List[bytes]:
+        """Async counterpart of run_workflow"""
+        outputs: List[bytes] = []
+        async for _ in self.stream_workflow_async(workflow, outputs):
+            pass
+        return outputs
     
     def generate_pony(self, 
                      prompt: str,
@@ -271,15 +428,17 @@ class PonyComfyUIWorkflow:
                      steps: int = 18,
                      cfg: float = 7.0,
                      seed: int = None,
-                     lora_weights: List[float] = None) -> tuple[Image.Image, str]:
-        """Generate pony image using ComfyUI workflow"""
+                     lora_weights: List[float] = None,
+                     previews: bool = True) -> Iterator[Tuple[Union[Image.Image, str, None], str]]:
+        """Generate pony image using ComfyUI workflow
+        
+        Yields (preview, status) while ComfyUI runs and (image path, message)
+        last. The image is ComfyUI's file as downloaded (re-encoded only when
+        another output format is configured) and lives in the result cache.
+        Closing the generator early interrupts the prompt on ComfyUI.
+        """
         
         try:
-            # Ensure ComfyUI is running
-            if not self.comfyui.is_running:
-                if not self.comfyui.start_comfyui():
-                    return None, "Failed to start ComfyUI server"
-            
             # Create workflow
             workflow = self.create_workflow(
                 prompt=prompt,
@@ -292,25 +451,180 @@ class PonyComfyUIWorkflow:
                 lora_weights=lora_weights
             )
             
-            # Queue workflow
-            prompt_id = self.comfyui.queue_prompt(workflow)
-            print(f"Queued workflow with ID: {prompt_id}")
+            # Identical requests are served from disk without touching ComfyUI
+            cache_key = self.output_key(workflow)
+            cached = self.result_cache.get(cache_key)
+            if cached:
+                REQUESTS.labels(outcome="cached").inc()
+                yield cached[0], "Pony served from cache!"
+                return
+            
+            # Queue the workflow on a backend, stream its progress and download the encoded output
+            paths = yield from self.stream_workflow(workflow, previews=previews, to_files=True)
+            if paths:
+                for extra in paths[1:]:
+                    os.remove(extra)
+                path = convert_file(paths[0], self.output_format)
+                stored = self.result_cache.put_files(cache_key, [path], move=True)
+                REQUESTS.labels(outcome="generated").inc()
+                yield stored[0], "Pony generated successfully with ComfyUI!"
+            else:
+                REQUESTS.labels(outcome="empty").inc()
+                yield None, "No image generated"
+                
+        except Exception as e:
+            REQUESTS.labels(outcome="error").inc()
+            yield None, f"Error: {str(e)}"
+    
+    def output_key(self, workflow: Dict[str, Any]) -> str:
+        """Result cache key of a workflow's output in the configured format"""
+        if self.output_format.format == "png":
+            # ComfyUI's own PNGs, keyed like before output formats existed
+            return request_key(workflow)
+        return request_key({"workflow": workflow, "output": self.output_format.key()})
+    
+    def create_batch_workflow(self,
+                              prompts: List[str],
+                              seeds: List[int],
+                              negative_prompt: str = "",
+                              width: int = 1024,
+                              height: int = 1024,
+                              steps: int = 18,
+                              cfg: float = 7.0,
+                              lora_weights: List[float] = None,
+                              per_seed: bool = True) -> Dict[str, Any]:
+        """Fold several prompt/seed pairs into one ComfyUI workflow"""
+        return self.template.build_batch(
+            prompts=prompts,
+            seeds=seeds,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            cfg=cfg,
+            lora_weights=lora_weights,
+            per_seed=per_seed
+        )
+    
+    def generate_batch(self,
+                       seeds: List[int],
+                       prompts: Union[str, List[str]],
+                       negative_prompt: str = "",
+                       width: int = 1024,
+                       height: int = 1024,
+                       steps: int = 18,
+                       cfg: float = 7.0,
+                       lora_weights: List[float] = None,
+                       per_seed: bool = True) -> Tuple[List[str], str]:
+        """Generate one image per seed (and prompt) in a single ComfyUI round trip
+        
+        Returns the image paths, in the result cache and each carrying its own
+        generation record, and a message. `per_seed` trades reproducibility for
+        speed, see WorkflowTemplate.build_batch.
+        """
+        
+        if isinstance(prompts, str):
+            prompts = [prompts] * len(seeds)
+        prompts, seeds = list(prompts), list(seeds)
+        
+        try:
+            workflow = self.create_batch_workflow(
+                prompts=prompts,
+                seeds=seeds,
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                steps=steps,
+                cfg=cfg,
+                lora_weights=lora_weights,
+                per_seed=per_seed
+            )
+            
+            cache_key = self.output_key(workflow)
+            cached = self.result_cache.get(cache_key)
+            if cached:
+                REQUESTS.labels(outcome="cached").inc()
+                return cached, f"{len(cached)} ponies served from cache!"
+            
+            # ImageBatch and the latent batch both keep seed order, so output i belongs to seeds[i]
+            base = self.template.parameters(workflow)
+            if per_seed:
+                params = [dict(base, prompt=prompt, seed=seed, batch_seeds=seeds) for prompt, seed in zip(prompts, seeds)]
+            else:
+                params = [dict(base, batch_index=index, batch_size=len(seeds)) for index in range(len(seeds))]
+            
+            paths = self.run_workflow(workflow, to_files=True, params=params)
+            if paths:
+                paths = [convert_file(path, self.output_format) for path in paths]
+                stored = self.result_cache.put_files(cache_key, paths, move=True)
+                REQUESTS.labels(outcome="generated").inc()
+                return stored, f"Generated {len(stored)} ponies with ComfyUI!"
+            else:
+                REQUESTS.labels(outcome="empty").inc()
+                return [], "No image generated"
+                
+        except Exception as e:
+            REQUESTS.labels(outcome="error").inc()
+            return [], f"Error: {str(e)}"
+    
+    async def generate_pony_async(self, 
+                                  prompt: str,
+                                  negative_prompt: str = "",
+                                  width: int = 1024,
+                                  height: int = 1024,
+                                  steps: int = 18,
+                                  cfg: float = 7.0,
+                                  seed: int = None,
+                                  lora_weights: List[float] = None,
+                                  previews: bool = True) -> AsyncIterator[Tuple[Union[Image.Image, str, None], str]]:
+        """Async counterpart of generate_pony, holding no thread while ComfyUI runs
+        
+        Yields (preview, status) while ComfyUI runs and (image path, message)
+        last. Closing or cancelling the generator interrupts the prompt.
+        """
+        
+        try:
+            workflow = self.create_workflow(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                steps=steps,
+                cfg=cfg,
+                seed=seed,
+                lora_weights=lora_weights
+            )
             
-            # Wait for completion
-            result = self.comfyui.wait_for_completion(prompt_id)
+            # Identical requests are served from disk without touching ComfyUI
+            cache_key = self.output_key(workflow)
+            cached = await asyncio.to_thread(self.result_cache.get, cache_key)
+            if cached:
+                REQUESTS.labels(outcome="cached").inc()
+                yield cached[0], "Pony served from cache!"
+                return
             
-            # Get generated image
-            outputs = result.get('outputs', {})
-            if '13' in outputs and 'images' in outputs['13']:
-                image_info = outputs['13']['images'][0]
-                filename = image_info['filename']
-                image = self.comfyui.get_image(filename)
-                return image, "Pony generated successfully with ComfyUI!"
+            paths: List[str] = []
+            updates = self.stream_workflow_async(workflow, paths, previews=previews, to_files=True)
+            try:
+                async for update in updates:
+                    yield update
+            finally:
+                # Closing this generator early must reach the prompt's cancellation right away
+                await updates.aclose()
+            if paths:
+                for extra in paths[1:]:
+                    os.remove(extra)
+                path = await asyncio.to_thread(convert_file, paths[0], self.output_format)
+                stored = await asyncio.to_thread(self.result_cache.put_files, cache_key, [path], True)
+                REQUESTS.labels(outcome="generated").inc()
+                yield stored[0], "Pony generated successfully with ComfyUI!"
             else:
-                return None, "No image generated"
+                REQUESTS.labels(outcome="empty").inc()
+                yield None, "No image generated"
                 
         except Exception as e:
-            return None, f"Error: {str(e)}"
+            REQUESTS.labels(outcome="error").inc()
+            yield None, f"Error: {str(e)}"
 
 # Initialize the workflow manager
 try:
@@ -322,6 +636,15 @@ except Exception as e:
     model_loaded = False
     model_error = str(e)
 
+# Bounded, prioritised queue between the UI and ComfyUI. Jobs run on the async client, so the
+# worker only dispatches them and GENERATION_MAX_RUNNING bounds the prompts in flight on ComfyUI
+scheduler = JobScheduler(
+    workers=1,
+    max_queue=int(os.environ.get("GENERATION_MAX_QUEUE", "32")),
+    name="ComfyUI",
+    max_running=int(os.environ.get("GENERATION_MAX_RUNNING", "16"))
+)
+
 def create_interface():
     with gr.Blocks(title="ComfyUI Pony Generator", theme=gr.themes.Soft()) as demo:
         if not model_loaded:
@@ -347,16 +670,8 @@ def create_interface():
                     
                     # LoRA weight controls
                     lora_controls = []
-                    lora_names = [
-                        "Pony Realism Slider",
-                        "RealSkin_slider", 
-                        "insta baddie PN",
-                        "Real_Beauty",
-                        "Pony_DetailV2.0",
-                        "perfect ass sliderV1",
-                        "Detail_Tweaker_Illustrious_BSY_V3"
-                    ]
-                    default_weights = [1.0, 1.0, 0.94, 0.9, 3.0, 0.34, 0.0]
+                    lora_names = [os.path.splitext(lora)[0] for lora in LORAS]
+                    default_weights = DEFAULT_LORA_WEIGHTS
                     
                     for i, (name, default) in enumerate(zip(lora_names, default_weights)):
                         control = gr.Slider(
@@ -376,20 +691,23 @@ def create_interface():
                     with gr.Row():
                         steps = gr.Slider(10, 50, 18, step=1, label="Steps")
                         cfg = gr.Slider(1.0, 20.0, 7.0, step=0.1, label="CFG Scale")
-                        seed = gr.Number(label="Seed", value=3891560175039, precision=0)
+                        seed = gr.Number(label="Seed", value=DEFAULT_SEED, precision=0)
                     
-                    generate_btn = gr.Button("Generate with ComfyUI", variant="primary", size="lg")
+                    with gr.Row():
+                        generate_btn = gr.Button("Generate with ComfyUI", variant="primary", size="lg")
+                        cancel_btn = gr.Button("Cancel", variant="stop", size="lg")
                     
                 with gr.Column():
-                    output_image = gr.Image(label="Generated Image", type="pil", format="png")
+                    output_image = gr.Image(label="Generated Image", type="filepath", format="png")
                     status = gr.Textbox(label="Status", interactive=False)
             
             # Event handler
-            def generate_image(prompt, negative_prompt, width, height, steps, cfg, seed, *lora_weights):
+            async def generate_image(request: gr.Request, prompt, negative_prompt, width, height, steps, cfg, seed, *lora_weights):
                 if pony_workflow is None:
-                    return None, "ComfyUI not available"
+                    yield None, "ComfyUI not available"
+                    return
                 
-                return pony_workflow.generate_pony(
+                params = dict(
                     prompt=prompt,
                     negative_prompt=negative_prompt,
                     width=width,
@@ -399,15 +717,49 @@ def create_interface():
                     seed=seed,
                     lora_weights=list(lora_weights)
                 )
+                try:
+                    job = scheduler.submit(
+                        pony_workflow.generate_pony_async,
+                        client_id=getattr(request, "session_hash", None) or "anonymous",
+                        priority=INTERACTIVE,
+                        key=request_key(params),
+                        **params
+                    )
+                except QueueFullError as e:
+                    yield None, f"Server busy: {e}. Please try again shortly."
+                    return
+                
+                future = asyncio.wrap_future(job.future)
+                shown, last_position = None, None
+                try:
+                    while not job.done():
+                        position = job.position()
+                        if position and position != last_position:
+                            yield None, f"Queued: position {position}"
+                        elif not position and job.progress is not None and job.progress is not shown:
+                            shown = job.progress
+                            yield shown
+                        last_position = position
+                        await asyncio.wait({future}, timeout=0.25)
+                    yield await future
+                except QueueFullError as e:
+                    yield None, f"Server busy: {e}"
+                finally:
+                    # Abandoned jobs are cancelled, which interrupts the prompt on ComfyUI
+                    if not job.done():
+                        scheduler.cancel(job)
             
-            generate_btn.click(
+            generate_event = generate_btn.click(
                 fn=generate_image,
                 inputs=[prompt, negative_prompt, width, height, steps, cfg, seed] + lora_controls,
-                outputs=[output_image, status]
+                outputs=[output_image, status],
+                concurrency_limit=None  # admission control happens in the scheduler
             )
+            cancel_btn.click(fn=None, cancels=[generate_event])
     
     return demo
 
 if __name__ == "__main__":
     demo = create_interface()
-    demo.launch()
+    # Gradio UI at / and Prometheus metrics at /metrics
+    launch_with_metrics(demo)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio ComfyUI client
+Keeps many prompts in flight from a single event loop with one shared websocket
+"""
+
+import asyncio
+import io
+import time
+import uuid
+from typing import AsyncIterator, Dict, Any, Optional
+
+import aiohttp
+from PIL import Image
+
+from comfyui_events import EventParser, finished_entry, websocket_url, is_completion_event
+from image_output import CHUNK_SIZE, ChunkWriter
+
+
+class AsyncComfyUIManager:
+    """Async counterpart of ComfyUIManager (queue_prompt, watch, completion waiting, get_image, cancel_prompt).
+
+    One websocket per client id is shared by every prompt in flight; a
+    listener task routes each event to the queue of the prompt it belongs
+    to. When the socket is unavailable or drops, watchers fall back to
+    polling the history endpoint. A client serves one event loop at a time.
+    """
+
+    def __init__(self, server_url: str = "http://127.0.0.1:8188",
+                 max_connections: int = 100,
+                 request_timeout: float = 60.0):
+        self.server_url = server_url
+        self.client_id = str(uuid.uuid4())
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._queues: Dict[str, "asyncio.Queue[Dict[str, Any]]"] = {}
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the session of the event loop the client is bound to
+
+        The session, listener and prompt queues all belong to one loop. Using
+        the client from another loop raises RuntimeError while the first one
+        is still open; once it is closed (e.g. asyncio.run returned) nothing
+        can be waiting on it any more and the client moves to the new loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not None and self._loop is not loop:
+            if not self._loop.is_closed():
+                raise RuntimeError(f"Async ComfyUI client for {self.server_url} is bound to another event loop")
+            if self._session is not None and not self._session.closed:
+                # Its loop is gone, so the session cannot be closed on it; drop it without touching the loop
+                self._session.detach()
+            self._session = None
+            self._loop = None
+        if self._session is None or self._session.closed:
+            self._loop = loop
+            self._listener = None
+            self._connected = None
+            self._queues = {}
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            )
+        return self._session
+
+    async def close(self):
+        """Stop the websocket listener and close the HTTP session"""
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def __aenter__(self):
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def queue_prompt(self, workflow: Dict[str, Any]) -> str:
+        """Queue a workflow for execution"""
+        session = await self._get_session()
+        await self._ensure_listener()
+        payload = {"prompt": workflow, "client_id": self.client_id}
+
+        try:
+            async with session.post(f"{self.server_url}/prompt", json=payload) as response:
+                if response.status == 200:
+                    return (await response.json())['prompt_id']
+                raise Exception(f"Failed to queue prompt: {response.status}")
+        except aiohttp.ClientError as e:
+            raise Exception(f"ComfyUI server not responding: {e}")
+
+    async def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        """Get execution history"""
+        session = await self._get_session()
+        try:
+            async with session.get(f"{self.server_url}/history/{prompt_id}") as response:
+                return await response.json()
+        except aiohttp.ClientError as e:
+            raise Exception(f"Failed to get history: {e}")
+
+    async def get_image_bytes(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
+        """Download the encoded image from ComfyUI"""
+        session = await self._get_session()
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        try:
+            async with session.get(f"{self.server_url}/view", params=params) as response:
+                if response.status == 200:
+                    return await response.read()
+                raise Exception(f"Failed to get image: {response.status}")
+        except aiohttp.ClientError as e:
+            raise Exception(f"Failed to retrieve image: {e}")
+
+    async def download_image(self, filename: str, subfolder: str = "", folder_type: str = "output",
+                             directory: Optional[str] = None, record: Optional[Dict[str, Any]] = None) -> str:
+        """Download the encoded image file into a local file, without decoding it
+
+        Each chunk is written as it arrives, so no job holds a whole image in
+        memory. A generation record is spliced into the PNG header on the way.
+        """
+        session = await self._get_session()
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        writer = ChunkWriter(directory, record)
+        try:
+            async with session.get(f"{self.server_url}/view", params=params) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to get image: {response.status}")
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await asyncio.to_thread(writer.write, chunk)
+            return await asyncio.to_thread(writer.close)
+        except aiohttp.ClientError as e:
+            writer.abort()
+            raise Exception(f"Failed to retrieve image: {e}")
+        except BaseException:
+            writer.abort()
+            raise
+
+    async def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> Image.Image:
+        """Get generated image from ComfyUI, decoding off the event loop"""
+        data = await self.get_image_bytes(filename, subfolder, folder_type)
+        return await asyncio.to_thread(lambda: Image.open(io.BytesIO(data)))
+
+    async def _finished_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Return the history entry if the prompt has finished, None otherwise"""
+        return finished_entry(await self.get_history(prompt_id), prompt_id)
+
+    async def poll_for_completion(self, prompt_id: str, deadline: float, interval: float = 1.0) -> Dict[str, Any]:
+        """Poll the history endpoint until the workflow finishes"""
+        while time.time() < deadline:
+            result = await self._finished_history(prompt_id)
+            if result is not None:
+                return result
+            await asyncio.sleep(interval)
+        raise Exception("Workflow timed out")
+
+    async def watch(self, prompt_id: str, timeout: int = 300,
+                    heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yield the websocket events of a prompt until it finishes
+
+        With a heartbeat, None is yielded whenever that many seconds pass without
+        an event. Without a websocket the history is polled and only heartbeats
+        are yielded. Follow with poll_for_completion for the history entry.
+        """
+        deadline = time.time() + timeout
+        interval = heartbeat or 1.0
+
+        if await self._ensure_listener():
+            events = self._queues.setdefault(prompt_id, asyncio.Queue())
+            try:
+                # The prompt may have finished before we subscribed
+                if await self._finished_history(prompt_id) is not None:
+                    return
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Exception("Workflow timed out")
+                    try:
+                        event = await asyncio.wait_for(events.get(), remaining if heartbeat is None else min(remaining, heartbeat))
+                    except asyncio.TimeoutError:
+                        if heartbeat is None:
+                            raise Exception("Workflow timed out")
+                        yield None
+                        continue
+                    if event['type'] == 'disconnected':
+                        print("Websocket dropped, falling back to history polling")
+                        break
+                    yield event
+                    if is_completion_event(event):
+                        return
+            finally:
+                self._queues.pop(prompt_id, None)
+
+        while await self._finished_history(prompt_id) is None:
+            if time.time() >= deadline:
+                raise Exception("Workflow timed out")
+            yield None
+            await asyncio.sleep(interval)
+
+    async def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> Dict[str, Any]:
+        """Wait for workflow completion without holding a thread"""
+        deadline = time.time() + timeout
+        async for _ in self.watch(prompt_id, timeout):
+            pass
+        # History is written right before the completion event, poll briefly in case it lags
+        return await self.poll_for_completion(prompt_id, deadline, interval=0.05)
+
+    async def cancel_prompt(self, prompt_id: str) -> bool:
+        """Stop a prompt: interrupt it if it is running, drop it from the queue if pending"""
+        session = await self._get_session()
+        try:
+            async with session.get(f"{self.server_url}/queue") as response:
+                queue_info = await response.json()
+            running = [item[1] for item in queue_info.get("queue_running", [])]
+            pending = [item[1] for item in queue_info.get("queue_pending", [])]
+
+            if prompt_id in running:
+                # Newer ComfyUI only interrupts the given prompt, older ones whatever runs (which is ours)
+                async with session.post(f"{self.server_url}/interrupt", json={"prompt_id": prompt_id}):
+                    pass
+            elif prompt_id in pending:
+                async with session.post(f"{self.server_url}/queue", json={"delete": [prompt_id]}):
+                    pass
+            else:
+                return False
+            print(f"Cancelled prompt {prompt_id} on {self.server_url}")
+            return True
+        except Exception as e:
+            print(f"Failed to cancel prompt {prompt_id}: {e}")
+            return False
+
+    async def _ensure_listener(self) -> bool:
+        """Start the shared websocket listener, returns False if it cannot connect"""
+        await self._get_session()
+        if self._listener is None or self._listener.done():
+            self._connected = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen(self._connected))
+        # Every caller waits, a prompt queued before the socket is up would have its events missed
+        await self._connected.wait()
+        return not self._listener.done()
+
+    async def _listen(self, connected: asyncio.Event):
+        session = await self._get_session()
+        parser = EventParser()
+        try:
+            async with session.ws_connect(websocket_url(self.server_url, self.client_id),
+                                          heartbeat=30, timeout=5) as ws:
+                connected.set()
+                async for message in ws:
+                    if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                        continue
+                    event = parser.parse(message.data)
+                    if event is None:
+                        continue
+                    events = self._queues.get(event["data"].get("prompt_id"))
+                    if events is not None:
+                        events.put_nowait(event)
+        except Exception as e:
+            print(f"ComfyUI websocket unavailable: {e}")
+        finally:
+            connected.set()
+            # Wake every watcher so it falls back to history polling
+            for events in list(self._queues.values()):
+                events.put_nowait({"type": "disconnected", "data": {}})
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+ComfyUI websocket event stream
+Listens on /ws?clientId= and fans execution events out per prompt
+"""
+
+import json
+import queue
+import struct
+import threading
+import time
+from typing import Callable, Dict, Any, Generator, Optional
+
+import websocket
+
+# Binary websocket message types sent by ComfyUI
+PREVIEW_IMAGE = 1
+PREVIEW_FORMATS = {1: "JPEG", 2: "PNG"}
+
+# Event types that end the execution of a prompt
+TERMINAL_EVENTS = ("execution_success", "execution_error", "execution_interrupted")
+
+
+def websocket_url(server_url: str, client_id: str) -> str:
+    """Build the websocket URL for a ComfyUI server"""
+    if server_url.startswith("https://"):
+        base = "wss://" + server_url[len("https://"):]
+    elif server_url.startswith("http://"):
+        base = "ws://" + server_url[len("http://"):]
+    else:
+        base = server_url
+    return f"{base.rstrip('/')}/ws?clientId={client_id}"
+
+
+def is_completion_event(event: Dict[str, Any]) -> bool:
+    """Whether an event marks the end of a prompt's execution"""
+    if event["type"] in TERMINAL_EVENTS:
+        return True
+    # ComfyUI signals the end of a prompt with an "executing" message for node None
+    return event["type"] == "executing" and event["data"].get("node") is None
+
+
+def finished_entry(history: Dict[str, Any], prompt_id: str) -> Optional[Dict[str, Any]]:
+    """History entry of a prompt that finished successfully, None while it runs; raises if it failed"""
+    if prompt_id in history:
+        status = history[prompt_id].get('status', {})
+        if status.get('status_str') == 'success':
+            return history[prompt_id]
+        elif status.get('status_str') == 'error':
+            raise Exception(f"Workflow failed: {status.get('messages', 'Unknown error')}")
+    return None
+
+
+def poll_history(get_history: Callable[[str], Dict[str, Any]], prompt_id: str, deadline: float,
+                 interval: float = 1.0) -> Generator[None, None, Dict[str, Any]]:
+    """Poll the history endpoint until the prompt finishes, yielding a heartbeat per poll"""
+    while True:
+        result = finished_entry(get_history(prompt_id), prompt_id)
+        if result is not None:
+            return result
+        if time.time() >= deadline:
+            raise Exception("Workflow timed out")
+        yield None
+        time.sleep(interval)
+
+
+def run_watch(watch: Generator[Optional[Dict[str, Any]], None, Dict[str, Any]],
+              on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Drive a watch_prompt/poll_history generator to the end, returns the history entry"""
+    while True:
+        try:
+            event = next(watch)
+        except StopIteration as done:
+            return done.value
+        if event is not None and on_event is not None:
+            on_event(event)
+
+
+def watch_prompt(stream: "ComfyUIEventStream", get_history: Callable[[str], Dict[str, Any]], prompt_id: str,
+                 timeout: float = 300,
+                 heartbeat: Optional[float] = None) -> Generator[Optional[Dict[str, Any]], None, Dict[str, Any]]:
+    """Yield the websocket events of a prompt until it finishes, then return its history entry
+
+    With a heartbeat, None is yielded whenever that many seconds pass without
+    an event, so consumers can react (or stop) while ComfyUI is busy elsewhere.
+    Without a websocket, or once it drops, the history is polled and only
+    heartbeats are yielded.
+    """
+    deadline = time.time() + timeout
+
+    if not stream.ensure_connected():
+        return (yield from poll_history(get_history, prompt_id, deadline, heartbeat or 1.0))
+
+    events = stream.subscribe(prompt_id)
+    try:
+        # The prompt may have finished before we subscribed
+        result = finished_entry(get_history(prompt_id), prompt_id)
+        if result is not None:
+            return result
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Exception("Workflow timed out")
+            try:
+                event = events.get(timeout=remaining if heartbeat is None else min(remaining, heartbeat))
+            except queue.Empty:
+                if heartbeat is None:
+                    raise Exception("Workflow timed out")
+                yield None
+                continue
+
+            if event['type'] == 'disconnected':
+                print("Websocket dropped, falling back to history polling")
+                return (yield from poll_history(get_history, prompt_id, deadline, heartbeat or 1.0))
+            yield event
+            if is_completion_event(event):
+                break
+    finally:
+        stream.unsubscribe(prompt_id)
+
+    # History is written right before the completion event, poll briefly in case it lags
+    return run_watch(poll_history(get_history, prompt_id, deadline, interval=0.05))
+
+
+class EventParser:
+    """Turns raw websocket messages into event dicts.
+
+    Binary preview frames carry no prompt id, so the parser remembers which
+    prompt ComfyUI is executing and attributes previews to it.
+    """
+
+    def __init__(self):
+        self.executing_prompt: Optional[str] = None
+
+    def parse(self, message) -> Optional[Dict[str, Any]]:
+        """Event dict of a text or binary message, None for anything else"""
+        if isinstance(message, bytes):
+            if len(message) < 8:
+                return None
+            event_type, image_type = struct.unpack(">II", message[:8])
+            if event_type != PREVIEW_IMAGE:
+                return None
+            return {
+                "type": "preview",
+                "data": {
+                    "prompt_id": self.executing_prompt,
+                    "format": PREVIEW_FORMATS.get(image_type, "JPEG"),
+                    "image": message[8:],
+                },
+            }
+
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return None
+        if not isinstance(event, dict) or "type" not in event:
+            return None
+        event.setdefault("data", {})
+
+        # Previews carry no prompt id, remember which prompt is on the GPU
+        if event["type"] == "executing":
+            node = event["data"].get("node")
+            self.executing_prompt = event["data"].get("prompt_id") if node is not None else None
+        return event
+
+
+class ComfyUIEventStream:
+    """Single websocket connection shared by all prompts of one client_id.
+
+    ComfyUI keeps one socket per client id, so every in-flight prompt of a
+    client has to be served from the same connection. A reader thread routes
+    each message to the queue of the prompt it belongs to.
+    """
+
+    def __init__(self, server_url: str, client_id: str, connect_timeout: float = 5.0):
+        self.url = websocket_url(server_url, client_id)
+        self.connect_timeout = connect_timeout
+        self.connected = False
+        self._ws = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._queues: Dict[str, "queue.Queue[Dict[str, Any]]"] = {}
+        self._parser = EventParser()
+
+    def ensure_connected(self) -> bool:
+        """Connect the websocket if needed, returns False if it is unavailable"""
+        with self._lock:
+            if self.connected:
+                return True
+            try:
+                ws = websocket.WebSocket()
+                ws.connect(self.url, timeout=self.connect_timeout)
+                ws.settimeout(None)
+            except Exception as e:
+                print(f"ComfyUI websocket unavailable: {e}")
+                return False
+
+            self._ws = ws
+            self.connected = True
+            self._thread = threading.Thread(target=self._run, args=(ws,), daemon=True)
+            self._thread.start()
+            return True
+
+    def subscribe(self, prompt_id: str) -> "queue.Queue[Dict[str, Any]]":
+        """Register interest in the events of a prompt"""
+        with self._lock:
+            return self._queues.setdefault(prompt_id, queue.Queue())
+
+    def unsubscribe(self, prompt_id: str):
+        """Stop routing events for a prompt"""
+        with self._lock:
+            self._queues.pop(prompt_id, None)
+
+    def close(self):
+        """Close the websocket, waiting prompts fall back to polling"""
+        with self._lock:
+            ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, event: Dict[str, Any]):
+        prompt_id = event["data"].get("prompt_id")
+        with self._lock:
+            target = self._queues.get(prompt_id) if prompt_id else None
+        if target is not None:
+            target.put(event)
+
+    def _run(self, ws):
+        try:
+            while True:
+                message = ws.recv()
+                if not message:
+                    break
+                event = self._parser.parse(message)
+                if event is not None:
+                    self._dispatch(event)
+        except Exception as e:
+            print(f"ComfyUI websocket closed: {e}")
+        finally:
+            with self._lock:
+                self.connected = False
+                self._ws = None
+                self._parser.executing_prompt = None
+                waiting = list(self._queues.values())
+            for target in waiting:
+                target.put({"type": "disconnected", "data": {}})
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP session layer for ComfyUI API calls
+Keeps connections alive in a pool instead of opening a socket per request
+"""
+
+import os
+import threading
+from typing import Dict, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = int(os.environ.get("COMFYUI_HTTP_POOL_SIZE", "32"))
+DEFAULT_RETRIES = int(os.environ.get("COMFYUI_HTTP_RETRIES", "3"))
+DEFAULT_BACKOFF = float(os.environ.get("COMFYUI_HTTP_BACKOFF", "0.2"))
+
+# (connect, read) timeouts in seconds per kind of call
+TIMEOUTS = {
+    "prompt": (3.0, 10.0),
+    "history": (3.0, 10.0),
+    "view": (3.0, 60.0),
+    "health": (1.0, 1.0),
+}
+
+Timeout = Union[float, Tuple[float, float]]
+
+_sessions: Dict[Tuple[int, int, float], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE,
+                   retries: int = DEFAULT_RETRIES,
+                   backoff_factor: float = DEFAULT_BACKOFF) -> requests.Session:
+    """Create a keep-alive session with a bounded connection pool and retries.
+
+    Read and status retries only apply to idempotent methods, so a POST
+    /prompt is retried when the connection fails but is never queued twice.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry, pool_block=False)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(pool_size: int = DEFAULT_POOL_SIZE,
+                retries: int = DEFAULT_RETRIES,
+                backoff_factor: float = DEFAULT_BACKOFF) -> requests.Session:
+    """Return the process-wide session for the given pool settings"""
+    key = (pool_size, retries, backoff_factor)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = create_session(pool_size, retries, backoff_factor)
+            _sessions[key] = session
+        return session
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of ComfyUI backends with load-aware dispatch
+Routes each prompt to the least-loaded healthy server, preferring model affinity
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from comfyui_http import get_session, TIMEOUTS
+
+ModelKey = Tuple[Any, ...]
+
+
+def workflow_model_key(workflow: Dict[str, Any]) -> ModelKey:
+    """Checkpoint and LoRA set a workflow needs loaded, used for backend affinity"""
+    checkpoints = []
+    loras = []
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        if node.get("class_type") == "CheckpointLoaderSimple":
+            checkpoints.append(inputs.get("ckpt_name"))
+        elif node.get("class_type") == "LoraLoader":
+            loras.append((inputs.get("lora_name"), inputs.get("strength_model"), inputs.get("strength_clip")))
+    return (tuple(sorted(checkpoints)), tuple(sorted(loras)))
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """Whether an error means the backend itself is unreachable"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return "not responding" in str(error)
+
+
+class ComfyUIBackend:
+    """One ComfyUI server and what the pool knows about it"""
+
+    def __init__(self, url: str, client: Any):
+        self.url = url.rstrip("/")
+        self.client = client
+        self.healthy = True
+        self.failures = 0
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.vram_free = 0
+        self.model_key: Optional[ModelKey] = None
+        self.last_checked = 0.0
+
+    @property
+    def load(self) -> int:
+        """Prompts queued or running on the server plus ours not yet visible in /queue"""
+        return max(self.queue_depth, self.in_flight)
+
+    def __repr__(self):
+        return f"ComfyUIBackend({self.url!r}, healthy={self.healthy}, load={self.load})"
+
+
+class ComfyUIPool:
+    """Dispatches prompts over N ComfyUI servers (local processes or remote URLs).
+
+    Backends are health-checked through /system_stats and /queue at most every
+    `health_interval` seconds, by one caller at a time while the others use the
+    last results. A backend that fails `max_failures` checks or requests in a
+    row is down: it is no longer selected and only re-probed every
+    `retry_interval` seconds, so it rejoins once it recovers (remove_backend
+    drops one for good). Selection picks the lowest load; a backend
+    whose last prompt used the same checkpoint/LoRA set wins ties within
+    `affinity_slack` queued prompts, since ComfyUI then skips reloading and
+    re-patching the model.
+    """
+
+    def __init__(self, urls: List[str], client_factory: Callable[[str], Any],
+                 session: Optional[requests.Session] = None,
+                 health_interval: float = 5.0, max_failures: int = 3, affinity_slack: int = 1,
+                 retry_interval: float = 60.0):
+        self.client_factory = client_factory
+        self.session = session if session is not None else get_session()
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.affinity_slack = affinity_slack
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._backends: Dict[str, ComfyUIBackend] = {}
+        for url in urls:
+            self.add_backend(url)
+
+    @property
+    def backends(self) -> List[ComfyUIBackend]:
+        with self._lock:
+            return list(self._backends.values())
+
+    def add_backend(self, url: str) -> ComfyUIBackend:
+        backend = ComfyUIBackend(url, self.client_factory(url.rstrip("/")))
+        with self._lock:
+            self._backends[backend.url] = backend
+        return backend
+
+    def remove_backend(self, url: str):
+        with self._lock:
+            backend = self._backends.pop(url.rstrip("/"), None)
+        if backend is not None:
+            print(f"Removed ComfyUI backend {backend.url}")
+
+    def check(self, backend: ComfyUIBackend) -> bool:
+        """Refresh one backend's health, queue depth and free VRAM"""
+        try:
+            stats = self.session.get(f"{backend.url}/system_stats", timeout=TIMEOUTS["health"])
+            queue = self.session.get(f"{backend.url}/queue", timeout=TIMEOUTS["health"])
+            if stats.status_code != 200 or queue.status_code != 200:
+                raise Exception(f"HTTP {stats.status_code}/{queue.status_code}")
+            queue_info = queue.json()
+            backend.queue_depth = len(queue_info.get("queue_running", [])) + len(queue_info.get("queue_pending", []))
+            backend.vram_free = sum(device.get("vram_free", 0) for device in stats.json().get("devices", []))
+            self._mark(backend, ok=True)
+        except Exception as e:
+            print(f"ComfyUI backend {backend.url} health check failed: {e}")
+            self._mark(backend, ok=False)
+        backend.last_checked = time.monotonic()
+        return backend.healthy
+
+    def is_down(self, backend: ComfyUIBackend) -> bool:
+        return backend.failures >= self.max_failures
+
+    def refresh(self, force: bool = False):
+        """Health-check backends whose information is stale
+
+        Without `force` this returns at once if another caller is already
+        checking. With it, it waits for that check and then re-checks every
+        backend not checked since the call began; down backends still wait
+        for their retry interval.
+        """
+        started = time.monotonic()
+        if not self._probe_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            for backend in self.backends:
+                if self.is_down(backend):
+                    stale = now - backend.last_checked >= self.retry_interval
+                elif force:
+                    stale = backend.last_checked < started
+                else:
+                    stale = now - backend.last_checked >= self.health_interval
+                if stale:
+                    self.check(backend)
+        finally:
+            self._probe_lock.release()
+
+    def _mark(self, backend: ComfyUIBackend, ok: bool):
+        if ok:
+            if self.is_down(backend):
+                print(f"ComfyUI backend {backend.url} is back")
+            backend.failures = 0
+            backend.healthy = True
+            return
+        backend.failures += 1
+        backend.healthy = False
+        if backend.failures == self.max_failures:
+            print(f"ComfyUI backend {backend.url} is down, re-probing every {self.retry_interval:.0f}s")
+
+    def select(self, model_key: Optional[ModelKey] = None, reserve: bool = False) -> ComfyUIBackend:
+        """Pick the backend for a prompt, optionally reserving a slot on it atomically"""
+        self.refresh()
+        candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            # Everything looked down at the last check, look again before giving up
+            self.refresh(force=True)
+            candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            raise Exception("No healthy ComfyUI backend available")
+
+        def score(backend: ComfyUIBackend):
+            load = backend.load
+            if model_key is not None and backend.model_key == model_key:
+                load -= self.affinity_slack + 0.5
+            return (load, -backend.vram_free)
+
+        with self._lock:
+            backend = min(candidates, key=score)
+            if reserve:
+                self._begin(backend, model_key)
+            return backend
+
+    def _begin(self, backend: ComfyUIBackend, model_key: Optional[ModelKey]):
+        backend.in_flight += 1
+        backend.queue_depth += 1
+        if model_key is not None:
+            backend.model_key = model_key
+
+    def begin(self, backend: ComfyUIBackend, model_key: Optional[ModelKey] = None):
+        """Account for a prompt dispatched to a backend"""
+        with self._lock:
+            self._begin(backend, model_key)
+
+    def finish(self, backend: ComfyUIBackend, ok: bool = True):
+        """Account for a finished prompt, failures count towards marking the backend down"""
+        with self._lock:
+            backend.in_flight = max(0, backend.in_flight - 1)
+            backend.queue_depth = max(0, backend.queue_depth - 1)
+        if not ok:
+            self._mark(backend, ok=False)
+
+    @contextmanager
+    def acquire(self, model_key: Optional[ModelKey] = None) -> Iterator[ComfyUIBackend]:
+        """Select a backend and hold a slot on it for the duration of the block"""
+        backend = self.select(model_key, reserve=True)
+        ok = True
+        try:
+            yield backend
+        except Exception as e:
+            # Workflow errors are not the backend's fault, connection failures are
+            ok = not is_backend_failure(e)
+            raise
+        finally:
+            self.finish(backend, ok)
@@ -13,23 +13,29 @@ import io
 from PIL import Image
 from typing import Dict, Any, Optional
 
+from comfyui_events import ComfyUIEventStream, run_watch, watch_prompt
+from comfyui_http import get_session, TIMEOUTS
+from workflow_template import get_template
+
 class ComfyUIAPI:
-    def __init__(self, server_url: str = "http://127.0.0.1:8188"):
+    def __init__(self, server_url: str = "http://127.0.0.1:8188", session: Optional[requests.Session] = None):
         self.server_url = server_url
         self.client_id = str(uuid.uuid4())
+        self.session = session if session is not None else get_session()
+        self.events = ComfyUIEventStream(server_url, self.client_id)
         
     def queue_prompt(self, prompt: Dict[str, Any]) -> str:
         """Queue a prompt for execution and return the prompt ID"""
         p = {"prompt": prompt, "client_id": self.client_id}
         data = json.dumps(p).encode('utf-8')
         
-        response = requests.post(f"{self.server_url}/prompt", data=data)
+        response = self.session.post(f"{self.server_url}/prompt", data=data, timeout=TIMEOUTS["prompt"])
         return response.json()['prompt_id']
     
     def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> Image.Image:
         """Get an image from ComfyUI server"""
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-        response = requests.get(f"{self.server_url}/view", params=data)
+        response = self.session.get(f"{self.server_url}/view", params=data, timeout=TIMEOUTS["view"])
         
         if response.status_code == 200:
             return Image.open(io.BytesIO(response.content))
@@ -38,31 +44,17 @@ class ComfyUIAPI:
     
     def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """Get execution history for a prompt"""
-        response = requests.get(f"{self.server_url}/history/{prompt_id}")
+        response = self.session.get(f"{self.server_url}/history/{prompt_id}", timeout=TIMEOUTS["history"])
         return response.json()
     
     def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> Dict[str, Any]:
-        """Wait for workflow completion and return results"""
-        import time
-        
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            history = self.get_history(prompt_id)
-            
-            if prompt_id in history:
-                status = history[prompt_id].get('status', {})
-                if status.get('status_str') == 'success':
-                    return history[prompt_id]
-                elif status.get('status_str') == 'error':
-                    raise Exception(f"Workflow failed: {status.get('messages', 'Unknown error')}")
-            
-            time.sleep(1)
-        
-        raise Exception("Workflow timed out")
+        """Wait for workflow completion via websocket events and return results"""
+        return run_watch(watch_prompt(self.events, self.get_history, prompt_id, timeout))
 
 class PonyComfyUIWorkflow:
     def __init__(self, server_url: str = "http://127.0.0.1:8188"):
         self.api = ComfyUIAPI(server_url)
+        self.template = get_template()
         
     def create_pony_workflow(self, 
                            prompt: str,
@@ -73,82 +65,17 @@ class PonyComfyUIWorkflow:
                            cfg: float = 7.0,
                            seed: int = None) -> Dict[str, Any]:
         """Create a ComfyUI workflow for pony generation"""
-        
-        if seed is None:
-            seed = 3891560175039
-            
-        # This is a simplified workflow - you'd need to create the actual ComfyUI workflow JSON
-        workflow = {
-            "1": {
-                "class_type": "CheckpointLoaderSimple",
-                "inputs": {
-                    "ckpt_name": "realismIllustriousBy_v50FP16.safetensors"
-                }
-            },
-            "2": {
-                "class_type": "LoraLoader",
-                "inputs": {
-                    "model": ["1", 0],
-                    "clip": ["1", 1],
-                    "lora_name": "Pony Realism Slider.safetensors",
-                    "strength_model": 1.0,
-                    "strength_clip": 1.0
-                }
-            },
-            "3": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "text": prompt,
-                    "clip": ["2", 1]
-                }
-            },
-            "4": {
-                "class_type": "CLIPTextEncode",
-                "inputs": {
-                    "text": negative_prompt,
-                    "clip": ["2", 1]
-                }
-            },
-            "5": {
-                "class_type": "KSampler",
-                "inputs": {
-                    "seed": seed,
-                    "steps": steps,
-                    "cfg": cfg,
-                    "sampler_name": "dpmpp_sde",
-                    "scheduler": "normal",
-                    "denoise": 1.0,
-                    "model": ["2", 0],
-                    "positive": ["3", 0],
-                    "negative": ["4", 0],
-                    "latent_image": ["6", 0]
-                }
-            },
-            "6": {
-                "class_type": "EmptyLatentImage",
-                "inputs": {
-                    "width": width,
-                    "height": height,
-                    "batch_size": 1
-                }
-            },
-            "7": {
-                "class_type": "VAEDecode",
-                "inputs": {
-                    "samples": ["5", 0],
-                    "vae": ["1", 2]
-                }
-            },
-            "8": {
-                "class_type": "SaveImage",
-                "inputs": {
-                    "filename_prefix": "pony",
-                    "images": ["7", 0]
-                }
-            }
-        }
-        
-        return workflow
+        # Only the Pony Realism Slider LoRA at full strength, the rest are skipped
+        return self.template.build(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            cfg=cfg,
+            seed=seed,
+            lora_weights=[1.0]
+        )
     
     def generate_pony(self, 
                      prompt: str,
@@ -180,8 +107,9 @@ class PonyComfyUIWorkflow:
         
         # Get the generated image
         outputs = result.get('outputs', {})
-        if '8' in outputs and 'images' in outputs['8']:
-            image_info = outputs['8']['images'][0]
+        output_node = self.template.output_node
+        if output_node in outputs and 'images' in outputs[output_node]:
+            image_info = outputs[output_node]['images'][0]
             filename = image_info['filename']
             return self.api.get_image(filename)
         else:
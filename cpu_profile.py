@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+CPU inference profile for the deployments without a GPU
+Picks bfloat16 or float32 from the CPU's instruction set, sizes the torch thread pools, and optionally compiles the UNet
+"""
+
+import os
+import platform
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import ContextManager, Dict, List, Optional
+
+import psutil
+import torch
+
+# "auto" picks bfloat16 on CPUs with native bf16 instructions and float32 elsewhere
+CPU_DTYPE = os.environ.get("CPU_DTYPE", "auto")
+# Intra-op threads, 0 means one per physical core
+CPU_THREADS = int(os.environ.get("CPU_THREADS", "0"))
+# Inter-op threads: the pipelines run one op after another, the app's own threads do the overlapping
+CPU_INTEROP_THREADS = int(os.environ.get("CPU_INTEROP_THREADS", "1"))
+CPU_CHANNELS_LAST = os.environ.get("CPU_CHANNELS_LAST", "1") == "1"
+# torch.compile the UNet: faster steps after a slow first request per resolution, needs a C++ compiler
+CPU_COMPILE = os.environ.get("CPU_COMPILE", "0") == "1"
+
+# /proc/cpuinfo flags of CPUs that compute bfloat16 natively (AVX512-BF16 on Cooper Lake/Zen 4, AMX on Sapphire Rapids)
+BF16_FLAGS = ("avx512_bf16", "amx_bf16")
+
+DTYPES = {"bfloat16": torch.bfloat16, "float32": torch.float32}
+
+
+def cpu_flags() -> List[str]:
+    """Instruction set flags of the first CPU, empty where /proc/cpuinfo does not exist"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return line.split(":", 1)[1].split()
+    except OSError:
+        pass
+    return []
+
+
+def native_bf16() -> bool:
+    """Whether bfloat16 matmuls and convolutions run natively rather than emulated (slower than float32)"""
+    if platform.machine().lower() in ("x86_64", "amd64"):
+        return any(flag in BF16_FLAGS for flag in cpu_flags())
+    # Armv8.6 BF16 extension (Graviton3, Neoverse V1), reported as "bf16"
+    return "bf16" in cpu_flags()
+
+
+def physical_cores() -> int:
+    return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+
+
+@dataclass(frozen=True)
+class CpuProfile:
+    """How a pipeline runs on CPU.
+
+    The checkpoints are float16, which CPUs cannot compute in: under
+    torch.autocast("cpu") the convolutions fail on the mixed dtypes, and
+    plain float16 kernels are emulated. Weights are instead held in
+    bfloat16 where the CPU has native bf16 instructions, float32 otherwise,
+    and run without autocast. Convolution weights go channels-last, the
+    layout oneDNN's CPU kernels use, so they are not reordered on every
+    call. Intra-op threads default to the physical cores, as hyperthreads
+    only contend for the same vector units.
+    """
+
+    dtype: torch.dtype
+    threads: int
+    interop_threads: int
+    channels_last: bool = CPU_CHANNELS_LAST
+    compile: bool = CPU_COMPILE
+
+    @classmethod
+    def from_env(cls) -> "CpuProfile":
+        if CPU_DTYPE == "auto":
+            dtype = torch.bfloat16 if native_bf16() else torch.float32
+        elif CPU_DTYPE in DTYPES:
+            dtype = DTYPES[CPU_DTYPE]
+        else:
+            raise ValueError(f"Unknown CPU_DTYPE {CPU_DTYPE!r}, expected auto or one of {list(DTYPES)}")
+        return cls(dtype, CPU_THREADS or physical_cores(), CPU_INTEROP_THREADS)
+
+    def set_threads(self):
+        torch.set_num_threads(self.threads)
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work; keep whatever is running
+            pass
+
+    def apply(self, pipe):
+        """Move a pipeline to the CPU in this profile's dtype and layout"""
+        self.set_threads()
+        pipe.to("cpu", self.dtype)
+        if self.channels_last:
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+        if self.compile:
+            # In place, so the LoRA manager and pipeline still see a UNet2DConditionModel
+            pipe.unet.compile(dynamic=False)
+        return pipe
+
+    def autocast(self) -> ContextManager:
+        """Context to run the pipeline in: weights are already in the compute dtype, so no autocast"""
+        return nullcontext()
+
+    def comfyui_args(self) -> List[str]:
+        """ComfyUI flags for the same precision (it runs float32 on --cpu by default)"""
+        if self.dtype == torch.bfloat16:
+            return ["--bf16-unet", "--bf16-vae", "--bf16-text-enc"]
+        return []
+
+    def environ(self, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Environment sizing a child process's OpenMP/MKL thread pools like this process"""
+        env = dict(os.environ if base is None else base)
+        env.setdefault("OMP_NUM_THREADS", str(self.threads))
+        env.setdefault("MKL_NUM_THREADS", str(self.threads))
+        return env
+
+    def describe(self) -> str:
+        dtype = str(self.dtype).replace("torch.", "")
+        return (f"{dtype}, {self.threads} threads ({self.interop_threads} inter-op)"
+                + (", channels-last" if self.channels_last else "")
+                + (", compiled UNet" if self.compile else ""))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Generation records embedded in output images
+Request parameters and per-stage timings as a PNG iTXt chunk before the pixel data (EXIF UserComment for WebP/JPEG)
+"""
+
+import json
+import struct
+import time
+import zlib
+from typing import Any, BinaryIO, Dict, Optional
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+METADATA_KEY = "pony-generation"
+VERSION = 1
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Signature plus the IHDR chunk, which always comes first and has 13 bytes of data
+PNG_HEADER_SIZE = 8 + 4 + 4 + 13 + 4
+
+EXIF_IFD = 0x8769
+EXIF_USER_COMMENT = 0x9286
+USER_COMMENT_ASCII = b"ASCII\0\0\0"
+
+
+def generation_record(backend: str, params: Dict[str, Any], timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Metadata stored with one output image: who made it, from what request, and how long each stage took"""
+    record = {"version": VERSION, "backend": backend, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    record.update(params)
+    record["timings"] = {name: round(value, 4) for name, value in (timings or {}).items()}
+    return record
+
+
+def record_text(record: Dict[str, Any]) -> str:
+    """Compact JSON, ASCII-only so it fits EXIF strings as well as PNG text"""
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=True, default=str)
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+
+def record_chunk(record: Dict[str, Any]) -> bytes:
+    """Uncompressed iTXt chunk holding a record"""
+    # keyword, NUL, compression flag and method, empty language tag and translated keyword
+    return png_chunk(b"iTXt", METADATA_KEY.encode("latin-1") + b"\0\0\0\0\0" + record_text(record).encode("utf-8"))
+
+
+def splice_record(head: bytes, record: Dict[str, Any]) -> bytes:
+    """Insert a record chunk right after IHDR in the first bytes of a PNG stream (at least PNG_HEADER_SIZE)"""
+    if not head.startswith(PNG_SIGNATURE) or head[12:16] != b"IHDR" or len(head) < PNG_HEADER_SIZE:
+        return head
+    return head[:PNG_HEADER_SIZE] + record_chunk(record) + head[PNG_HEADER_SIZE:]
+
+
+def embed_options(image_format: str, record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """PIL Image.save keyword arguments that embed a record in the given format"""
+    if record is None:
+        return {}
+    if image_format == "png":
+        info = PngInfo()
+        info.add_itxt(METADATA_KEY, record_text(record))
+        return {"pnginfo": info}
+    exif = Image.Exif()
+    exif.get_ifd(EXIF_IFD)[EXIF_USER_COMMENT] = USER_COMMENT_ASCII + record_text(record).encode("ascii")
+    return {"exif": exif.tobytes()}
+
+
+def read_png_text(f: BinaryIO) -> Dict[str, str]:
+    """Text chunks ahead of the pixel data of a PNG; seeks past everything else and stops at IDAT"""
+    if f.read(8) != PNG_SIGNATURE:
+        return {}
+    text: Dict[str, str] = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type not in (b"tEXt", b"iTXt", b"zTXt"):
+            f.seek(length + 4, 1)
+            continue
+        data = f.read(length)
+        f.seek(4, 1)
+        keyword, _, value = data.partition(b"\0")
+        key = keyword.decode("latin-1")
+        try:
+            if chunk_type == b"tEXt":
+                text[key] = value.decode("latin-1")
+            elif chunk_type == b"zTXt":
+                text[key] = zlib.decompress(value[1:]).decode("latin-1")
+            else:
+                compressed, value = value[0], value[2:]
+                _, _, value = value.partition(b"\0")  # language tag
+                _, _, value = value.partition(b"\0")  # translated keyword
+                text[key] = (zlib.decompress(value) if compressed else value).decode("utf-8")
+        except (zlib.error, UnicodeDecodeError, IndexError):
+            continue
+    return text
+
+
+def read_record(path: str) -> Optional[Dict[str, Any]]:
+    """Generation record of an image file, read from its header without decoding pixels"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) == PNG_SIGNATURE:
+                f.seek(0)
+                text = read_png_text(f).get(METADATA_KEY)
+            else:
+                f.seek(0)
+                with Image.open(f) as image:
+                    comment = image.getexif().get_ifd(EXIF_IFD).get(EXIF_USER_COMMENT)
+                if isinstance(comment, str):
+                    comment = comment.encode("latin-1")
+                text = comment[len(USER_COMMENT_ASCII):].decode("ascii") if comment else None
+        return json.loads(text) if text else None
+    except (OSError, ValueError, SyntaxError):
+        return None
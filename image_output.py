@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Encoded image output for the generators
+Writes each image once to a temporary file (PNG, WebP or JPEG) that is handed on as a path, never decoded again
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from generation_metadata import PNG_HEADER_SIZE, embed_options, read_record, splice_record
+from metrics import time_stage
+
+# Bytes per read/write when forwarding encoded images
+CHUNK_SIZE = 1024 * 1024
+
+# Threads encoding finished images, 0 encodes on the calling thread
+OUTPUT_WORKERS = int(os.environ.get("OUTPUT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+FORMATS = {
+    "png": (".png", "PNG"),
+    "webp": (".webp", "WEBP"),
+    "jpeg": (".jpg", "JPEG"),
+}
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    format: str = "png"
+    quality: int = 90  # WebP/JPEG quality, 1-100
+    compress_level: int = 1  # PNG zlib level 0-9, WebP method 0-6 (higher is smaller and slower)
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Unsupported output format {self.format!r}, expected one of {sorted(FORMATS)}")
+
+    @property
+    def suffix(self) -> str:
+        return FORMATS[self.format][0]
+
+    def save_options(self) -> dict:
+        """PIL Image.save keyword arguments"""
+        if self.format == "png":
+            return {"compress_level": min(max(self.compress_level, 0), 9)}
+        if self.format == "webp":
+            return {"quality": self.quality, "method": min(max(self.compress_level, 0), 6)}
+        return {"quality": self.quality, "optimize": False}
+
+    def key(self) -> dict:
+        """Cache key part, different settings produce different files"""
+        return {"format": self.format, "quality": self.quality, "compress_level": self.compress_level}
+
+    @classmethod
+    def from_env(cls) -> "OutputFormat":
+        """OUTPUT_FORMAT, OUTPUT_QUALITY and OUTPUT_COMPRESS_LEVEL, defaulting to fast PNG"""
+        return cls(
+            format=os.environ.get("OUTPUT_FORMAT", "png").lower(),
+            quality=int(os.environ.get("OUTPUT_QUALITY", "90")),
+            compress_level=int(os.environ.get("OUTPUT_COMPRESS_LEVEL", "1")),
+        )
+
+
+@dataclass(frozen=True)
+class OutputFile:
+    path: str
+    sha256: str
+    size: int
+
+
+class _HashingWriter:
+    """File wrapper hashing everything written through it.
+
+    It has no fileno(), so PIL hands it the encoded chunks instead of writing
+    to the descriptor directly.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def frame_to_image(frame: Union[Image.Image, np.ndarray]) -> Image.Image:
+    """PIL image from a pipeline frame, either PIL already or an HWC float array in [0, 1]"""
+    if isinstance(frame, Image.Image):
+        return frame
+    array = (frame * 255).round().astype(np.uint8)
+    if array.shape[-1] == 1:
+        return Image.fromarray(array[..., 0])
+    return Image.fromarray(array)
+
+
+def new_output_path(suffix: str, directory: Optional[str] = None) -> str:
+    """Create an empty, uniquely named output file (unlike mktemp there is no race on the name)"""
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def encode_image(frame: Union[Image.Image, np.ndarray], output_format: OutputFormat,
+                 directory: Optional[str] = None, record: Optional[Dict[str, Any]] = None) -> OutputFile:
+    """Encode a frame straight into a new file, hashing the bytes as they are written
+
+    A generation record is embedded in the file's header (see generation_metadata).
+    """
+    path = new_output_path(output_format.suffix, directory)
+    try:
+        with time_stage(f"{output_format.format}_encode"), open(path, "wb") as f:
+            image = frame_to_image(frame)
+            if output_format.format == "jpeg" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            writer = _HashingWriter(f)
+            image.save(writer, FORMATS[output_format.format][1], **output_format.save_options(),
+                       **embed_options(output_format.format, record))
+    except Exception:
+        os.remove(path)
+        raise
+    return OutputFile(path, writer.hash.hexdigest(), writer.size)
+
+
+def write_image(image: Image.Image, output_format: OutputFormat, directory: Optional[str] = None,
+                record: Optional[Dict[str, Any]] = None) -> str:
+    """Encode a PIL image straight into a new file and return its path"""
+    return encode_image(image, output_format, directory, record).path
+
+
+def sniff_suffix(head: bytes) -> str:
+    """File suffix from the magic bytes of an encoded image"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    return ".png"
+
+
+class ChunkWriter:
+    """Writes an encoded image to a new file named after its format, one chunk at a time
+
+    Only the first PNG_HEADER_SIZE bytes are held back, to pick the suffix and
+    splice a generation record into a PNG stream right after its header; the
+    pixel data is passed through untouched.
+    """
+
+    def __init__(self, directory: Optional[str] = None, record: Optional[Dict[str, Any]] = None):
+        self.directory = directory
+        self.record = record
+        self.path: Optional[str] = None
+        self._head = b""
+        self._file: Optional[BinaryIO] = None
+
+    def write(self, chunk: bytes):
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._head += chunk
+        if len(self._head) >= PNG_HEADER_SIZE:
+            self._open()
+
+    def _open(self):
+        head, self._head = self._head, b""
+        suffix = sniff_suffix(head)
+        if self.record is not None and suffix == ".png":
+            head = splice_record(head, self.record)
+        self.path = new_output_path(suffix, self.directory)
+        self._file = open(self.path, "wb")
+        self._file.write(head)
+
+    def close(self) -> str:
+        """Finish the file, returns its path"""
+        if self._file is None:
+            self._open()
+        self._file.close()
+        return self.path
+
+    def abort(self):
+        """Drop a partly written file"""
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path)
+            self._file = None
+
+
+def write_chunks(chunks: Iterable[bytes], directory: Optional[str] = None,
+                 record: Optional[Dict[str, Any]] = None) -> str:
+    """Write an encoded image arriving in chunks to a new file named after its format"""
+    writer = ChunkWriter(directory, record)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+
+def convert_file(path: str, output_format: OutputFormat, directory: Optional[str] = None) -> str:
+    """Re-encode an image file when it is not in the wanted format, returns the path to use"""
+    if os.path.splitext(path)[1].lower() == output_format.suffix:
+        return path
+    with Image.open(path) as image:
+        converted = write_image(image, output_format, directory, read_record(path))
+    os.remove(path)
+    return converted
+
+
+def link_or_copy(source: str, destination: str):
+    """Give a file a second name without copying its data when the filesystem allows it"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class OutputDirectory:
+    """Temporary directory keeping only the newest `keep` output files.
+
+    For apps that hand paths to Gradio, which copies each file into its own
+    cache when the event yields it, so older files can be removed.
+    """
+
+    def __init__(self, keep: int = 64, prefix: str = "pony-outputs-"):
+        self.directory = tempfile.mkdtemp(prefix=prefix)
+        self.keep = keep
+        self._paths: "deque[str]" = deque()
+        self._lock = threading.Lock()
+
+    def write(self, image: Image.Image, output_format: OutputFormat) -> str:
+        """Encode an image into the directory, dropping the oldest files beyond `keep`"""
+        return self.track(write_image(image, output_format, self.directory))
+
+    def track(self, path: str) -> str:
+        """Count a file written into the directory, dropping the oldest files beyond `keep`"""
+        with self._lock:
+            self._paths.append(path)
+            while len(self._paths) > self.keep:
+                stale = self._paths.popleft()
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return path
+
+
+class OutputPool:
+    """Threads that turn finished frames into files while the pipeline moves on.
+
+    PIL's encoders, zlib and hashlib release the GIL, so threads encode in
+    parallel with each other and with the next denoising run. A process pool
+    would have to pickle every full-size frame across. At most `max_pending`
+    jobs are queued or running; `submit` blocks beyond that, so a generator
+    that outpaces the encoders is slowed down instead of piling frames up in
+    memory. With no workers every job runs on the calling thread.
+    """
+
+    def __init__(self, workers: int = OUTPUT_WORKERS, max_pending: Optional[int] = None):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output") if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending or max(2 * workers, 1))
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) on the pool, returns its Future"""
+        if self._executor is None:
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def encode(self, frame: Union[Image.Image, np.ndarray], output_format: OutputFormat,
+               directory: Optional[str] = None, record: Optional[Dict[str, Any]] = None) -> Future:
+        """Encode, write and hash one frame on the pool, the Future resolves to an OutputFile"""
+        return self.submit(encode_image, frame, output_format, directory, record)
+
+    def encode_all(self, frames: Iterable[Union[Image.Image, np.ndarray]], output_format: OutputFormat,
+                   directory: Optional[str] = None,
+                   records: Optional[List[Dict[str, Any]]] = None) -> List[OutputFile]:
+        """Encode a batch of frames in parallel, in order, each with its own generation record"""
+        frames = list(frames)
+        records = records if records is not None else [None] * len(frames)
+        futures = [self.encode(frame, output_format, directory, record) for frame, record in zip(frames, records)]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
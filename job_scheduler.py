@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+In-process job scheduler in front of the generators
+Bounded queue, priority classes, per-client fairness, load shedding and coalescing
+"""
+
+import asyncio
+import functools
+import inspect
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+from metrics import REQUESTS, observe_stage
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+class QueueFullError(Exception):
+    """The scheduler is at capacity and shed the request"""
+
+
+class Job:
+    """A queued call; identical requests share one Job"""
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict,
+                 client_id: str, priority: int, key: Optional[Hashable]):
+        self.id = str(uuid.uuid4())
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.client_id = client_id
+        self.priority = priority
+        self.key = key
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.subscribers = 1
+        self.progress: Any = None
+        self.abandoned = False
+        self._scheduler: Optional["JobScheduler"] = None
+        # Running async job on the scheduler's event loop
+        self._task: Optional[Future] = None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout)
+
+    def position(self) -> int:
+        """Place in the queue, 1 being next to run (0 once running)"""
+        if self._scheduler is None or self.started_at is not None or self.done():
+            return 0
+        return self._scheduler.position(self)
+
+
+class JobScheduler:
+    """Runs generation jobs on a fixed number of worker threads.
+
+    Pending jobs are grouped by priority class and, within a class, by
+    client. Workers always take from the highest non-empty class and rotate
+    through its clients, so one client's burst cannot starve the others. The
+    queue holds at most `max_queue` jobs. When it is full, an interactive
+    request displaces the newest bulk job, and anything else is rejected with
+    QueueFullError. Submitting a request whose key matches a pending or
+    running job returns that job instead of queueing a second generation.
+
+    When fn is a generator function, each value it yields is published as
+    `job.progress` and the last one becomes the result, unless the generator
+    returns a value. A running generator job that every subscriber cancelled
+    is closed at its next yield. A job whose result is a concurrent Future
+    (its output still being written on another thread) frees its worker
+    straight away and completes once that Future does.
+
+    Coroutine and async generator functions run on the scheduler's own event
+    loop thread instead, so they hold no worker while they wait: workers only
+    dispatch them, and `max_running` (started but unfinished jobs, unlimited
+    by default) is what bounds how many are in flight. Cancelling such a job
+    cancels its task.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 32, name: str = "generation",
+                 max_running: Optional[int] = None):
+        self.max_queue = max_queue
+        self.max_running = max_running
+        self.name = name
+        self._lock = threading.Condition()
+        self._pending: Dict[int, "OrderedDict[str, Deque[Job]]"] = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}
+        self._by_key: Dict[Hashable, Job] = {}
+        self._running: List[Job] = []
+        self._in_flight = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.completed = 0
+        self.shed = 0
+        self.coalesced = 0
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _queued(self) -> int:
+        return sum(len(jobs) for clients in self._pending.values() for jobs in clients.values())
+
+    def submit(self, fn: Callable[..., Any], *args, client_id: str = "anonymous",
+               priority: int = INTERACTIVE, key: Optional[Hashable] = None, **kwargs) -> Job:
+        """Queue fn(*args, **kwargs), raises QueueFullError when shed"""
+        with self._lock:
+            if key is not None and key in self._by_key:
+                job = self._by_key[key]
+                job.subscribers += 1
+                self.coalesced += 1
+                return job
+
+            if self._queued() >= self.max_queue:
+                if priority != INTERACTIVE or not self._shed_bulk():
+                    self.shed += 1
+                    REQUESTS.labels(outcome="shed").inc()
+                    raise QueueFullError(f"{self.name} queue is full ({self.max_queue} waiting)")
+
+            job = Job(fn, args, kwargs, client_id, priority, key)
+            job._scheduler = self
+            self._pending[priority].setdefault(client_id, deque()).append(job)
+            if key is not None:
+                self._by_key[key] = job
+            self._lock.notify()
+            return job
+
+    def _shed_bulk(self) -> bool:
+        """Drop the most recently queued bulk job to make room (lock held)"""
+        newest: Optional[Job] = None
+        for jobs in self._pending[BULK].values():
+            if jobs and (newest is None or jobs[-1].enqueued_at > newest.enqueued_at):
+                newest = jobs[-1]
+        if newest is None:
+            return False
+        self._remove(newest)
+        self.shed += 1
+        REQUESTS.labels(outcome="shed").inc()
+        newest.future.set_exception(QueueFullError("Displaced by interactive requests, please retry"))
+        return True
+
+    def _remove(self, job: Job):
+        clients = self._pending[job.priority]
+        jobs = clients.get(job.client_id)
+        if jobs is not None:
+            jobs.remove(job)
+            if not jobs:
+                del clients[job.client_id]
+        if job.key is not None and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _dispatch_order(self) -> List[Job]:
+        """Pending jobs in the order workers will take them (lock held)"""
+        order: List[Job] = []
+        for priority in (INTERACTIVE, BULK):
+            queues = [list(jobs) for jobs in self._pending[priority].values()]
+            for round_jobs in itertools.zip_longest(*queues):
+                order.extend(job for job in round_jobs if job is not None)
+        return order
+
+    def _next(self) -> Optional[Job]:
+        """Take the next job, rotating clients within the top priority class (lock held)"""
+        for priority in (INTERACTIVE, BULK):
+            clients = self._pending[priority]
+            if not clients:
+                continue
+            client_id, jobs = next(iter(clients.items()))
+            job = jobs.popleft()
+            # Move the client to the back of the rotation
+            del clients[client_id]
+            if jobs:
+                clients[client_id] = jobs
+            return job
+        return None
+
+    def _take(self) -> Optional[Job]:
+        """Next job, unless max_running jobs are already in flight (lock held)"""
+        if self.max_running is not None and self._in_flight >= self.max_running:
+            return None
+        return self._next()
+
+    def position(self, job: Job) -> int:
+        with self._lock:
+            order = self._dispatch_order()
+            return order.index(job) + 1 if job in order else 0
+
+    def cancel(self, job: Job) -> bool:
+        """Withdraw one subscriber, stopping the job once nobody else waits for it"""
+        with self._lock:
+            job.subscribers -= 1
+            if job.subscribers > 0 or job.done():
+                return False
+            if job.started_at is not None:
+                # Generator jobs notice at their next yield, async jobs are cancelled, plain calls run to the end
+                job.abandoned = True
+                if job.key is not None and self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+                if job._task is not None:
+                    job._task.cancel()
+                return True
+            self._remove(job)
+        return job.future.cancel()
+
+    def _drain(self, job: Job, updates) -> Any:
+        """Run a generator job, publishing each yield as its progress"""
+        try:
+            while True:
+                try:
+                    update = next(updates)
+                except StopIteration as done:
+                    return job.progress if done.value is None else done.value
+                if job.abandoned:
+                    REQUESTS.labels(outcome="abandoned").inc()
+                    raise CancelledError(f"Job {job.id} abandoned by its clients")
+                job.progress = update
+        finally:
+            updates.close()
+
+    async def _drain_async(self, job: Job, updates) -> Any:
+        """Await a coroutine job, or run an async generator job publishing each yield as its progress"""
+        if inspect.iscoroutine(updates):
+            return await updates
+        try:
+            async for update in updates:
+                if job.abandoned:
+                    REQUESTS.labels(outcome="abandoned").inc()
+                    raise CancelledError(f"Job {job.id} abandoned by its clients")
+                job.progress = update
+            return job.progress
+        finally:
+            await updates.aclose()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """The loop async jobs run on, started with the first of them"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=f"{self.name}-loop", daemon=True).start()
+            return self._loop
+
+    def _finish(self, job: Job, outcome: Future):
+        """Complete a job with the outcome of its (possibly deferred) result"""
+        with self._lock:
+            if job.key is not None and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            self.completed += 1
+            self._in_flight -= 1
+            self._lock.notify()
+        if outcome.cancelled():
+            job.future.set_exception(CancelledError(f"Job {job.id} output was cancelled"))
+        elif outcome.exception() is not None:
+            job.future.set_exception(outcome.exception())
+        else:
+            job.future.set_result(outcome.result())
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job = self._take()
+                while job is None:
+                    self._lock.wait()
+                    job = self._take()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                job.started_at = time.monotonic()
+                self._running.append(job)
+                self._in_flight += 1
+            observe_stage("scheduler_wait", job.started_at - job.enqueued_at)
+
+            outcome: Future = Future()
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+                if inspect.isgenerator(result):
+                    result = self._drain(job, result)
+                elif inspect.iscoroutine(result) or inspect.isasyncgen(result):
+                    result = job._task = asyncio.run_coroutine_threadsafe(self._drain_async(job, result),
+                                                                          self._event_loop())
+                if isinstance(result, Future):
+                    outcome = result
+                else:
+                    outcome.set_result(result)
+            except BaseException as e:
+                outcome.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running.remove(job)
+            # Runs now, or once a deferred result is ready while this worker takes the next job
+            outcome.add_done_callback(functools.partial(self._finish, job))
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth per priority class and counters"""
+        with self._lock:
+            return {
+                "queued": {PRIORITY_NAMES[p]: sum(len(j) for j in c.values()) for p, c in self._pending.items()},
+                "running": len(self._running),
+                "in_flight": self._in_flight,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "shed": self.shed,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+LoRA adapter switching for diffusers pipelines
+Fused mode merges the active LoRAs into the base weights so denoising runs without PEFT overhead
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from peft.tuners.tuners_utils import BaseTunerLayer
+
+from metrics import CACHE_LOOKUPS, observe_stage
+from model_manifest import DEFAULT_LORA_WEIGHTS, LORAS, ModelFile
+
+# "fused" merges LoRAs into the weights, "peft" keeps them as runtime adapters
+LORA_MODE = os.environ.get("LORA_MODE", "fused")
+# Fused weight sets kept in host memory, each is a copy of every LoRA-targeted layer
+FUSED_CACHE_SIZE = int(os.environ.get("LORA_FUSED_CACHE_SIZE", "2"))
+
+LORA_COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+AdapterKey = Tuple[Tuple[str, float], ...]
+
+
+def adapter_key(weights: Dict[str, float]) -> AdapterKey:
+    """Canonical, hashable form of an adapter weight vector; zero-weight adapters are dropped"""
+    return tuple(sorted((name, float(weight)) for name, weight in weights.items() if weight != 0.0))
+
+
+def manifest_weights(lora_weights: Optional[List[float]] = None,
+                     loras: List[ModelFile] = LORAS) -> Dict[str, float]:
+    """{adapter: weight} for a weight vector in manifest order, None means DEFAULT_LORA_WEIGHTS"""
+    if lora_weights is None:
+        lora_weights = [DEFAULT_LORA_WEIGHTS.get(entry.adapter_name, 0.0) for entry in loras]
+    if len(lora_weights) > len(loras):
+        raise ValueError(f"Got {len(lora_weights)} LoRA weights for {len(loras)} LoRAs")
+    return {entry.adapter_name: float(weight) for entry, weight in zip(loras, lora_weights)}
+
+
+class LoraManager:
+    """Applies LoRA weight vectors to a pipeline, either fused or as PEFT adapters.
+
+    In fused mode `activate` merges the requested adapters into the weights of
+    the layers they target, so every denoising step runs the plain base layers.
+    Switching to another weight vector restores an exact copy of the original
+    weights (no fp16 drift from repeated unfuse/fuse) and fuses again. The
+    fused weights of the most recent vectors are kept in host memory, so
+    switching back to one of them is a copy instead of a re-fuse.
+
+    `baked` lists LoRAs already fused into the loaded weights (a snapshot
+    from build_snapshot.py). Requests still ask for absolute weights; only
+    the difference to the baked weight is applied, which is exact because a
+    LoRA's contribution is linear in its weight. Registered LoRAs are only
+    fetched and loaded once a request needs them, so a snapshot that bakes
+    the default mix boots without touching any LoRA file.
+    """
+
+    def __init__(self, pipe, fused: bool = LORA_MODE == "fused", cache_size: int = FUSED_CACHE_SIZE,
+                 baked: Optional[Dict[str, float]] = None):
+        self.pipe = pipe
+        self.fused = fused
+        self.cache_size = cache_size
+        self.baked = dict(baked or {})
+        self.adapters: List[str] = []
+        self._sources: Dict[str, Callable[[], str]] = {}
+        self.active: Optional[AdapterKey] = None
+        self.hits = 0
+        self.misses = 0
+        self._layers: Optional[List[BaseTunerLayer]] = None
+        self._base: Optional[List[torch.Tensor]] = None
+        self._fused_states: "OrderedDict[AdapterKey, List[torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: str, adapter_name: str, **kwargs):
+        """Load a LoRA file as a new adapter, dropping fused state that no longer covers every layer"""
+        with self._lock:
+            if adapter_name in self.adapters:
+                return
+            self._restore_base()
+            self.pipe.load_lora_weights(path, adapter_name=adapter_name, **kwargs)
+            self.adapters.append(adapter_name)
+            self._layers = None
+            self._base = None
+            self._fused_states.clear()
+            self.active = None
+
+    def load_manifest(self, fetch: Callable[[ModelFile], str], entries: List[ModelFile] = LORAS):
+        """Load every manifest LoRA as a named adapter, `fetch` returns the local path of an entry"""
+        for entry in entries:
+            self.load(fetch(entry), adapter_name=entry.adapter_name)
+
+    def register_manifest(self, fetch: Callable[[ModelFile], str], entries: List[ModelFile] = LORAS):
+        """Make manifest LoRAs available without loading them; each is fetched on its first non-zero weight"""
+        for entry in entries:
+            self._sources[entry.adapter_name] = functools.partial(fetch, entry)
+
+    def activate(self, weights: Dict[str, float]) -> AdapterKey:
+        """Make `weights` ({adapter: weight}) the active LoRA configuration, returns its adapter key
+
+        Adapters missing from `weights` or at weight 0 are disabled entirely.
+        """
+        requested = adapter_key(weights)
+        key = adapter_key({
+            name: weights.get(name, 0.0) - self.baked.get(name, 0.0)
+            for name in set(weights) | set(self.baked)
+        })
+        for name, _ in key:
+            if name not in self.adapters and name in self._sources:
+                self.load(self._sources[name](), adapter_name=name)
+        unknown = [name for name, _ in key if name not in self.adapters]
+        if unknown:
+            raise ValueError(f"LoRA adapters not loaded: {unknown}")
+        with self._lock:
+            if key == self.active:
+                return requested
+            start = time.perf_counter()
+            if self.fused:
+                self._activate_fused(key)
+            else:
+                self._activate_peft(key)
+            self.active = key
+            observe_stage("lora_switch", time.perf_counter() - start)
+        return requested
+
+    def _activate_peft(self, key: AdapterKey):
+        if not key:
+            self.pipe.disable_lora()
+            return
+        self.pipe.enable_lora()
+        self.pipe.set_adapters([name for name, _ in key], adapter_weights=[weight for _, weight in key])
+
+    def _activate_fused(self, key: AdapterKey):
+        self._tuner_layers()
+        if not key:
+            self._restore_base()
+            self.pipe.disable_lora()
+            return
+
+        self.pipe.enable_lora()
+        names = [name for name, _ in key]
+        state = self._fused_states.get(key)
+        if state is not None:
+            self._fused_states.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels(cache="lora_fused", result="hit").inc()
+            # Deactivate the previous vector's adapters, or layers only they target would add their delta at runtime
+            self.pipe.set_adapters(names, adapter_weights=[weight for _, weight in key])
+            self._write(state, names)
+            return
+
+        self.misses += 1
+        CACHE_LOOKUPS.labels(cache="lora_fused", result="miss").inc()
+        self._restore_base()
+        self.pipe.set_adapters(names, adapter_weights=[weight for _, weight in key])
+        self.pipe.fuse_lora(adapter_names=names, lora_scale=1.0)
+        if self.cache_size > 0:
+            self._fused_states[key] = self._read()
+            while len(self._fused_states) > self.cache_size:
+                self._fused_states.popitem(last=False)
+
+    def _tuner_layers(self) -> List[BaseTunerLayer]:
+        """LoRA-wrapped layers of every component, capturing their unfused weights the first time"""
+        if self._layers is None:
+            self._layers = [
+                module
+                for component in LORA_COMPONENTS
+                if getattr(self.pipe, component, None) is not None
+                for module in getattr(self.pipe, component).modules()
+                if isinstance(module, BaseTunerLayer)
+            ]
+            self._base = self._read()
+        return self._layers
+
+    def _read(self) -> List[torch.Tensor]:
+        return [layer.get_base_layer().weight.detach().to("cpu", copy=True) for layer in self._layers]
+
+    def _write(self, state: List[torch.Tensor], merged: List[str]):
+        """Copy a weight set into the base layers and mark which adapters it contains"""
+        with torch.no_grad():
+            for layer, weight in zip(self._layers, state):
+                layer.get_base_layer().weight.copy_(weight)
+                layer.merged_adapters = [name for name in merged if name in getattr(layer, "lora_A", {})]
+        self.pipe._merged_adapters = set(merged)
+
+    def _restore_base(self):
+        if self._layers is not None and any(layer.merged for layer in self._layers):
+            self._write(self._base, [])
+
+    def stats(self) -> str:
+        mode = "fused" if self.fused else "peft"
+        return f"{mode}, active {list(self.active or ())}, {len(self._fused_states)} cached ({self.hits} hits / {self.misses} misses)"
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-bounded generation for the diffusers SDXL pipelines
+Picks VAE slicing/tiling, attention slicing and model CPU offload from the request size and the free memory
+"""
+
+import os
+import resource
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional
+
+import psutil
+import torch
+import torch.nn.functional as F
+
+from metrics import PEAK_MEMORY
+
+# "auto" picks per request, a level name forces that level (and every level before it)
+MEMORY_MODE = os.environ.get("MEMORY_MODE", "auto")
+# "auto" offloads when the weights and a largest request would not fit the device, "1"/"0" force it
+CPU_OFFLOAD = os.environ.get("CPU_OFFLOAD", "auto")
+# Fraction of the free memory a request is planned to use, the rest covers estimate error and fragmentation
+MEMORY_HEADROOM = float(os.environ.get("MEMORY_HEADROOM", "0.8"))
+# Output pixels per VAE tile edge when tiling, tiles overlap by a quarter and are blended
+VAE_TILE_SIZE = int(os.environ.get("VAE_TILE_SIZE", "512"))
+
+# Each level includes the ones before it:
+#   vae_slicing decodes a batch one image at a time (no effect on the output)
+#   vae_tiling decodes each image in overlapping tiles
+#   attention_slicing computes attention a few heads at a time
+LEVELS = ("full", "vae_slicing", "vae_tiling", "attention_slicing")
+
+# Live full-resolution activations in the VAE decoder at its peak, measured on the SDXL VAE
+DECODE_LIVE_TENSORS = 4
+# Live latent-resolution activations per sample in the UNet: kept skip connections plus transformer feed-forwards
+UNET_LIVE_TENSORS = 20
+# SDXL's highest-resolution attention runs at half the latent resolution, with 10 heads
+ATTENTION_DOWNSCALE = 16
+ATTENTION_HEADS = 10
+
+# Largest width/height the apps accept
+MAX_SIZE = 1536
+
+MiB = 1024 * 1024
+
+
+def module_bytes(module) -> int:
+    return sum(p.numel() * p.element_size() for p in module.parameters()) if module is not None else 0
+
+
+def available_memory(device: torch.device) -> int:
+    """Bytes a request can still allocate: free device memory plus what the caching allocator holds unused"""
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+    return psutil.virtual_memory().available
+
+
+def total_memory(device: torch.device) -> int:
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[1]
+    return psutil.virtual_memory().total
+
+
+@dataclass(frozen=True)
+class MemoryPlan:
+    level: str
+    offload: bool
+    required_bytes: int
+    available_bytes: int
+
+    @property
+    def vae_slicing(self) -> bool:
+        return LEVELS.index(self.level) >= LEVELS.index("vae_slicing")
+
+    @property
+    def vae_tiling(self) -> bool:
+        return LEVELS.index(self.level) >= LEVELS.index("vae_tiling")
+
+    @property
+    def attention_slicing(self) -> bool:
+        return LEVELS.index(self.level) >= LEVELS.index("attention_slicing")
+
+    @property
+    def fits(self) -> bool:
+        return self.required_bytes <= self.available_bytes * MEMORY_HEADROOM
+
+    def describe(self) -> str:
+        mode = self.level + (" + cpu offload" if self.offload else "")
+        return (f"{mode} (needs ~{self.required_bytes // MiB} MiB of "
+                f"{int(self.available_bytes * MEMORY_HEADROOM) // MiB} MiB budget)")
+
+
+class MemoryManager:
+    """Keeps one pipeline's decode and attention within the memory there is.
+
+    `place` moves the pipeline to its device once, or enables model CPU
+    offload when the weights plus the largest allowed request would not fit
+    it even at the most frugal level (offloading is a startup decision: its
+    hooks are too costly to add and remove per request). `plan` estimates a
+    request's working memory from its resolution and batch size at each level
+    and picks the first that fits the free memory; `apply` switches the pipeline to it, only touching
+    the settings that change. `track` measures the request's peak memory.
+
+    The estimates come from the model configs: the VAE decoder peaks at
+    about DECODE_LIVE_TENSORS full-resolution tensors of its widest
+    full-resolution channel count (upcast to fp32 for SDXL's fp16 VAE), the
+    UNet at UNET_LIVE_TENSORS latent-resolution tensors per sample. Without
+    PyTorch's scaled_dot_product_attention the attention scores are added.
+    With it, attention already runs in linear memory and slicing would only
+    slow it down, so auto mode skips attention_slicing.
+    """
+
+    def __init__(self, pipe, mode: str = MEMORY_MODE, offload: str = CPU_OFFLOAD, tile_size: int = VAE_TILE_SIZE):
+        if mode != "auto" and mode not in LEVELS:
+            raise ValueError(f"Unknown memory mode {mode!r}, expected auto or one of {LEVELS}")
+        self.pipe = pipe
+        self.mode = mode
+        self.offload_setting = offload
+        self.offload = False
+        self.device = torch.device("cpu")
+        self.current: Optional[MemoryPlan] = None
+        self._level = "full"
+        self.sdpa = hasattr(F, "scaled_dot_product_attention")
+
+        vae = pipe.vae
+        vae.tile_sample_min_size = tile_size
+        vae.tile_latent_min_size = tile_size // pipe.vae_scale_factor
+
+    def place(self, device: str) -> str:
+        """Move the pipeline to `device`, or offload it there model by model when it would not fit"""
+        self.device = torch.device(device)
+        offload = self.offload_setting == "1"
+        if self.offload_setting == "auto" and self.device.type == "cuda":
+            weights = sum(module_bytes(getattr(self.pipe, name, None))
+                          for name in ("unet", "vae", "text_encoder", "text_encoder_2"))
+            # Tiling and slicing come first, offload only when even the most frugal level would not fit
+            smallest = self.estimate(MAX_SIZE, MAX_SIZE, 1, self.levels()[-1])
+            offload = weights + smallest > total_memory(self.device) * MEMORY_HEADROOM
+        if offload and self.device.type == "cuda":
+            self.pipe.enable_model_cpu_offload(device=self.device)
+            self.offload = True
+            return f"model CPU offload to {device}"
+        self.pipe.to(device)
+        return device
+
+    def levels(self):
+        """Levels auto mode chooses from, cheapest first"""
+        return [level for level in LEVELS if not (level == "attention_slicing" and self.sdpa)]
+
+    def _decode_element_size(self) -> int:
+        vae = self.pipe.vae
+        if vae.dtype == torch.float16 and getattr(vae.config, "force_upcast", False):
+            return 4
+        return vae.dtype.itemsize
+
+    def estimate(self, width: int, height: int, batch: int, level: str) -> int:
+        """Working memory of a request at a level, in bytes (largest of the denoise and decode phases)"""
+        index = LEVELS.index(level)
+        vae, unet = self.pipe.vae, self.pipe.unet
+
+        decoded = width * height * batch
+        if index >= LEVELS.index("vae_tiling"):
+            decoded = min(width, vae.tile_sample_min_size) * min(height, vae.tile_sample_min_size)
+        elif index >= LEVELS.index("vae_slicing"):
+            decoded = width * height
+        channels = max(vae.config.block_out_channels[:2])
+        decode = DECODE_LIVE_TENSORS * channels * self._decode_element_size() * decoded
+        decode += width * height * batch * 3 * 4  # the float output frames
+
+        samples = 2 * batch  # classifier-free guidance
+        latent_pixels = (width // self.pipe.vae_scale_factor) * (height // self.pipe.vae_scale_factor)
+        element = unet.dtype.itemsize
+        denoise = UNET_LIVE_TENSORS * unet.config.block_out_channels[0] * latent_pixels * samples * element
+        if not self.sdpa:
+            tokens = (width // ATTENTION_DOWNSCALE) * (height // ATTENTION_DOWNSCALE)
+            # Sliced ("auto") attention holds the scores of half a sample's heads at a time
+            heads = ATTENTION_HEADS // 2 if index >= LEVELS.index("attention_slicing") else samples * ATTENTION_HEADS
+            denoise += heads * tokens * tokens * element
+
+        if self.offload:
+            # The running model is brought onto the device for its phase
+            decode += module_bytes(vae)
+            denoise += module_bytes(unet)
+        return max(decode, denoise)
+
+    def plan(self, width: int, height: int, batch: int = 1) -> MemoryPlan:
+        """Cheapest level whose estimate fits the free memory (the deepest one when none does)"""
+        available = available_memory(self.device)
+        if self.mode != "auto":
+            return MemoryPlan(self.mode, self.offload, self.estimate(width, height, batch, self.mode), available)
+        plan = None
+        for level in self.levels():
+            plan = MemoryPlan(level, self.offload, self.estimate(width, height, batch, level), available)
+            if plan.fits:
+                return plan
+        return plan
+
+    def apply(self, plan: MemoryPlan):
+        """Switch the pipeline's VAE and attention settings to a plan"""
+        vae = self.pipe.vae
+        previous = MemoryPlan(self._level, self.offload, 0, 0)
+        if plan.vae_slicing != previous.vae_slicing:
+            vae.enable_slicing() if plan.vae_slicing else vae.disable_slicing()
+        if plan.vae_tiling != previous.vae_tiling:
+            vae.enable_tiling() if plan.vae_tiling else vae.disable_tiling()
+        if plan.attention_slicing != previous.attention_slicing:
+            if plan.attention_slicing:
+                self.pipe.enable_attention_slicing()
+            else:
+                self.pipe.disable_attention_slicing()
+        self._level = plan.level
+        self.current = plan
+
+    def prepare(self, width: int, height: int, batch: int = 1) -> MemoryPlan:
+        """Plan and apply in one go, warning when even the deepest level is over budget"""
+        plan = self.plan(width, height, batch)
+        self.apply(plan)
+        if not plan.fits:
+            print(f"⚠️ {width}x{height} x{batch} may not fit in memory: {plan.describe()}")
+        return plan
+
+    @contextmanager
+    def track(self) -> Iterator[Dict[str, float]]:
+        """Measure the peak memory of the enclosed request into the yielded dict (peak_memory_mb)
+
+        On CUDA this is the request's own peak allocation. On CPU only the
+        process-wide peak RSS is available, which covers earlier requests too.
+        """
+        stats: Dict[str, float] = {}
+        cuda = self.device.type == "cuda"
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        try:
+            yield stats
+        finally:
+            if cuda:
+                peak = torch.cuda.max_memory_allocated(self.device)
+            else:
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            stats["peak_memory_mb"] = round(peak / MiB, 1)
+            PEAK_MEMORY.labels(level=self._level, device=self.device.type).observe(peak)
+
+    def stats(self) -> str:
+        plan = self.current.describe() if self.current is not None else "no request yet"
+        return f"memory mode {self.mode}, offload {'on' if self.offload else 'off'}, last plan {plan}"
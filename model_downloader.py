@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable, checksum-verified model downloader
+Usage: python model_downloader.py --root comfyui/models [--workers 4] [--pin]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import requests
+
+from comfyui_http import create_session
+from model_manifest import HASHES_FILE, MANIFEST, REPO_ID, REVISION, ModelFile, local_path, read_hashes
+
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+CHUNK_SIZE = 8 * 1024 * 1024
+TIMEOUT = (10.0, 60.0)
+# Files with no manifest sha256 and no hub LFS hash are refused unless this is set
+ALLOW_UNVERIFIED = os.environ.get("MODEL_ALLOW_UNVERIFIED") == "1"
+
+
+def file_url(entry: ModelFile, endpoint: str = HF_ENDPOINT,
+             repo_id: str = REPO_ID, revision: str = REVISION) -> str:
+    """Hub resolve URL of a manifest entry"""
+    return f"{endpoint}/{repo_id}/resolve/{revision}/{quote(entry.filename)}"
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stamp(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def read_verified(path: str) -> Optional[str]:
+    """sha256 recorded for a file, if the file is unchanged since it was verified"""
+    try:
+        with open(path + ".sha256", "r") as f:
+            digest, stamp = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(path) or _stamp(path) != stamp:
+        return None
+    return digest
+
+
+def write_verified(path: str, digest: str):
+    with open(path + ".sha256", "w") as f:
+        f.write(f"{digest} {_stamp(path)}\n")
+
+
+class ModelDownloader:
+    """Fetches manifest files concurrently into a ComfyUI-style models directory.
+
+    Partial downloads are kept as <file>.part and resumed with HTTP Range
+    requests. Each file is hashed while it streams and checked against the
+    manifest's pinned sha256 (or the hub's LFS sha256 when none is pinned)
+    before it is moved into place. When neither exists the file is refused,
+    unless `allow_unverified` accepts it with a warning. A sidecar
+    <file>.sha256 records the verified hash with the file's size and mtime,
+    so warm starts skip files without re-hashing gigabytes.
+    """
+
+    def __init__(self, models_root: str, max_workers: int = 4, endpoint: str = HF_ENDPOINT,
+                 repo_id: str = REPO_ID, revision: str = REVISION, token: Optional[str] = None,
+                 allow_unverified: bool = ALLOW_UNVERIFIED):
+        self.models_root = models_root
+        self.allow_unverified = allow_unverified
+        self.max_workers = max_workers
+        self.endpoint = endpoint
+        self.repo_id = repo_id
+        self.revision = revision
+        self.session = create_session(pool_size=max_workers)
+        token = token or os.environ.get("HF_TOKEN")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def expected_sha256(self, entry: ModelFile, url: str) -> Optional[str]:
+        """Pinned checksum from the manifest, falling back to the hub's LFS etag"""
+        if entry.sha256:
+            return entry.sha256.lower()
+        response = self.session.head(url, allow_redirects=False, timeout=TIMEOUT)
+        etag = response.headers.get("X-Linked-Etag") or response.headers.get("ETag")
+        if etag:
+            etag = etag.strip('"').lower()
+            if etag.startswith("w/"):
+                etag = etag[2:].strip('"')
+            if len(etag) == 64:
+                return etag
+        return None
+
+    def fetch(self, entry: ModelFile) -> str:
+        """Download and verify one file, returns its local path"""
+        path = local_path(entry, self.models_root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        url = file_url(entry, self.endpoint, self.repo_id, self.revision)
+
+        verified = read_verified(path)
+        if verified and (entry.sha256 is None or verified == entry.sha256.lower()):
+            return path
+
+        expected = self.expected_sha256(entry, url)
+        if expected is None:
+            if not self.allow_unverified:
+                raise Exception(f"No sha256 to verify {entry.filename} against: pin it in {HASHES_FILE} "
+                                f"(or set MODEL_ALLOW_UNVERIFIED=1 to accept it unchecked)")
+            print(f"WARNING: {entry.filename} has no known sha256, it is NOT verified")
+        if os.path.exists(path):
+            actual = sha256_file(path)
+            if expected is None or actual == expected:
+                write_verified(path, actual)
+                return path
+            os.remove(path)
+
+        part = path + ".part"
+        digest = hashlib.sha256()
+        offset = 0
+        if os.path.exists(part):
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    offset += len(chunk)
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 416:
+                # The part file is already complete
+                pass
+            elif response.status_code == 206 and offset:
+                self._stream(response, part, "ab", digest)
+            elif response.status_code == 200:
+                digest = hashlib.sha256()
+                self._stream(response, part, "wb", digest)
+            else:
+                raise Exception(f"HTTP {response.status_code} for {entry.filename}")
+
+        actual = digest.hexdigest()
+        if expected is not None and actual != expected:
+            os.remove(part)
+            raise Exception(f"Checksum mismatch for {entry.filename}: {actual} != {expected}")
+
+        os.replace(part, path)
+        write_verified(path, actual)
+        return path
+
+    def _stream(self, response: requests.Response, part: str, mode: str, digest):
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    digest.update(chunk)
+
+    def download(self, entries: List[ModelFile] = MANIFEST) -> Dict[str, Optional[str]]:
+        """Fetch all entries with a bounded worker pool, returns filename -> error (None if ok)"""
+        results: Dict[str, Optional[str]] = {}
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, entry): entry for entry in entries}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    future.result()
+                    results[entry.filename] = None
+                    print(f"{entry.kind.capitalize()} ready: {entry.filename}")
+                except Exception as e:
+                    results[entry.filename] = str(e)
+                    print(f"Failed to download {entry.filename}: {e}")
+        failed = sum(1 for error in results.values() if error)
+        print(f"Model download finished in {time.time() - start:.1f}s ({failed} failed)")
+        return results
+
+
+def download_models(models_root: str, max_workers: int = 4) -> Dict[str, Optional[str]]:
+    """Download every manifest file into models_root"""
+    return ModelDownloader(models_root, max_workers=max_workers).download()
+
+
+def pin_hashes(models_root: str, entries: List[ModelFile] = MANIFEST, path: str = HASHES_FILE) -> Dict[str, str]:
+    """Pin the verified sha256 of every downloaded entry in the hashes file, returns the pins
+
+    Entries that are not downloaded keep their current pin.
+    """
+    hashes = read_hashes(path)
+    for entry in entries:
+        digest = read_verified(local_path(entry, models_root))
+        if digest:
+            hashes[entry.filename] = digest
+    with open(path, "w") as f:
+        json.dump(dict(sorted(hashes.items())), f, indent=2)
+        f.write("\n")
+    return hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--root", default="comfyui/models", help="ComfyUI models directory")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pin", action="store_true",
+                        help=f"pin the sha256 of the verified downloads in {HASHES_FILE}")
+    args = parser.parse_args()
+
+    results = download_models(args.root, args.workers)
+    if args.pin:
+        print(f"Pinned {len(pin_hashes(args.root))} hashes in {HASHES_FILE}")
+    sys.exit(1 if any(results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Model manifest for the pony generators
+Single list of the checkpoint, LoRAs and embeddings every backend uses
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+REPO_ID = "skas12/illustrious-test1"
+REVISION = "main"
+# filename -> sha256 pinned for REVISION, written by `python model_downloader.py --pin`
+HASHES_FILE = os.environ.get("MODEL_HASHES_FILE",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_hashes.json"))
+
+
+@dataclass(frozen=True)
+class ModelFile:
+    filename: str
+    kind: str  # "checkpoint", "lora" or "embedding"
+    sha256: Optional[str] = None  # pinned hash, None: use the hub's LFS sha256
+    default_weight: float = 1.0  # LoRA strength used by default
+    token: Optional[str] = None  # prompt token of an embedding
+
+    @property
+    def subdir(self) -> str:
+        """ComfyUI models/ sub-directory the file belongs in"""
+        return {"checkpoint": "checkpoints", "lora": "loras", "embedding": "embeddings"}[self.kind]
+
+    @property
+    def name(self) -> str:
+        """File name without extension"""
+        return os.path.splitext(self.filename)[0]
+
+    @property
+    def adapter_name(self) -> str:
+        """diffusers adapter name of a LoRA, e.g. pony_realism_slider"""
+        return re.sub(r"[^0-9a-z]+", "_", self.name.lower()).strip("_")
+
+
+def read_hashes(path: str = HASHES_FILE) -> Dict[str, str]:
+    """Pinned sha256 per filename, empty when nothing is pinned yet"""
+    try:
+        with open(path, "r") as f:
+            return {filename: digest.lower() for filename, digest in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+PINNED_SHA256 = read_hashes()
+
+
+def pinned(entries: List[ModelFile], hashes: Dict[str, str] = PINNED_SHA256) -> List[ModelFile]:
+    """Entries with their pinned sha256 filled in, a hash written in the entry itself wins"""
+    return [replace(entry, sha256=entry.sha256 or hashes.get(entry.filename)) for entry in entries]
+
+
+CHECKPOINT, = pinned([ModelFile("realismIllustriousBy_v50FP16.safetensors", "checkpoint")])
+
+LORAS: List[ModelFile] = pinned([
+    ModelFile("Pony Realism Slider.safetensors", "lora", default_weight=1.0),
+    ModelFile("RealSkin_slider.safetensors", "lora", default_weight=1.0),
+    ModelFile("insta baddie PN.safetensors", "lora", default_weight=0.94),
+    ModelFile("Real_Beauty.safetensors", "lora", default_weight=0.9),
+    ModelFile("Pony_DetailV2.0.safetensors", "lora", default_weight=3.0),
+    ModelFile("perfect ass sliderV1.safetensors", "lora", default_weight=0.34),
+    ModelFile("Detail_Tweaker_Illustrious_BSY_V3.safetensors", "lora", default_weight=0.0),
+])
+
+# LoRA mix of a diffusers request that sets no weights, and what snapshots bake in by default;
+# ComfyUI workflows use each entry's default_weight instead
+DEFAULT_LORA_WEIGHTS: Dict[str, float] = {LORAS[0].adapter_name: 1.0}
+
+EMBEDDINGS: List[ModelFile] = pinned([
+    ModelFile("Stable_Yogis_Realism_Positives_V1.safetensors", "embedding",
+              token="Stable_Yogis_Realism_Positives_V1"),
+    ModelFile("Stable_Yogis_Anatomy_Negatives_V1-neg.safetensors", "embedding",
+              token="Stable_Yogis_Anatomy_Negatives_V1"),
+    ModelFile("Stable_Yogis_General_Negatives_V1-neg.safetensors", "embedding",
+              token="Stable_Yogis_General_Negatives_V1"),
+    ModelFile("Stable_Yogis_Realism_Negatives_V1-neg.safetensors", "embedding",
+              token="Stable_Yogis_Realism_Negatives_V1"),
+])
+
+MANIFEST: List[ModelFile] = [CHECKPOINT] + LORAS + EMBEDDINGS
+
+
+def local_path(entry: ModelFile, models_root: str) -> str:
+    """Where a manifest entry lives under a ComfyUI-style models directory"""
+    return os.path.join(models_root, entry.subdir, entry.filename)
@@ -1,47 +1,107 @@
 import os
-import tempfile
-from typing import List
+import shutil
+import time
+from typing import Dict, List, Optional
 from cog import BasePredictor, Input, Path
 import torch
 from diffusers import StableDiffusionXLPipeline
 from PIL import Image
 
+from prompt_cache import PromptEmbeddingCache
+from step_progress import StepProgress
+from lora_manager import LoraManager, adapter_key, manifest_weights
+from build_snapshot import (SNAPSHOT_DIR, download, load_snapshot, read_metadata, snapshot_adapter_key,
+                            snapshot_mismatch)
+from model_manifest import CHECKPOINT as CHECKPOINT_FILE, DEFAULT_LORA_WEIGHTS, LORAS, REPO_ID
+from textual_inversion import EmbeddingTable
+from image_output import OutputFormat, OutputPool, new_output_path
+from generation_metadata import generation_record
+from memory_mode import MemoryManager
+from cpu_profile import CpuProfile
+from metrics import REQUESTS, observe_stage, start_metrics_server
+from result_cache import ResultCache, request_key
+
+CHECKPOINT = f"{REPO_ID}/{CHECKPOINT_FILE.filename}"
+MAX_OUTPUTS = 8
+LORA_NAMES = ", ".join(entry.name for entry in LORAS)
+# OUTPUT_FORMAT, OUTPUT_QUALITY and OUTPUT_COMPRESS_LEVEL set the defaults
+DEFAULT_OUTPUT = OutputFormat.from_env()
+
 class Predictor(BasePredictor):
     def setup(self) -> None:
         """Load the model into memory to make running multiple predictions efficient"""
         
         print("Loading your custom pony models from Hugging Face...")
+        start = time.perf_counter()
+        
+        # METRICS_PORT exposes /metrics for scraping while predictions run
+        if os.environ.get("METRICS_PORT"):
+            start_metrics_server(int(os.environ["METRICS_PORT"]))
+        
+        # CPUs cannot compute in float16, so without a GPU the CPU profile picks the weights' dtype
+        self.cpu = None if torch.cuda.is_available() else CpuProfile.from_env()
+        dtype = torch.float16 if self.cpu is None else self.cpu.dtype
         
         # Load your custom models from Hugging Face Hub
         # This is much more reliable than CivitAI downloads
         try:
-            # Load the main checkpoint (illustrious)
-            print("Loading Realism Illustrious checkpoint...")
-            self.pipe = StableDiffusionXLPipeline.from_single_file(
-                "skas12/illustrious-test1/realismIllustriousBy_v50FP16.safetensors",
-                torch_dtype=torch.float16,
-                use_safetensors=True,
-                variant="fp16"
-            )
-            print("✅ Checkpoint loaded successfully!")
+            metadata = read_metadata(SNAPSHOT_DIR)
+            mismatch = metadata and snapshot_mismatch(metadata)
+            if mismatch:
+                print(f"⚠️ Ignoring the snapshot at {SNAPSHOT_DIR}, built from another checkpoint: {mismatch}")
+                metadata = None
+            if metadata is not None:
+                # Pre-converted pipeline with the LoRA already fused (python build_snapshot.py)
+                print(f"Loading pre-fused snapshot from {SNAPSHOT_DIR}...")
+                self.pipe, metadata = load_snapshot(SNAPSHOT_DIR, dtype)
+                baked = dict(snapshot_adapter_key(metadata))
+                print(f"✅ Snapshot loaded (checkpoint {metadata['checkpoint']}, fused LoRAs {baked})")
+            else:
+                print(f"⚠️ No snapshot at {SNAPSHOT_DIR}, converting the checkpoint (run build_snapshot.py to skip this)")
+                
+                # Load the main checkpoint (illustrious)
+                print("Loading Realism Illustrious checkpoint...")
+                self.pipe = StableDiffusionXLPipeline.from_single_file(
+                    CHECKPOINT,
+                    torch_dtype=dtype,
+                    use_safetensors=True,
+                    variant="fp16"
+                )
+                baked = {}
+                print("✅ Checkpoint loaded successfully!")
             
-            # Load the LoRA
-            print("Loading Pony Realism Slider LoRA...")
-            self.pipe.load_lora_weights(
-                "skas12/illustrious-test1/Pony Realism Slider.safetensors", 
-                adapter_name="pony_realism"
-            )
-            self.pipe.set_adapters(["pony_realism"], adapter_weights=[1.0])
-            print("✅ LoRA loaded successfully!")
+            # Every manifest LoRA is a named adapter so requests can pick their own weights; each one is
+            # downloaded and loaded on the first request that needs it, and baked ones only if reweighted
+            self.loras = LoraManager(self.pipe, baked=baked)
+            self.loras.register_manifest(download)
+            print(f"✅ {len(LORAS)} LoRAs registered from the manifest")
             
-            # Move to GPU if available
-            if torch.cuda.is_available():
-                self.pipe = self.pipe.to("cuda")
-                print("✅ Custom pony model loaded on GPU")
-            else:
-                print("✅ Custom pony model loaded on CPU")
+            # Textual inversions go into both tokenizers and text encoders once
+            self.embeddings = EmbeddingTable()
+            self.embeddings.load_manifest(self.pipe, download)
+            print(f"✅ {len(self.embeddings)} embeddings loaded: {', '.join(self.embeddings.vectors)}")
+            loaded = time.perf_counter()
+            
+            self.prompt_cache = PromptEmbeddingCache()
+            self.result_cache = ResultCache()
+            self.encoder = OutputPool()
+            
+            # Move to GPU if available, model by model (CPU offload) when the weights would not fit next to a request
+            self.memory = MemoryManager(self.pipe)
+            placement = self.memory.place("cuda" if torch.cuda.is_available() else "cpu")
+            if self.cpu is not None:
+                self.cpu.apply(self.pipe)
+                placement = f"cpu, {self.cpu.describe()}"
+            print(f"✅ Custom pony model loaded ({placement}, memory mode {self.memory.mode})")
+            
+            # Fuse on the target device so the merge runs there
+            self.adapter_key = self.loras.activate(DEFAULT_LORA_WEIGHTS)
+            print(f"✅ LoRA active: {self.loras.stats()}")
             
-            print("🦄 Your custom pony model loaded successfully!")
+            total = time.perf_counter() - start
+            observe_stage("model_load", total)
+            print(f"🦄 Your custom pony model loaded successfully! Startup {total:.1f}s "
+                  f"(weights {loaded - start:.1f}s, to device {total - (loaded - start):.1f}s)")
             
         except Exception as e:
             print(f"❌ CRITICAL ERROR: Failed to load custom model: {e}")
@@ -57,40 +117,152 @@ class Predictor(BasePredictor):
         num_inference_steps: int = Input(description="Number of inference steps", default=25, ge=10, le=50),
         guidance_scale: float = Input(description="Guidance scale", default=7.5, ge=1.0, le=20.0),
         seed: int = Input(description="Random seed for reproducibility", default=None),
-    ) -> Path:
-        """Run a single prediction on the model"""
+        num_outputs: int = Input(description="Number of images to generate in one batch", default=1, ge=1, le=MAX_OUTPUTS),
+        seeds: str = Input(description="Comma-separated seeds, one per output (overrides seed and num_outputs)", default=""),
+        lora_weights: str = Input(description=f"Comma-separated LoRA weights in this order: {LORA_NAMES}. Empty uses the Pony Realism Slider at 1.0", default=""),
+        output_format: str = Input(description="Image file format", default=DEFAULT_OUTPUT.format, choices=["png", "webp", "jpeg"]),
+        output_quality: int = Input(description="WebP/JPEG quality", default=DEFAULT_OUTPUT.quality, ge=1, le=100),
+    ) -> List[Path]:
+        """Run a batched prediction, one image per seed"""
         
         print(f"Generating pony image with prompt: {prompt}")
+        request_prompt, request_negative_prompt = prompt, negative_prompt
+        prompt = self.embeddings.resolve(prompt)
+        negative_prompt = self.embeddings.resolve(negative_prompt)
         
-        # Set seed if provided
-        if seed is not None:
-            torch.manual_seed(seed)
-            generator = torch.Generator(device="cuda" if torch.cuda.is_available() else "cpu").manual_seed(seed)
-        else:
-            generator = None
+        seed_list = self.resolve_seeds(seed, num_outputs, seeds)
+        print(f"Using seeds: {seed_list}")
+        weights = self.resolve_lora_weights(lora_weights)
+        image_format = OutputFormat(output_format, output_quality, DEFAULT_OUTPUT.compress_level)
         
-        # Generate image
-        with torch.autocast("cuda" if torch.cuda.is_available() else "cpu"):
+        # Only requests with caller-chosen seeds are reproducible, so only those are cached
+        cache_key = None
+        if seed is not None or (seeds and seeds.strip()):
+            cache_key = request_key({
+                "checkpoint": CHECKPOINT,
+                "adapters": adapter_key(weights),
+                "embeddings": self.embeddings.key,
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "width": width,
+                "height": height,
+                "num_inference_steps": num_inference_steps,
+                "guidance_scale": guidance_scale,
+                "seeds": seed_list,
+                "output": image_format.key(),
+            })
+            cached = self.result_cache.get(cache_key)
+            if cached:
+                print("✅ Served from result cache")
+                REQUESTS.labels(outcome="cached").inc()
+                return [self.copy_output(path) for path in cached]
+        
+        # Fused or cached weight sets make switching between recent LoRA mixes cheap
+        started = time.perf_counter()
+        self.adapter_key = self.loras.activate(weights)
+        timings = {"lora_switch_s": time.perf_counter() - started}
+        
+        # One generator per image keeps every output reproducible from its own seed
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        generators = [torch.Generator(device=device).manual_seed(s) for s in seed_list]
+        
+        # Log every denoising step so Cog streams progress while the pipeline runs
+        progress = StepProgress(num_inference_steps, on_step=lambda update: print(
+            f"Step {update.step}/{update.total}: {update.step_time * 1000:.0f} ms ({update.elapsed:.1f}s elapsed)"
+        ))
+        
+        # Decode tiling and attention slicing only when this resolution and batch would not fit otherwise
+        memory_plan = self.memory.prepare(width, height, len(seed_list))
+        
+        # Generate images
+        autocast = self.cpu.autocast() if self.cpu is not None else torch.autocast(device)
+        with self.memory.track() as memory, autocast:
+            started = time.perf_counter()
+            embeds = self.prompt_cache.encode(self.pipe, prompt, negative_prompt, adapter_key=self.adapter_key,
+                                              embeddings_key=self.embeddings.key)
+            timings["text_encode_s"] = time.perf_counter() - started
+            progress.start()
             result = self.pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
+                **embeds,
                 width=width,
                 height=height,
                 num_inference_steps=num_inference_steps,
                 guidance_scale=guidance_scale,
-                generator=generator
+                num_images_per_prompt=len(seed_list),
+                generator=generators,
+                callback_on_step_end=progress,
+                output_type="np"
             )
+            timings["vae_decode_s"] = progress.since_last_step()
+            observe_stage("vae_decode", timings["vae_decode_s"])
+        timings.update(progress.timings())
+        
+        # Request parameters and timings go into every file's header (python check_metadata.py --index)
+        records = [generation_record("predict", {
+            "checkpoint": os.path.basename(CHECKPOINT),
+            "prompt": request_prompt,
+            "negative_prompt": request_negative_prompt,
+            "seed": image_seed,
+            "batch_seeds": seed_list,
+            "width": width,
+            "height": height,
+            "steps": num_inference_steps,
+            "guidance_scale": guidance_scale,
+            "loras": dict(self.adapter_key),
+            "memory": {"level": memory_plan.level, "offload": memory_plan.offload, **memory},
+        }, timings) for image_seed in seed_list]
         
-        # Save the generated image
-        image = result.images[0]
+        # Each image is converted, encoded, written and hashed once, the batch in parallel on the output pool
+        outputs = self.encoder.encode_all(result.images, image_format, records=records)
+        for image_seed, output in zip(seed_list, outputs):
+            print(f"📦 Seed {image_seed}: {output.size // 1024} KiB, sha256 {output.sha256[:16]}")
+        output_paths = [Path(output.path) for output in outputs]
         
-        # Save to temporary file
-        output_path = Path(tempfile.mktemp(suffix=".png"))
-        image.save(output_path)
+        REQUESTS.labels(outcome="generated").inc()
+        if cache_key is not None:
+            self.result_cache.put_files(cache_key, [str(path) for path in output_paths])
         
-        print("✅ Image generated successfully!")
+        print(f"✅ {len(output_paths)} image(s) generated successfully in {progress.summary()}! Prompt cache: {self.prompt_cache.stats()}")
+        print(f"🧠 Memory: {memory_plan.describe()}, peak {memory['peak_memory_mb']:.0f} MiB")
+        return output_paths
+
+    @staticmethod
+    def copy_output(path: str) -> Path:
+        """Copy a cached file out so Cog can own and clean up the returned path"""
+        output_path = Path(new_output_path(os.path.splitext(path)[1]))
+        shutil.copyfile(path, output_path)
         return output_path
 
+    @staticmethod
+    def resolve_lora_weights(lora_weights: str) -> Dict[str, float]:
+        """Work out the weight of every manifest LoRA, zero disables it"""
+        if not lora_weights or not lora_weights.strip():
+            return dict(DEFAULT_LORA_WEIGHTS)
+        try:
+            vector = [float(w) for w in lora_weights.replace(" ", "").split(",") if w]
+        except ValueError:
+            raise ValueError(f"Invalid LoRA weights: {lora_weights!r}")
+        return manifest_weights(vector)
+
+    @staticmethod
+    def resolve_seeds(seed: Optional[int], num_outputs: int, seeds: str) -> List[int]:
+        """Work out one seed per output image"""
+        if seeds and seeds.strip():
+            try:
+                seed_list = [int(s) for s in seeds.replace(" ", "").split(",") if s]
+            except ValueError:
+                raise ValueError(f"Invalid seeds list: {seeds!r}")
+            if not seed_list:
+                raise ValueError("Seeds list is empty")
+            if len(seed_list) > MAX_OUTPUTS:
+                raise ValueError(f"At most {MAX_OUTPUTS} seeds are supported per prediction")
+            return seed_list
+        
+        # Random seeds are still reported so every image can be regenerated
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), "big")
+        return [seed + i for i in range(num_outputs)]
+
 def main():
     """Main function for local testing"""
     predictor = Predictor()
@@ -104,10 +276,15 @@ def main():
         height=1024,
         num_inference_steps=25,
         guidance_scale=7.5,
-        seed=42
+        seed=42,
+        num_outputs=1,
+        seeds="",
+        lora_weights="",
+        output_format=DEFAULT_OUTPUT.format,
+        output_quality=DEFAULT_OUTPUT.quality
     )
     
-    print(f"Generated image saved to: {result}")
+    print(f"Generated images saved to: {result}")
 
 if __name__ == "__main__":
     main()
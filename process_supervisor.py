@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Child process supervisor for the ComfyUI server
+Drains output into a ring buffer and probes readiness with backoff
+"""
+
+import collections
+import subprocess
+import threading
+import time
+from typing import Callable, Deque, List, Optional
+
+import requests
+
+from metrics import observe_stage
+
+
+class ProcessExitedError(Exception):
+    """The supervised process exited before becoming ready"""
+
+
+class ProcessSupervisor:
+    """Runs a server process and tracks its output and readiness.
+
+    stdout and stderr are merged and read continuously by a daemon thread,
+    so the child can never block on a full pipe. The last `log_lines` lines
+    are kept for diagnostics. With a `stage`, the time to ready is recorded
+    as that stage in pony_stage_seconds.
+    """
+
+    def __init__(self, cmd: List[str], name: str = "process", log_lines: int = 500,
+                 echo: bool = False, stage: Optional[str] = None, **popen_kwargs):
+        self.cmd = cmd
+        self.name = name
+        self.stage = stage
+        self.echo = echo
+        self.popen_kwargs = popen_kwargs
+        self.log: Deque[str] = collections.deque(maxlen=log_lines)
+        self.process: Optional[subprocess.Popen] = None
+        self.time_to_ready: Optional[float] = None
+        self._started_at: Optional[float] = None
+        self._reader: Optional[threading.Thread] = None
+
+    def start(self) -> subprocess.Popen:
+        """Launch the process and start draining its output"""
+        self._started_at = time.monotonic()
+        self.time_to_ready = None
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            **self.popen_kwargs
+        )
+        self._reader = threading.Thread(target=self._drain, args=(self.process,), daemon=True)
+        self._reader.start()
+        return self.process
+
+    def _drain(self, process: subprocess.Popen):
+        for raw in iter(process.stdout.readline, b""):
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            self.log.append(line)
+            if self.echo:
+                print(f"[{self.name}] {line}")
+        process.stdout.close()
+
+    def poll(self) -> Optional[int]:
+        """Exit code of the process, or None while it is running"""
+        return None if self.process is None else self.process.poll()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def tail(self, lines: int = 20) -> str:
+        """Last lines of process output"""
+        return "\n".join(list(self.log)[-lines:])
+
+    def wait_until_ready(self, probe: Callable[[], bool], timeout: float = 120.0,
+                         initial_delay: float = 0.05, max_delay: float = 2.0,
+                         backoff: float = 1.5) -> float:
+        """Probe until ready, with exponential backoff, returns seconds since start.
+
+        Raises ProcessExitedError as soon as the child dies and TimeoutError
+        when it is not ready within `timeout` seconds.
+        """
+        if self.process is None:
+            raise RuntimeError(f"{self.name} has not been started")
+
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while True:
+            code = self.process.poll()
+            if code is not None:
+                raise ProcessExitedError(
+                    f"{self.name} exited with code {code} before becoming ready:\n{self.tail()}"
+                )
+            try:
+                if probe():
+                    self.time_to_ready = time.monotonic() - self._started_at
+                    if self.stage is not None:
+                        observe_stage(self.stage, self.time_to_ready)
+                    return self.time_to_ready
+            except Exception:
+                pass
+
+            now = time.monotonic()
+            if now >= deadline:
+                raise TimeoutError(f"{self.name} not ready after {timeout:.0f}s:\n{self.tail()}")
+            time.sleep(min(delay, deadline - now))
+            delay = min(delay * backoff, max_delay)
+
+    def stop(self, timeout: float = 10.0):
+        """Terminate the process, killing it if it does not exit in time"""
+        if not self.is_alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def http_probe(url: str, session: Optional[requests.Session] = None, timeout: float = 1.0) -> Callable[[], bool]:
+    """Readiness probe that succeeds on an HTTP 200 from url"""
+    http = session if session is not None else requests
+
+    def probe() -> bool:
+        return http.get(url, timeout=timeout).status_code == 200
+
+    return probe
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+LRU cache of SDXL prompt embeddings
+Skips both text encoders for prompts and negative prompts seen before
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import torch
+
+from metrics import CACHE_LOOKUPS, time_stage
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_MB", "128")) * 1024 * 1024
+
+
+def tensor_bytes(*tensors: torch.Tensor) -> int:
+    """Device memory held by a group of tensors"""
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class PromptEmbeddingCache:
+    """Memory-bounded LRU of (prompt_embeds, pooled_prompt_embeds) per text.
+
+    Prompts and negative prompts are cached as separate entries, so the shared
+    default negative prompt is encoded once no matter which prompt it is paired
+    with. Keys include the adapter configuration because text-encoder LoRAs
+    change the embeddings, and the textual-inversion set because it changes
+    what the tokens mean.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries: "OrderedDict[Tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _encode_text(self, pipe, text: str, device) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Run both SDXL text encoders on one text"""
+        with torch.no_grad(), time_stage("prompt_encode"):
+            prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+                prompt=text,
+                device=device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+        return prompt_embeds, pooled_prompt_embeds
+
+    def _lookup(self, pipe, text: str, adapter_key: Hashable, device,
+                embeddings_key: Hashable = ()) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = (text, adapter_key, embeddings_key, str(device))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels(cache="prompt", result="hit").inc()
+                return entry
+            self.misses += 1
+        CACHE_LOOKUPS.labels(cache="prompt", result="miss").inc()
+
+        entry = self._encode_text(pipe, text, device)
+        size = tensor_bytes(*entry)
+        with self._lock:
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= tensor_bytes(*evicted)
+        return entry
+
+    def encode(self, pipe, prompt: str, negative_prompt: Optional[str] = None,
+               adapter_key: Hashable = (), device=None, embeddings_key: Hashable = ()) -> Dict[str, torch.Tensor]:
+        """Return pipeline keyword arguments with cached embeddings instead of raw text"""
+        if device is None:
+            device = pipe._execution_device
+
+        prompt_embeds, pooled_prompt_embeds = self._lookup(pipe, prompt, adapter_key, device, embeddings_key)
+
+        # Like the SDXL pipeline, only an omitted negative prompt means zero embeddings; "" is encoded
+        if negative_prompt is None and getattr(pipe.config, "force_zeros_for_empty_prompt", False):
+            negative_prompt_embeds = torch.zeros_like(prompt_embeds)
+            negative_pooled_prompt_embeds = torch.zeros_like(pooled_prompt_embeds)
+        else:
+            negative_prompt_embeds, negative_pooled_prompt_embeds = self._lookup(
+                pipe, negative_prompt or "", adapter_key, device, embeddings_key
+            )
+
+        return {
+            "prompt_embeds": prompt_embeds,
+            "pooled_prompt_embeds": pooled_prompt_embeds,
+            "negative_prompt_embeds": negative_prompt_embeds,
+            "negative_pooled_prompt_embeds": negative_pooled_prompt_embeds,
+        }
+
+    def clear(self):
+        """Drop all cached embeddings, e.g. after the adapters or text encoders change"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
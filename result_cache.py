@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache of generated images
+Keyed by a canonical hash of the full generation request, evicted LRU by size
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from image_output import link_or_copy
+from metrics import CACHE_LOOKUPS
+
+DEFAULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(".cache", "results"))
+DEFAULT_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+
+def request_key(request: Any) -> str:
+    """Canonical sha256 of a JSON-serialisable request (workflow dict or predict inputs)"""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Directory of cached results, one sub-directory of image files per request key.
+
+    Entries are written to a temporary directory and renamed into place, so a
+    crash never leaves a half-written hit behind. Access order is tracked in
+    memory (seeded from directory mtimes at startup) and the least recently
+    used entries are removed once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load_index(self):
+        """Rebuild the LRU order from what is already on disk"""
+        found: List[Tuple[float, str, int]] = []
+        for name in os.listdir(self.directory):
+            path = self._entry_dir(name)
+            if name.startswith(".tmp-"):
+                # Left behind by an interrupted write
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            found.append((os.path.getmtime(path), name, size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._bytes += size
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Paths of the cached images for a key, or None on a miss"""
+        path = self._entry_dir(key)
+        with self._lock:
+            if key not in self._entries or not os.path.isdir(path):
+                self.misses += 1
+                CACHE_LOOKUPS.labels(cache="result", result="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        CACHE_LOOKUPS.labels(cache="result", result="hit").inc()
+        try:
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return self._files(key)
+
+    def _files(self, key: str) -> List[str]:
+        path = self._entry_dir(key)
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))]
+
+    def put_bytes(self, key: str, blobs: List[bytes], suffix: str = ".png") -> List[str]:
+        """Store encoded images under a key"""
+        def write(tmp_dir: str):
+            for i, blob in enumerate(blobs):
+                with open(os.path.join(tmp_dir, f"{i:04d}{suffix}"), "wb") as f:
+                    f.write(blob)
+        return self._store(key, write)
+
+    def put_files(self, key: str, paths: List[str], move: bool = False) -> List[str]:
+        """Store already encoded image files under a key, moving them in or linking/copying them"""
+        def write(tmp_dir: str):
+            for i, source in enumerate(paths):
+                suffix = os.path.splitext(str(source))[1] or ".png"
+                destination = os.path.join(tmp_dir, f"{i:04d}{suffix}")
+                if move:
+                    shutil.move(str(source), destination)
+                else:
+                    link_or_copy(str(source), destination)
+        return self._store(key, write)
+
+    def _store(self, key: str, write) -> List[str]:
+        final_dir = self._entry_dir(key)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            write(tmp_dir)
+            size = sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in os.listdir(tmp_dir))
+            with self._lock:
+                if key in self._entries:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                else:
+                    if os.path.isdir(final_dir):
+                        shutil.rmtree(final_dir, ignore_errors=True)
+                    os.replace(tmp_dir, final_dir)
+                    self._entries[key] = size
+                    self._bytes += size
+                    self._evict()
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return self._files(key)
+
+    def _evict(self):
+        """Drop least recently used entries until under the size bound (lock held)"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and disk usage"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
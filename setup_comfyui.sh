@@ -34,60 +34,8 @@ mkdir -p models/embeddings
 # Download your custom models
 echo "Downloading custom models from Hugging Face..."
 
-# Download checkpoint
-python -c "
-from huggingface_hub import hf_hub_download
-import os
-
-# Download checkpoint
-checkpoint_path = hf_hub_download(
-    repo_id='skas12/illustrious-test1',
-    filename='realismIllustriousBy_v50FP16.safetensors',
-    local_dir='models/checkpoints'
-)
-print(f'Checkpoint downloaded to: {checkpoint_path}')
-
-# Download LoRAs
-loras = [
-    'Pony Realism Slider.safetensors',
-    'RealSkin_slider.safetensors', 
-    'insta baddie PN.safetensors',
-    'Real_Beauty.safetensors',
-    'Pony_DetailV2.0.safetensors',
-    'perfect ass sliderV1.safetensors',
-    'Detail_Tweaker_Illustrious_BSY_V3.safetensors'
-]
-
-for lora in loras:
-    try:
-        lora_path = hf_hub_download(
-            repo_id='skas12/illustrious-test1',
-            filename=lora,
-            local_dir='models/loras'
-        )
-        print(f'LoRA downloaded: {lora}')
-    except Exception as e:
-        print(f'Failed to download {lora}: {e}')
-
-# Download embeddings
-embeddings = [
-    'Stable_Yogis_Realism_Positives_V1.safetensors',
-    'Stable_Yogis_Anatomy_Negatives_V1-neg.safetensors',
-    'Stable_Yogis_General_Negatives_V1-neg.safetensors',
-    'Stable_Yogis_Realism_Negatives_V1-neg.safetensors'
-]
-
-for embedding in embeddings:
-    try:
-        embedding_path = hf_hub_download(
-            repo_id='skas12/illustrious-test1',
-            filename=embedding,
-            local_dir='models/embeddings'
-        )
-        print(f'Embedding downloaded: {embedding}')
-    except Exception as e:
-        print(f'Failed to download {embedding}: {e}')
-"
+# Checkpoint, LoRAs and embeddings are fetched in parallel from the shared manifest
+python ../model_downloader.py --root models
 
 echo "ComfyUI setup complete!"
 echo "To run ComfyUI: python main.py --listen 0.0.0.0 --port 8188"
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Per-step progress, cheap previews and cooperative cancellation for diffusers pipelines
+Hooks into callback_on_step_end, previews come from a linear latent-to-RGB map instead of the VAE
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+import torch
+from PIL import Image
+
+from metrics import observe_stage
+
+# Linear approximation of the SDXL VAE decoder (same factors ComfyUI uses for latent2rgb previews)
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+
+class GenerationCancelled(Exception):
+    """Raised inside the denoising loop when the cancel token is set"""
+
+
+class CancelToken:
+    """Thread-safe flag checked by the pipeline after every step"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class StepUpdate:
+    """Progress of one finished denoising step"""
+
+    def __init__(self, step: int, total: int, step_time: float, elapsed: float,
+                 previews: Optional[List[Image.Image]] = None):
+        self.step = step
+        self.total = total
+        self.step_time = step_time
+        self.elapsed = elapsed
+        self.previews = previews or []
+
+    def __repr__(self):
+        return f"StepUpdate({self.step}/{self.total}, {self.step_time * 1000:.0f} ms)"
+
+
+def latents_to_rgb(latents: torch.Tensor,
+                   factors: List[List[float]] = SDXL_LATENT_RGB_FACTORS,
+                   bias: List[float] = SDXL_LATENT_RGB_BIAS) -> List[Image.Image]:
+    """Approximate RGB previews (1/8 resolution) of a batch of latents"""
+    with torch.no_grad():
+        weight = torch.tensor(factors, dtype=torch.float32, device=latents.device)
+        offset = torch.tensor(bias, dtype=torch.float32, device=latents.device)
+        rgb = torch.einsum("bchw,cr->bhwr", latents.float(), weight) + offset
+        rgb = ((rgb + 1.0) / 2.0).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+    return [Image.fromarray(image) for image in rgb]
+
+
+class StepProgress:
+    """callback_on_step_end hook reporting per-step timing and optional previews.
+
+    Pass an instance as `callback_on_step_end` to a diffusers pipeline call.
+    After every step it checks the cancel token and raises
+    GenerationCancelled when it is set, which unwinds the pipeline before
+    the remaining steps and the VAE decode run. Previews are made every
+    `preview_every` steps (0 disables them) and only cost one small matmul.
+    """
+
+    def __init__(self, total_steps: int, on_step: Optional[Callable[[StepUpdate], None]] = None,
+                 cancel_token: Optional[CancelToken] = None, preview_every: int = 0):
+        self.total_steps = total_steps
+        self.on_step = on_step
+        self.cancel_token = cancel_token
+        self.preview_every = preview_every
+        self.step_times: List[float] = []
+        self.start()
+
+    def start(self):
+        """Reset the clock, call right before the pipeline so setup is not counted as a step"""
+        self._started = time.perf_counter()
+        self._last = self._started
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.perf_counter()
+        self.step_times.append(now - self._last)
+        self._last = now
+        observe_stage("denoise_step", self.step_times[-1])
+
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            raise GenerationCancelled(f"Cancelled after step {step + 1}/{self.total_steps}")
+
+        previews = None
+        if self.preview_every and (step + 1) % self.preview_every == 0 and "latents" in callback_kwargs:
+            previews = latents_to_rgb(callback_kwargs["latents"])
+
+        if self.on_step is not None:
+            self.on_step(StepUpdate(step + 1, self.total_steps, self.step_times[-1], now - self._started, previews))
+        return callback_kwargs
+
+    def since_last_step(self) -> float:
+        """Seconds since the last step finished, i.e. the decode time once the pipeline returns"""
+        return time.perf_counter() - self._last
+
+    def timings(self) -> Dict[str, float]:
+        """Denoising time and step count of the run, for generation records"""
+        return {"steps": len(self.step_times), "denoise_s": sum(self.step_times)}
+
+    def summary(self) -> str:
+        """Step count and mean step time"""
+        if not self.step_times:
+            return "no steps run"
+        mean = sum(self.step_times) / len(self.step_times)
+        return f"{len(self.step_times)} steps, {mean * 1000:.0f} ms/step"
+
+
+def run_with_progress(run: Callable[[StepProgress], Any], total_steps: int,
+                      cancel_token: Optional[CancelToken] = None,
+                      preview_every: int = 0) -> Generator[StepUpdate, None, Any]:
+    """Run run(callback) on a helper thread, yielding a StepUpdate per step and returning its result
+
+    Closing the generator early cancels the pipeline and waits for it to stop,
+    so the device is free again when close() returns.
+    """
+    token = cancel_token if cancel_token is not None else CancelToken()
+    updates: "queue.Queue[Optional[StepUpdate]]" = queue.Queue()
+    progress = StepProgress(total_steps, on_step=updates.put, cancel_token=token, preview_every=preview_every)
+    outcome: Dict[str, Any] = {}
+
+    def target():
+        try:
+            outcome["result"] = run(progress)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            updates.put(None)
+
+    thread = threading.Thread(target=target, name="diffusers-steps", daemon=True)
+    thread.start()
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            yield update
+    finally:
+        if thread.is_alive():
+            token.cancel()
+            thread.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from check_metadata import MetadataIndex
+from generation_metadata import generation_record
+from image_output import OutputFormat, encode_image
+
+
+def write(directory, image_format: str, seed: int, prompt: str, loras) -> str:
+    frame = np.full((16, 16, 3), seed * 40, dtype=np.uint8)
+    record = generation_record("predict", {"seed": seed, "prompt": prompt, "negative_prompt": "blurry", "loras": loras})
+    return encode_image(frame, OutputFormat(image_format), str(directory), record).path
+
+
+def paths(rows):
+    return {row["path"] for row in rows}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(str(tmp_path / "index.sqlite"))
+    yield index
+    index.close()
+
+
+def test_index_and_query_every_format(tmp_path, index):
+    outputs = tmp_path / "outputs"
+    outputs.mkdir()
+    png = write(outputs, "png", 1, "a pony with a rainbow mane", {"pony_realism_slider": 1.0})
+    webp = write(outputs, "webp", 2, "a rainbow over the meadow", {"pony_realism_slider": 0.5, "realskin_slider": 1.0})
+    jpeg = write(outputs, "jpeg", 3, "a pony in the snow", {})
+
+    counts = index.index(str(outputs))
+    assert counts["added"] == 3 and counts["without_record"] == 0
+
+    assert paths(index.query(prompt="rainbow")) == {png, webp}
+    # Every word must appear, in any order, and only the prompt is searched
+    assert paths(index.query(prompt="mane rainbow")) == {png}
+    assert paths(index.query(prompt="blurry")) == set()
+    assert paths(index.query(lora="pony_realism_slider")) == {png, webp}
+    assert paths(index.query(lora="pony_realism_slider", lora_weight=0.5)) == {webp}
+    assert paths(index.query(seed=3)) == {jpeg}
+    assert paths(index.query(seed=1, prompt="pony")) == {png}
+
+
+def test_reindex_picks_up_changes_and_deletions(tmp_path, index):
+    outputs = tmp_path / "outputs"
+    outputs.mkdir()
+    png = write(outputs, "png", 1, "a pony with a rainbow mane", {"pony_realism_slider": 1.0})
+    webp = write(outputs, "webp", 2, "a rainbow over the meadow", {})
+    jpeg = write(outputs, "jpeg", 3, "a pony in the snow", {})
+    index.index(str(outputs))
+    assert index.index(str(outputs))["unchanged"] == 3
+
+    # Regenerate the PNG in place with another record, and delete the JPEG
+    os.replace(write(outputs, "png", 4, "a unicorn at dusk", {"realskin_slider": 0.8}), png)
+    stat = os.stat(png)
+    os.utime(png, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    os.remove(jpeg)
+
+    counts = index.index(str(outputs))
+    assert (counts["added"], counts["updated"], counts["unchanged"], counts["removed"]) == (0, 1, 1, 1)
+    assert index.count() == 2
+    assert paths(index.query(seed=4)) == {png}
+    assert paths(index.query(prompt="unicorn")) == {png}
+    assert paths(index.query(lora="realskin_slider")) == {png}
+    # The old record and the deleted file are gone from the full-text and LoRA indexes too
+    assert paths(index.query(prompt="rainbow")) == {webp}
+    assert paths(index.query(prompt="snow")) == set()
+    assert paths(index.query(lora="pony_realism_slider")) == set()
+    assert paths(index.query(seed=3)) == set()
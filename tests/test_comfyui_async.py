@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from bench.fake_comfyui import FakeComfyUIServer
+from comfyui_async import AsyncComfyUIManager
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {}},
+    "9": {"class_type": "SaveImage", "inputs": {}},
+}
+
+
+def test_many_prompts_in_flight_on_one_loop():
+    async def run(url):
+        async with AsyncComfyUIManager(url) as client:
+            async def one():
+                prompt_id = await client.queue_prompt(WORKFLOW)
+                events = [event async for event in client.watch(prompt_id)]
+                history = await client.wait_for_completion(prompt_id)
+                return events, history
+
+            return await asyncio.gather(*[one() for _ in range(20)])
+
+    with FakeComfyUIServer(execution_time=0.3) as server:
+        results = asyncio.run(run(server.url))
+    for events, history in results:
+        types = [event["type"] for event in events]
+        # Previews carry no prompt id and the fake runs every prompt at once, so only count progress
+        assert types.count("progress") == 4 and types[-1] == "executing"
+        assert history["outputs"]["9"]["images"]
+
+
+def test_previews_follow_the_executing_prompt():
+    async def run(url):
+        async with AsyncComfyUIManager(url) as client:
+            prompt_id = await client.queue_prompt(WORKFLOW)
+            return [event async for event in client.watch(prompt_id)]
+
+    with FakeComfyUIServer(execution_time=0.1) as server:
+        events = asyncio.run(run(server.url))
+    previews = [event for event in events if event["type"] == "preview"]
+    assert len(previews) == 4 and previews[0]["data"]["image"].startswith(b"\x89PNG")
+
+
+def test_client_stays_on_one_event_loop():
+    with FakeComfyUIServer() as server:
+        client = AsyncComfyUIManager(server.url)
+        first = asyncio.new_event_loop()
+        first.run_until_complete(client.get_history("missing"))
+        with pytest.raises(RuntimeError, match="another event loop"):
+            asyncio.run(client.get_history("missing"))
+
+        async def on_new_loop():
+            async with client:
+                return await client.get_history("missing")
+
+        # Nothing can wait on a closed loop, so the client moves on
+        first.close()
+        assert asyncio.run(on_new_loop()) == {}
+
+
+def test_download_image_keeps_encoded_file(tmp_path, monkeypatch):
+    import comfyui_async
+    from image_output import ChunkWriter
+
+    # Small chunks, so the image arrives in many of them; each must reach the writer on its own
+    monkeypatch.setattr(comfyui_async, "CHUNK_SIZE", 64)
+    writes = []
+    write = ChunkWriter.write
+
+    def record_write(self, chunk):
+        writes.append(len(chunk))
+        write(self, chunk)
+
+    monkeypatch.setattr(ChunkWriter, "write", record_write)
+
+    async def run(url):
+        async with AsyncComfyUIManager(url) as client:
+            prompt_id = await client.queue_prompt(WORKFLOW)
+            history = await client.wait_for_completion(prompt_id)
+            info = history["outputs"]["9"]["images"][0]
+            return await client.download_image(info["filename"], directory=str(tmp_path), record={"seed": 1})
+
+    with FakeComfyUIServer(execution_time=0.05) as server:
+        path = asyncio.run(run(server.url))
+    with open(path, "rb") as f:
+        assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+    assert len(writes) > 1 and max(writes) <= 64
+
+
+def test_generate_pony_async_runs_on_the_scheduler(tmp_path, monkeypatch):
+    from job_scheduler import JobScheduler
+    from result_cache import ResultCache
+
+    with FakeComfyUIServer(execution_time=0.3) as server:
+        monkeypatch.setenv("COMFYUI_BACKENDS", server.url)
+        from comfyui_app import PonyComfyUIWorkflow
+
+        workflow = PonyComfyUIWorkflow()
+        workflow.result_cache = ResultCache(str(tmp_path))
+        scheduler = JobScheduler(workers=1, name="test", max_running=8)
+        jobs = [scheduler.submit(workflow.generate_pony_async, prompt="a pony", seed=seed, previews=False,
+                                 client_id=f"c{seed}") for seed in range(8)]
+        results = [job.result(timeout=30) for job in jobs]
+    for path, message in results:
+        assert path is not None, message
+        assert path.startswith(str(tmp_path))
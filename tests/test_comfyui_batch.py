@@ -0,0 +1,45 @@
+import pytest
+
+from bench.fake_comfyui import FakeComfyUIServer
+from generation_metadata import read_record
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def pony(tmp_path, monkeypatch):
+    with FakeComfyUIServer(execution_time=0.1) as server:
+        monkeypatch.setenv("COMFYUI_BACKENDS", server.url)
+        from comfyui_app import PonyComfyUIWorkflow
+
+        workflow = PonyComfyUIWorkflow()
+        workflow.result_cache = ResultCache(str(tmp_path))
+        yield workflow
+
+
+def test_batch_files_carry_their_own_seed(pony, tmp_path):
+    seeds = [5, 6, 7]
+    paths, message = pony.generate_batch(seeds, ["a pony", "a horse", "a pony"], steps=4)
+
+    assert len(paths) == 3, message
+    records = [read_record(path) for path in paths]
+    assert [record["seed"] for record in records] == seeds
+    assert [record["prompt"] for record in records] == ["a pony", "a horse", "a pony"]
+    assert all(path.startswith(str(tmp_path)) for path in paths)
+
+    cached, message = pony.generate_batch(seeds, ["a pony", "a horse", "a pony"], steps=4)
+    assert cached == paths and "cache" in message
+
+
+def test_latent_batch_runs_one_sampler(pony):
+    workflow = pony.create_batch_workflow(["a pony"] * 3, [5, 6, 7], per_seed=False)
+    assert sum(1 for node in workflow.values() if node["class_type"] == "KSampler") == 1
+    assert workflow[pony.template.latent]["inputs"]["batch_size"] == 3
+
+    paths, message = pony.generate_batch([5, 6, 7], "a pony", steps=4, per_seed=False)
+    assert len(paths) == 3, message
+    records = [read_record(path) for path in paths]
+    assert [record["batch_index"] for record in records] == [0, 1, 2]
+    assert {record["seed"] for record in records} == {5}
+
+    with pytest.raises(ValueError):
+        pony.create_batch_workflow(["a pony", "a horse"], [5, 6], per_seed=False)
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from bench.fake_comfyui import FakeComfyUIServer
+from comfyui_app import ComfyUIManager
+from comfyui_events import watch_prompt
+from comfyui_setup import ComfyUIAPI
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {}},
+    "9": {"class_type": "SaveImage", "inputs": {}},
+}
+
+
+def run(server, on_event=None):
+    client = ComfyUIManager(server.url)
+    prompt_id = client.queue_prompt(WORKFLOW)
+    events = []
+
+    def collect(event):
+        events.append(event)
+        if on_event is not None:
+            on_event(event)
+
+    try:
+        return client.wait_for_completion(prompt_id, timeout=10, on_event=collect), events
+    finally:
+        client.events.close()
+
+
+def test_completion_over_websocket():
+    with FakeComfyUIServer(execution_time=0.2) as server:
+        history, events = run(server)
+    types = [event["type"] for event in events]
+    assert types.count("progress") == 4
+    assert types.count("preview") == 4
+    assert types[-1] == "executing" and events[-1]["data"]["node"] is None
+    assert history["outputs"]["9"]["images"]
+
+
+def test_execution_error_fails_the_wait():
+    with FakeComfyUIServer(execution_time=0.2, fail=True) as server:
+        events = []
+        with pytest.raises(Exception, match="Workflow failed"):
+            run(server, on_event=events.append)
+    assert "execution_error" in [event["type"] for event in events]
+
+
+def test_dropped_socket_falls_back_to_polling():
+    with FakeComfyUIServer(execution_time=0.6) as server:
+        dropped = threading.Event()
+
+        def drop_after_first_step(event):
+            if event["type"] == "progress" and not dropped.is_set():
+                dropped.set()
+                server.state.drop_sockets()
+
+        history, events = run(server, on_event=drop_after_first_step)
+    assert dropped.is_set()
+    # No further events arrive once the socket is gone, the history poll finishes the wait
+    assert [event["type"] for event in events].count("progress") < 4
+    assert history["outputs"]["9"]["images"]
+
+
+def test_setup_client_shares_the_wait():
+    with FakeComfyUIServer(execution_time=0.2) as server:
+        client = ComfyUIAPI(server.url)
+        prompt_id = client.queue_prompt(WORKFLOW)
+        try:
+            history = client.wait_for_completion(prompt_id, timeout=10)
+            # Completion came over the websocket, not from polling alone
+            assert client.client_id in server.state.sockets
+        finally:
+            client.events.close()
+    assert history["outputs"]["9"]["images"]
+
+
+def test_watch_polls_history_without_a_websocket():
+    with FakeComfyUIServer(execution_time=0.3) as server:
+        client = ComfyUIManager(server.url)
+        client.events.ensure_connected = lambda: False
+        prompt_id = client.queue_prompt(WORKFLOW)
+        watch = watch_prompt(client.events, client.get_history, prompt_id, timeout=10, heartbeat=0.05)
+        heartbeats = 0
+        while True:
+            try:
+                assert next(watch) is None
+                heartbeats += 1
+            except StopIteration as done:
+                history = done.value
+                break
+    assert heartbeats > 1
+    assert history["outputs"]["9"]["images"]
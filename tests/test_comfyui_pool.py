@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from bench.fake_comfyui import FakeComfyUIServer
+from comfyui_pool import ComfyUIPool
+
+
+class CountingSession(requests.Session):
+    """Counts /system_stats probes and makes them slow enough for callers to overlap"""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+        self.probes = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        if url.endswith("/system_stats"):
+            with self.lock:
+                self.probes += 1
+            time.sleep(self.delay)
+        return super().get(url, **kwargs)
+
+
+@pytest.fixture
+def servers():
+    started = [FakeComfyUIServer().start() for _ in range(3)]
+    yield started
+    for server in started:
+        try:
+            server.stop()
+        except OSError:
+            pass
+
+
+def make_pool(servers, **kwargs) -> ComfyUIPool:
+    return ComfyUIPool([server.url for server in servers], client_factory=lambda url: url, **kwargs)
+
+
+def test_spreads_load_and_prefers_affinity(servers):
+    pool = make_pool(servers, session=CountingSession())
+
+    picked = [pool.select((name,), reserve=True) for name in "abc"]
+    assert {backend.url for backend in picked} == {server.url for server in servers}
+
+    # Every backend has one prompt; the one that last ran ("b",) wins the tie, even one prompt behind
+    assert pool.select(("b",)) is picked[1]
+    pool.finish(picked[0])
+    assert pool.select(("b",)) is picked[1]
+    assert pool.select(("d",)) is picked[0]
+
+
+def test_down_backend_is_reprobed_and_rejoins(servers):
+    pool = make_pool(servers, session=CountingSession(), health_interval=0.0, max_failures=2, retry_interval=60.0)
+    dead = servers[0]
+    host, port = dead.httpd.server_address[:2]
+    dead.stop()
+
+    for _ in range(3):
+        assert pool.select().url != dead.url
+    backend = next(backend for backend in pool.backends if backend.url == dead.url)
+    assert pool.is_down(backend)
+    assert len(pool.backends) == 3
+
+    # Within the retry interval the down backend is left alone
+    failures = backend.failures
+    pool.select()
+    assert backend.failures == failures
+
+    servers[0] = FakeComfyUIServer(host, port).start()
+    pool.retry_interval = 0.0
+    pool.refresh()
+    assert backend.healthy and not pool.is_down(backend)
+    picked = {pool.select(reserve=True).url for _ in range(3)}
+    assert dead.url in picked
+
+
+def test_concurrent_selects_probe_once(servers):
+    session = CountingSession(delay=0.2)
+    pool = make_pool(servers, session=session, health_interval=60.0)
+    for backend in pool.backends:
+        backend.last_checked = -60.0
+
+    barrier = threading.Barrier(8)
+    selected = []
+
+    def select():
+        barrier.wait()
+        selected.append(pool.select())
+
+    threads = [threading.Thread(target=select) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(selected) == 8
+    assert session.probes == len(servers)
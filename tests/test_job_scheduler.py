@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from job_scheduler import BULK, JobScheduler, QueueFullError
+
+
+@pytest.fixture
+def held():
+    """A one-worker scheduler whose worker is busy until the returned event is set"""
+    scheduler = JobScheduler(workers=1, max_queue=8, name="test")
+    release = threading.Event()
+    blocker = scheduler.submit(release.wait, client_id="blocker")
+    while blocker.started_at is None:
+        time.sleep(0.01)
+    yield scheduler, release
+    release.set()
+
+
+def test_interactive_first_and_clients_take_turns(held):
+    scheduler, release = held
+    ran = []
+
+    def submit(name, client, **kwargs):
+        return scheduler.submit(ran.append, name, client_id=client, **kwargs)
+
+    bulk = submit("bulk", "a", priority=BULK)
+    a1, a2, a3 = submit("a1", "a"), submit("a2", "a"), submit("a3", "a")
+    b1 = submit("b1", "b")
+
+    assert [job.position() for job in (a1, b1, a2, a3, bulk)] == [1, 2, 3, 4, 5]
+    release.set()
+    bulk.result(timeout=5)
+    assert ran == ["a1", "b1", "a2", "a3", "bulk"]
+    assert a1.position() == 0
+
+
+def test_full_queue_sheds_newest_bulk_for_interactive(held):
+    scheduler, release = held
+    scheduler.max_queue = 2
+    older = scheduler.submit(time.sleep, 0, priority=BULK)
+    newer = scheduler.submit(time.sleep, 0, priority=BULK)
+
+    with pytest.raises(QueueFullError):
+        scheduler.submit(time.sleep, 0, priority=BULK)
+    first = scheduler.submit(time.sleep, 0)
+    with pytest.raises(QueueFullError, match="Displaced"):
+        newer.result(timeout=1)
+    second = scheduler.submit(time.sleep, 0)
+    with pytest.raises(QueueFullError, match="Displaced"):
+        older.result(timeout=1)
+    # No bulk job left to displace
+    with pytest.raises(QueueFullError, match="queue is full"):
+        scheduler.submit(time.sleep, 0)
+    assert scheduler.stats()["shed"] == 4
+    assert scheduler.stats()["queued"] == {"interactive": 2, "bulk": 0}
+
+    release.set()
+    first.result(timeout=5)
+    second.result(timeout=5)
+
+
+def test_identical_requests_share_a_job_until_all_cancel(held):
+    scheduler, release = held
+    job = scheduler.submit(str.upper, "pony", key="k")
+    assert scheduler.submit(str.upper, "pony", key="k") is job
+    assert job.subscribers == 2 and scheduler.stats()["coalesced"] == 1
+
+    # One subscriber leaving keeps the job queued for the other
+    assert not scheduler.cancel(job)
+    assert job.subscribers == 1 and job.position() == 1
+    assert scheduler.cancel(job)
+    assert job.future.cancelled() and job.position() == 0
+
+    again = scheduler.submit(str.upper, "pony", key="k")
+    assert again is not job
+    release.set()
+    assert again.result(timeout=5) == "PONY"
+
+
+def test_async_jobs_hold_no_worker():
+    scheduler = JobScheduler(workers=1, max_queue=16, name="test")
+
+    async def job(value):
+        await asyncio.sleep(0.2)
+        return value
+
+    start = time.monotonic()
+    jobs = [scheduler.submit(job, i, client_id=f"c{i}") for i in range(8)]
+    assert [j.result(timeout=5) for j in jobs] == list(range(8))
+    # One worker, eight overlapping sleeps
+    assert time.monotonic() - start < 1.0
+
+
+def test_async_generator_progress_and_result():
+    scheduler = JobScheduler(workers=1, name="test")
+
+    async def job():
+        for step in range(3):
+            await asyncio.sleep(0.01)
+            yield step
+
+    assert scheduler.submit(job).result(timeout=5) == 2
+
+
+def test_max_running_bounds_jobs_in_flight():
+    scheduler = JobScheduler(workers=1, max_queue=16, name="test", max_running=2)
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    async def job():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    jobs = [scheduler.submit(job, client_id=f"c{i}") for i in range(6)]
+    for j in jobs:
+        j.result(timeout=5)
+    assert peak[0] == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_cancel_running_async_job():
+    scheduler = JobScheduler(workers=1, name="test")
+    cleaned = threading.Event()
+
+    async def job():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            cleaned.set()
+
+    running = scheduler.submit(job)
+    while running.started_at is None:
+        time.sleep(0.01)
+    assert scheduler.cancel(running)
+    with pytest.raises(Exception):
+        running.result(timeout=5)
+    assert cleaned.wait(5)
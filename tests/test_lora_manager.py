@@ -0,0 +1,90 @@
+import torch
+from diffusers import StableDiffusionXLPipeline
+from peft import LoraConfig
+from peft.utils import get_peft_model_state_dict
+
+from bench.tiny_sdxl import build_tiny_sdxl
+from lora_manager import LoraManager
+from model_manifest import ModelFile
+
+# Adapters on disjoint layers, so a stale active adapter shows up in layers the requested one does not touch
+ADAPTER_TARGETS = {"x": ["to_q"], "y": ["to_v"]}
+
+
+def build_pipe():
+    pipe = build_tiny_sdxl(seed=0)
+    for name, targets in ADAPTER_TARGETS.items():
+        pipe.unet.add_adapter(LoraConfig(r=4, lora_alpha=4, target_modules=targets), adapter_name=name)
+    # PEFT initialises lora_B to zero, which would make every adapter a no-op
+    generator = torch.Generator().manual_seed(1)
+    with torch.no_grad():
+        for param_name, param in pipe.unet.named_parameters():
+            if "lora_B" in param_name:
+                param.copy_(torch.randn(param.shape, generator=generator) * 0.5)
+    return pipe
+
+
+def manager(fused: bool):
+    pipe = build_pipe()
+    loras = LoraManager(pipe, fused=fused)
+    loras.adapters = list(ADAPTER_TARGETS)
+    return pipe, loras
+
+
+def latents(pipe) -> torch.Tensor:
+    return pipe(prompt="a pony", width=64, height=64, num_inference_steps=2, guidance_scale=5.0,
+                generator=torch.Generator().manual_seed(3), output_type="latent").images
+
+
+def test_fused_cache_hit_matches_peft():
+    reference_pipe, reference = manager(fused=False)
+    reference.activate({"x": 1.0})
+    expected = latents(reference_pipe)
+
+    pipe, loras = manager(fused=True)
+    loras.activate({"x": 1.0})
+    first = latents(pipe)
+    loras.activate({"y": 0.7})
+    loras.activate({"x": 1.0})
+    assert loras.hits == 1
+    again = latents(pipe)
+
+    assert torch.allclose(first, expected, atol=1e-4)
+    assert torch.allclose(again, expected, atol=1e-4)
+
+
+def test_fused_switch_to_no_lora_restores_base():
+    base_pipe = build_pipe()
+    base_pipe.disable_lora()
+    expected = latents(base_pipe)
+
+    pipe, loras = manager(fused=True)
+    loras.activate({"x": 1.0, "y": 0.5})
+    loras.activate({})
+    assert torch.allclose(latents(pipe), expected, atol=1e-5)
+
+
+def test_registered_loras_load_on_first_use(tmp_path):
+    reference_pipe, reference = manager(fused=False)
+    reference.activate({"x": 1.0})
+    expected = latents(reference_pipe)
+    StableDiffusionXLPipeline.save_lora_weights(
+        str(tmp_path), unet_lora_layers=get_peft_model_state_dict(reference_pipe.unet, adapter_name="x"))
+
+    fetched = []
+
+    def fetch(entry: ModelFile) -> str:
+        fetched.append(entry.adapter_name)
+        return str(tmp_path / "pytorch_lora_weights.safetensors")
+
+    pipe = build_tiny_sdxl(seed=0)
+    loras = LoraManager(pipe, fused=True)
+    loras.register_manifest(fetch, [ModelFile("x.safetensors", "lora"), ModelFile("y.safetensors", "lora")])
+    loras.activate({})
+    assert fetched == [] and loras.adapters == []
+
+    loras.activate({"x": 1.0})
+    loras.activate({"x": 0.5})
+    assert fetched == ["x"] and loras.adapters == ["x"]
+    loras.activate({"x": 1.0})
+    assert torch.allclose(latents(pipe), expected, atol=1e-4)
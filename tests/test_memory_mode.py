@@ -0,0 +1,89 @@
+import pytest
+
+import memory_mode
+from bench.tiny_sdxl import build_tiny_sdxl
+from memory_mode import MEMORY_HEADROOM, MemoryManager
+
+WIDTH = HEIGHT = 128
+BATCH = 2
+
+
+@pytest.fixture(scope="module")
+def pipe():
+    return build_tiny_sdxl(seed=0)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Free memory reported to the manager, set by the test"""
+    free = [0]
+    monkeypatch.setattr(memory_mode, "available_memory", lambda device: free[0])
+    # The tiny UNet is as wide as its VAE, keep its share small so the decode decides the level like on SDXL
+    monkeypatch.setattr(memory_mode, "UNET_LIVE_TENSORS", 1)
+    return free
+
+
+@pytest.fixture
+def calls(pipe, monkeypatch):
+    """Names of the VAE and attention switches the manager calls"""
+    made = []
+
+    def recorded(name, switch):
+        def call(*args, **kwargs):
+            made.append(name)
+            return switch(*args, **kwargs)
+        return call
+
+    for target, names in ((pipe.vae, ("enable_slicing", "disable_slicing", "enable_tiling", "disable_tiling")),
+                          (pipe, ("enable_attention_slicing", "disable_attention_slicing"))):
+        for name in names:
+            monkeypatch.setattr(target, name, recorded(name, getattr(target, name)))
+    return made
+
+
+def test_shrinking_budget_steps_through_levels(pipe, budget):
+    memory = MemoryManager(pipe, mode="auto", offload="0", tile_size=32)
+    estimates = {level: memory.estimate(WIDTH, HEIGHT, BATCH, level) for level in memory.levels()}
+    assert estimates["full"] > estimates["vae_slicing"] > estimates["vae_tiling"]
+
+    for level in ("full", "vae_slicing", "vae_tiling"):
+        budget[0] = int(estimates[level] / MEMORY_HEADROOM) + 1
+        plan = memory.plan(WIDTH, HEIGHT, BATCH)
+        assert plan.level == level and plan.fits
+
+    # Nothing fits: the deepest level, flagged as over budget
+    budget[0] = 1
+    plan = memory.plan(WIDTH, HEIGHT, BATCH)
+    assert plan.level == "vae_tiling" and not plan.fits
+
+
+def test_apply_only_toggles_what_changed(pipe, budget, calls):
+    memory = MemoryManager(pipe, mode="auto", offload="0", tile_size=32)
+    estimates = {level: memory.estimate(WIDTH, HEIGHT, BATCH, level) for level in memory.levels()}
+
+    def prepare(level):
+        budget[0] = int(estimates[level] / MEMORY_HEADROOM) + 1
+        calls.clear()
+        assert memory.prepare(WIDTH, HEIGHT, BATCH).level == level
+        return list(calls)
+
+    assert prepare("vae_tiling") == ["enable_slicing", "enable_tiling"]
+    assert prepare("vae_tiling") == []
+    assert prepare("vae_slicing") == ["disable_tiling"]
+    assert prepare("full") == ["disable_slicing"]
+    assert not pipe.vae.use_slicing and not pipe.vae.use_tiling
+
+
+def test_forced_level_is_kept_whatever_the_budget(pipe, budget, calls):
+    memory = MemoryManager(pipe, mode="attention_slicing", offload="0", tile_size=32)
+    for free in (1, 1 << 40):
+        budget[0] = free
+        assert memory.plan(WIDTH, HEIGHT, BATCH).level == "attention_slicing"
+
+    memory.apply(memory.plan(WIDTH, HEIGHT, BATCH))
+    assert calls == ["enable_slicing", "enable_tiling", "enable_attention_slicing"]
+    memory.apply(memory_mode.MemoryPlan("full", False, 0, 0))
+    assert not pipe.vae.use_slicing and not pipe.vae.use_tiling
+
+    with pytest.raises(ValueError, match="Unknown memory mode"):
+        MemoryManager(pipe, mode="fastest")
@@ -0,0 +1,46 @@
+import pytest
+
+from metrics import Counter, Histogram, Registry
+
+
+def samples(registry: Registry) -> dict:
+    """{sample name with labels: value} of a registry's exposition"""
+    lines = [line for line in registry.render().splitlines() if line and not line.startswith("#")]
+    return dict(line.rsplit(" ", 1) for line in lines)
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram("pony_test_seconds", "Test latency", ["stage"], buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.labels(stage="decode").observe(value)
+
+    assert samples(registry) == {
+        'pony_test_seconds_bucket{stage="decode",le="0.1"}': "2",
+        'pony_test_seconds_bucket{stage="decode",le="1"}': "3",
+        'pony_test_seconds_bucket{stage="decode",le="+Inf"}': "4",
+        'pony_test_seconds_sum{stage="decode"}': "3.65",
+        'pony_test_seconds_count{stage="decode"}': "4",
+    }
+    assert histogram.totals() == {("decode",): (3.65, 4)}
+    assert "# TYPE pony_test_seconds histogram" in registry.render()
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = Counter("pony_test_requests", "Test requests", ["outcome"], registry=registry)
+    counter.labels(outcome='say "hi"\\now\nthen').inc(2)
+
+    assert samples(registry) == {'pony_test_requests_total{outcome="say \\"hi\\"\\\\now\\nthen"}': "2"}
+
+
+def test_registry_rejects_duplicates_and_wrong_labels():
+    registry = Registry()
+    counter = Counter("pony_test_requests", "Test requests", ["outcome"], registry=registry)
+    with pytest.raises(ValueError, match="already registered"):
+        Histogram("pony_test_requests", "Same name", registry=registry)
+    # Another registry has its own names
+    Counter("pony_test_requests", "Test requests", registry=Registry())
+
+    with pytest.raises(ValueError, match="expects labels"):
+        counter.labels(result="ok")
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import pytest
+
+from model_downloader import ModelDownloader, pin_hashes, sha256_file
+from model_manifest import REPO_ID, REVISION, ModelFile, local_path, pinned, read_hashes
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 17)
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """Serves every resolve URL with PAYLOAD, honouring Range like the hub does"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _headers(self, status: int, length: int, extra: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        if self.server.etag:
+            self.send_header("X-Linked-Etag", f'"{self.server.etag}"')
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(PAYLOAD))
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+        if start >= len(PAYLOAD):
+            self._headers(416, 0)
+            return
+        body = PAYLOAD[start:]
+        if start:
+            self._headers(206, len(body), {"Content-Range": f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"})
+        else:
+            self._headers(200, len(body))
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def hub():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), HubHandler)
+    httpd.daemon_threads = True
+    httpd.etag = DIGEST
+    httpd.requests: List = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def downloader(hub, root, **kwargs) -> ModelDownloader:
+    host, port = hub.server_address[:2]
+    return ModelDownloader(str(root), max_workers=2, endpoint=f"http://{host}:{port}", token="", **kwargs)
+
+
+def test_downloads_verifies_and_skips_when_warm(hub, tmp_path):
+    entries = [ModelFile("model.safetensors", "checkpoint", sha256=DIGEST), ModelFile("lora.safetensors", "lora")]
+    results = downloader(hub, tmp_path).download(entries)
+
+    assert results == {"model.safetensors": None, "lora.safetensors": None}
+    for entry in entries:
+        assert sha256_file(local_path(entry, str(tmp_path))) == DIGEST
+    assert {path for path, _ in hub.requests} == {
+        f"/{REPO_ID}/resolve/{REVISION}/model.safetensors", f"/{REPO_ID}/resolve/{REVISION}/lora.safetensors"
+    }
+
+    hub.requests.clear()
+    assert downloader(hub, tmp_path).download(entries) == results
+    assert hub.requests == []
+
+
+def test_resumes_from_part_file(hub, tmp_path):
+    entry = ModelFile("model.safetensors", "checkpoint")
+    path = local_path(entry, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    offset = len(PAYLOAD) // 3
+    with open(path + ".part", "wb") as f:
+        f.write(PAYLOAD[:offset])
+
+    downloader(hub, tmp_path).fetch(entry)
+
+    assert hub.requests == [(f"/{REPO_ID}/resolve/{REVISION}/model.safetensors", f"bytes={offset}-")]
+    assert sha256_file(path) == DIGEST
+    assert not os.path.exists(path + ".part")
+
+
+def test_checksum_mismatch_discards_download(hub, tmp_path):
+    entry = ModelFile("model.safetensors", "checkpoint", sha256="0" * 64)
+    path = local_path(entry, str(tmp_path))
+
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        downloader(hub, tmp_path).fetch(entry)
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+
+
+def test_corrupted_file_is_downloaded_again(hub, tmp_path):
+    entry = ModelFile("model.safetensors", "checkpoint")
+    path = local_path(entry, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"truncated")
+
+    downloader(hub, tmp_path).fetch(entry)
+
+    assert sha256_file(path) == DIGEST
+
+
+def test_refuses_files_without_a_known_hash(hub, tmp_path):
+    hub.etag = None
+    entry = ModelFile("model.safetensors", "checkpoint")
+    path = local_path(entry, str(tmp_path))
+
+    with pytest.raises(Exception, match="No sha256"):
+        downloader(hub, tmp_path).fetch(entry)
+    assert hub.requests == []
+    assert not os.path.exists(path)
+
+    downloader(hub, tmp_path, allow_unverified=True).fetch(entry)
+    assert sha256_file(path) == DIGEST
+
+
+def test_pinned_hash_wins_over_the_hub_etag(hub, tmp_path):
+    entries = [ModelFile("model.safetensors", "checkpoint"), ModelFile("lora.safetensors", "lora")]
+    downloader(hub, tmp_path / "models").download(entries[:1])
+    hashes_file = str(tmp_path / "model_hashes.json")
+    assert pin_hashes(str(tmp_path / "models"), entries, hashes_file) == {"model.safetensors": DIGEST}
+
+    entry, = pinned(entries[:1], read_hashes(hashes_file))
+    assert entry.sha256 == DIGEST
+    # The pin is checked instead of the hub's etag, which would not match
+    hub.etag = "0" * 64
+    assert sha256_file(downloader(hub, tmp_path / "fresh").fetch(entry)) == DIGEST
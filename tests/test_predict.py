@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from bench.tiny_sdxl import build_tiny_sdxl
+from cpu_profile import CpuProfile
+from image_output import OutputPool
+from lora_manager import LoraManager
+from memory_mode import MemoryManager
+from model_manifest import LORAS
+from predict import Predictor
+from prompt_cache import PromptEmbeddingCache
+from result_cache import ResultCache
+from textual_inversion import EmbeddingTable
+
+
+@pytest.fixture(scope="module")
+def predictor(tmp_path_factory):
+    # Set up like bench/e2e.py's PredictBackend: a tiny SDXL with random LoRAs named like the manifest ones
+    adapters = [entry.adapter_name for entry in LORAS]
+    pipe = build_tiny_sdxl(seed=0, lora_adapters=adapters)
+    cpu = CpuProfile(torch.float32, threads=1, interop_threads=1, channels_last=False, compile=False)
+    cpu.apply(pipe)
+
+    predictor = Predictor()
+    predictor.pipe = pipe
+    predictor.loras = LoraManager(pipe, fused=True)
+    predictor.loras.adapters = list(adapters)
+    predictor.adapter_key = ()
+    predictor.prompt_cache = PromptEmbeddingCache()
+    predictor.embeddings = EmbeddingTable()
+    predictor.result_cache = ResultCache(str(tmp_path_factory.mktemp("results")))
+    predictor.encoder = OutputPool(2)
+    predictor.memory = MemoryManager(pipe, mode="auto")
+    predictor.cpu = cpu
+    yield predictor
+    predictor.encoder.shutdown()
+
+
+def predict(predictor: Predictor, seeds: str):
+    paths = predictor.predict(
+        prompt="a pony in a meadow",
+        negative_prompt="blurry",
+        width=64,
+        height=64,
+        num_inference_steps=3,
+        guidance_scale=5.0,
+        seed=None,
+        num_outputs=1,
+        seeds=seeds,
+        lora_weights="",
+        output_format="png",
+        output_quality=90,
+    )
+    return [np.asarray(Image.open(str(path)).convert("RGB"), dtype=np.int16) for path in paths]
+
+
+def test_batched_seed_matches_single_seed_run(predictor):
+    batch = predict(predictor, "11,12,13")
+    assert len(batch) == 3
+
+    for index, seed in enumerate((11, 12, 13)):
+        single, = predict(predictor, str(seed))
+        # Batched matmuls may round differently in the last bit, which can move a pixel by one level
+        assert np.abs(batch[index] - single).max() <= 1
+    assert np.abs(batch[0] - batch[1]).max() > 1
@@ -0,0 +1,30 @@
+import sys
+import time
+
+import pytest
+
+from metrics import STAGE_SECONDS
+from process_supervisor import ProcessExitedError, ProcessSupervisor
+
+
+def test_time_to_ready_is_recorded_as_a_stage():
+    before = STAGE_SECONDS.totals().get(("test_startup",), (0.0, 0))[1]
+    supervisor = ProcessSupervisor([sys.executable, "-c", "import time; time.sleep(30)"], stage="test_startup")
+    supervisor.start()
+    ready_at = time.monotonic() + 0.2
+    try:
+        seconds = supervisor.wait_until_ready(lambda: time.monotonic() >= ready_at, timeout=10)
+    finally:
+        supervisor.stop()
+
+    assert seconds >= 0.2
+    _, count = STAGE_SECONDS.totals()[("test_startup",)]
+    assert count == before + 1
+
+
+def test_exit_before_ready_fails_fast():
+    supervisor = ProcessSupervisor([sys.executable, "-c", "print('boom'); raise SystemExit(3)"], stage="test_crash")
+    supervisor.start()
+    with pytest.raises(ProcessExitedError, match="code 3"):
+        supervisor.wait_until_ready(lambda: False, timeout=10)
+    assert ("test_crash",) not in STAGE_SECONDS.totals()
@@ -0,0 +1,33 @@
+import pytest
+import torch
+
+from bench.tiny_sdxl import build_tiny_sdxl
+from prompt_cache import PromptEmbeddingCache
+
+
+@pytest.fixture(scope="module")
+def pipe():
+    pipe = build_tiny_sdxl(seed=0)
+    pipe.register_to_config(force_zeros_for_empty_prompt=True)
+    return pipe
+
+
+def reference(pipe, negative_prompt):
+    """What the pipeline itself would condition on"""
+    with torch.no_grad():
+        _, negative, _, negative_pooled = pipe.encode_prompt(
+            prompt="a pony", device="cpu", num_images_per_prompt=1,
+            do_classifier_free_guidance=True, negative_prompt=negative_prompt,
+        )
+    return negative, negative_pooled
+
+
+@pytest.mark.parametrize("negative_prompt", [None, "", "blurry"])
+def test_negative_embeddings_match_pipeline(pipe, negative_prompt):
+    embeds = PromptEmbeddingCache().encode(pipe, "a pony", negative_prompt, device="cpu")
+    negative, negative_pooled = reference(pipe, negative_prompt)
+
+    assert torch.allclose(embeds["negative_prompt_embeds"], negative)
+    assert torch.allclose(embeds["negative_pooled_prompt_embeds"], negative_pooled)
+    # Only an omitted negative prompt is zeroed, an empty one is encoded like any other text
+    assert bool(negative.any()) == (negative_prompt is not None)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Textual-inversion embeddings for the diffusers SDXL pipelines
+Loads the manifest embeddings into both tokenizers/text encoders once, so prompts resolve them in memory
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+from safetensors.torch import load_file
+
+from model_manifest import EMBEDDINGS, ModelFile
+
+# ComfyUI prompt syntax, e.g. "embedding:Stable_Yogis_Realism_Positives_V1.safetensors"
+COMFYUI_EMBEDDING = re.compile(r"embedding:([\w.-]+?)(?:\.safetensors|\.pt)?(?=[\s,:)]|$)")
+
+
+def vector_tokens(token: str, count: int) -> List[str]:
+    """One added token per embedding vector: Name, Name__v1, Name__v2, ..."""
+    return [token] + [f"{token}__v{index}" for index in range(1, count)]
+
+
+class EmbeddingTable:
+    """Textual-inversion tokens registered with both SDXL text encoders.
+
+    SDXL embeddings carry one set of vectors per text encoder ("clip_l" for
+    the 768-dim encoder, "clip_g" for the 1280-dim one). Every vector is
+    added to its tokenizer and encoder as its own token, and `resolve`
+    expands a prompt's embedding names into those tokens from a precompiled
+    table. diffusers' own multi-vector expansion is left with nothing to do:
+    it depends on tokenizer.tokenize preserving case, which newer
+    transformers releases no longer do. Nothing is read from disk per request.
+    """
+
+    def __init__(self):
+        self.vectors: Dict[str, int] = {}  # token -> vectors per encoder
+        self.key: Tuple = ()
+        self._expand: Optional[Pattern] = None
+        self._lock = threading.Lock()
+
+    def load(self, pipe, path: str, token: str, version: str = "") -> int:
+        """Register one SDXL embedding file under `token`, returns its vector count"""
+        state = load_file(path)
+        if "clip_l" not in state or "clip_g" not in state:
+            raise ValueError(f"{path} is not an SDXL embedding (expected clip_l and clip_g, got {sorted(state)})")
+        if state["clip_l"].shape[0] != state["clip_g"].shape[0]:
+            raise ValueError(f"{path} has {state['clip_l'].shape[0]} clip_l but {state['clip_g'].shape[0]} clip_g vectors")
+        count = state["clip_l"].shape[0]
+        with self._lock:
+            for vectors, text_encoder, tokenizer in (
+                (state["clip_l"], pipe.text_encoder, pipe.tokenizer),
+                (state["clip_g"], pipe.text_encoder_2, pipe.tokenizer_2),
+            ):
+                pipe.load_textual_inversion(list(vectors), token=vector_tokens(token, count),
+                                            text_encoder=text_encoder, tokenizer=tokenizer)
+            self.vectors[token] = count
+            self.key = self.key + ((token, version or path),)
+            names = sorted(self.vectors, key=len, reverse=True)
+            self._expand = re.compile(r"(?<![\w])(" + "|".join(map(re.escape, names)) + r")(?![\w])")
+        return count
+
+    def load_manifest(self, pipe, fetch: Callable[[ModelFile], str], entries: List[ModelFile] = EMBEDDINGS):
+        """Register every manifest embedding, `fetch` returns the local path of an entry"""
+        for entry in entries:
+            self.load(pipe, fetch(entry), entry.token, entry.sha256 or entry.filename)
+
+    def resolve(self, text: str) -> str:
+        """Expand embedding names (bare or ComfyUI "embedding:Name") into their vector tokens"""
+        if not text or self._expand is None:
+            return text
+        if "embedding:" in text:
+            text = COMFYUI_EMBEDDING.sub(lambda m: m.group(1) if m.group(1) in self.vectors else m.group(0), text)
+        return self._expand.sub(lambda m: " ".join(vector_tokens(m.group(1), self.vectors[m.group(1)])), text)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
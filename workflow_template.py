@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled ComfyUI workflow template for pony generation
+The graph is loaded and its links resolved once, requests only patch inputs
+"""
+
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+from model_manifest import LORAS as MANIFEST_LORAS
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows", "pony_sdxl.json")
+
+DEFAULT_SEED = 3891560175039
+
+# LoRA files in chain order and their default strengths
+LORAS = [entry.filename for entry in MANIFEST_LORAS]
+DEFAULT_LORA_WEIGHTS = [entry.default_weight for entry in MANIFEST_LORAS]
+# Generation records name LoRAs like the diffusers adapters
+ADAPTER_NAMES = {entry.filename: entry.adapter_name for entry in MANIFEST_LORAS}
+
+Link = List[Any]
+
+
+class WorkflowTemplate:
+    """API-format ComfyUI graph with pre-resolved parameter slots.
+
+    On load the sampler, text encoders, latent, decoder and output nodes are
+    located from the graph's links, as is every input wired to the
+    checkpoint's MODEL and CLIP outputs. A build then only copies each node's
+    input dict, writes the request parameters into their slots and splices a
+    LoraLoader chain between the checkpoint and those consumers. LoRAs with a
+    weight of 0.0 are left out so ComfyUI never loads or patches them.
+    """
+
+    def __init__(self, graph: Dict[str, Dict[str, Any]], loras: Optional[List[str]] = None):
+        self.graph = graph
+        self.loras = list(loras if loras is not None else LORAS)
+
+        self.checkpoint = self._find("CheckpointLoaderSimple")
+        self.sampler = self._find("KSampler")
+        sampler_inputs = graph[self.sampler]["inputs"]
+        self.positive = sampler_inputs["positive"][0]
+        self.negative = sampler_inputs["negative"][0]
+        self.latent = sampler_inputs["latent_image"][0]
+        self.decoder = self._find("VAEDecode")
+        self.output_node = self._find("SaveImage")
+
+        self.slots: Dict[str, Tuple[str, str]] = {
+            "checkpoint": (self.checkpoint, "ckpt_name"),
+            "prompt": (self.positive, "text"),
+            "negative_prompt": (self.negative, "text"),
+            "width": (self.latent, "width"),
+            "height": (self.latent, "height"),
+            "batch_size": (self.latent, "batch_size"),
+            "seed": (self.sampler, "seed"),
+            "steps": (self.sampler, "steps"),
+            "cfg": (self.sampler, "cfg"),
+        }
+        self.model_consumers = self._consumers_of([self.checkpoint, 0])
+        self.clip_consumers = self._consumers_of([self.checkpoint, 1])
+        self._next_id = max(int(node_id) for node_id in graph if node_id.isdigit()) + 1
+
+    @classmethod
+    def load(cls, path: str = TEMPLATE_PATH, loras: Optional[List[str]] = None) -> "WorkflowTemplate":
+        """Load an API-format workflow JSON file"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), loras)
+
+    def _find(self, class_type: str) -> str:
+        for node_id, node in self.graph.items():
+            if node["class_type"] == class_type:
+                return node_id
+        raise ValueError(f"Workflow template has no {class_type} node")
+
+    def _consumers_of(self, link: Link) -> List[Tuple[str, str]]:
+        return [
+            (node_id, name)
+            for node_id, node in self.graph.items()
+            for name, value in node["inputs"].items()
+            if value == link
+        ]
+
+    def lora_chain(self, lora_weights: Optional[List[float]]) -> List[Tuple[str, float]]:
+        """LoRAs to apply, in chain order, with zero-weight entries dropped"""
+        if lora_weights is None:
+            lora_weights = DEFAULT_LORA_WEIGHTS
+        if len(lora_weights) > len(self.loras):
+            raise ValueError(f"Got {len(lora_weights)} LoRA weights for {len(self.loras)} LoRAs")
+        return [(name, float(weight)) for name, weight in zip(self.loras, lora_weights) if weight != 0.0]
+
+    def build(self,
+              prompt: str,
+              negative_prompt: str = "",
+              width: int = 1024,
+              height: int = 1024,
+              steps: int = 18,
+              cfg: float = 7.0,
+              seed: Optional[int] = None,
+              lora_weights: Optional[List[float]] = None,
+              batch_size: int = 1) -> Dict[str, Any]:
+        """Build a fresh workflow dict for one request"""
+        workflow = {
+            node_id: {"class_type": node["class_type"], "inputs": dict(node["inputs"])}
+            for node_id, node in self.graph.items()
+        }
+
+        values = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "width": width,
+            "height": height,
+            "batch_size": batch_size,
+            "seed": DEFAULT_SEED if seed is None else seed,
+            "steps": steps,
+            "cfg": cfg,
+        }
+        for name, value in values.items():
+            node_id, input_name = self.slots[name]
+            workflow[node_id]["inputs"][input_name] = value
+
+        model: Link = [self.checkpoint, 0]
+        clip: Link = [self.checkpoint, 1]
+        for index, (lora_name, weight) in enumerate(self.lora_chain(lora_weights)):
+            node_id = f"lora_{index}"
+            workflow[node_id] = {
+                "class_type": "LoraLoader",
+                "inputs": {
+                    "model": model,
+                    "clip": clip,
+                    "lora_name": lora_name,
+                    "strength_model": weight,
+                    "strength_clip": weight
+                }
+            }
+            model, clip = [node_id, 0], [node_id, 1]
+
+        for node_id, input_name in self.model_consumers:
+            workflow[node_id]["inputs"][input_name] = model
+        for node_id, input_name in self.clip_consumers:
+            workflow[node_id]["inputs"][input_name] = clip
+
+        return workflow
+
+    def parameters(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
+        """Request parameters read back from a built workflow, named like the diffusers backends"""
+        values = {name: workflow[node_id]["inputs"].get(input_name) for name, (node_id, input_name) in self.slots.items()}
+        return {
+            "checkpoint": values["checkpoint"],
+            "prompt": values["prompt"],
+            "negative_prompt": values["negative_prompt"],
+            "seed": values["seed"],
+            "width": values["width"],
+            "height": values["height"],
+            "steps": values["steps"],
+            "guidance_scale": values["cfg"],
+            "loras": {
+                ADAPTER_NAMES.get(node["inputs"]["lora_name"], node["inputs"]["lora_name"]): node["inputs"]["strength_model"]
+                for node in workflow.values()
+                if node["class_type"] == "LoraLoader"
+            },
+        }
+
+    def build_batch(self,
+                    prompts: List[str],
+                    seeds: List[int],
+                    negative_prompt: str = "",
+                    width: int = 1024,
+                    height: int = 1024,
+                    steps: int = 18,
+                    cfg: float = 7.0,
+                    lora_weights: Optional[List[float]] = None,
+                    per_seed: bool = True) -> Dict[str, Any]:
+        """Fold several prompt/seed pairs into one workflow
+
+        The checkpoint, LoRA chain, negative prompt and empty latent are shared,
+        each distinct prompt is encoded once, and every seed gets its own
+        KSampler/VAEDecode branch so each image matches a single run with that
+        seed. The decoded images are joined with ImageBatch into the output node.
+        ComfyUI runs those branches one after another. Without `per_seed` (one
+        prompt only) a single KSampler denoises a batch_size latent in one pass
+        instead, but the noise of the whole batch then comes from seeds[0], so
+        no image matches a single run.
+        """
+        if len(prompts) != len(seeds) or not seeds:
+            raise ValueError("prompts and seeds must be non-empty and of equal length")
+        if not per_seed:
+            if len(set(prompts)) != 1:
+                raise ValueError("a latent batch shares one prompt, use per_seed for several")
+            return self.build(
+                prompt=prompts[0],
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                steps=steps,
+                cfg=cfg,
+                seed=seeds[0],
+                lora_weights=lora_weights,
+                batch_size=len(seeds)
+            )
+
+        workflow = self.build(
+            prompt=prompts[0],
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            cfg=cfg,
+            seed=seeds[0],
+            lora_weights=lora_weights
+        )
+        next_id = self._next_id
+
+        def add_node(node: Dict[str, Any]) -> str:
+            nonlocal next_id
+            node_id = str(next_id)
+            workflow[node_id] = node
+            next_id += 1
+            return node_id
+
+        clip = workflow[self.positive]["inputs"]["clip"]
+        encoded = {prompts[0]: self.positive}
+        decoded = [self.decoder]
+        for prompt, seed in zip(prompts[1:], seeds[1:]):
+            if prompt not in encoded:
+                encoded[prompt] = add_node({
+                    "class_type": "CLIPTextEncode",
+                    "inputs": {"text": prompt, "clip": clip}
+                })
+            sampler = add_node({
+                "class_type": "KSampler",
+                "inputs": dict(workflow[self.sampler]["inputs"], seed=seed, positive=[encoded[prompt], 0])
+            })
+            decoded.append(add_node({
+                "class_type": "VAEDecode",
+                "inputs": dict(workflow[self.decoder]["inputs"], samples=[sampler, 0])
+            }))
+
+        images = decoded[0]
+        for image in decoded[1:]:
+            images = add_node({
+                "class_type": "ImageBatch",
+                "inputs": {"image1": [images, 0], "image2": [image, 0]}
+            })
+        workflow[self.output_node]["inputs"]["images"] = [images, 0]
+
+        return workflow
+
+
+@lru_cache(maxsize=None)
+def get_template(path: str = TEMPLATE_PATH) -> WorkflowTemplate:
+    """Load a workflow template once per process"""
+    return WorkflowTemplate.load(path)